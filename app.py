@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 import motor
@@ -6,11 +7,17 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 
 
+import bot
+import metrics
 from config import config
+from events import MongoBackend, event_log
+from leaderboards import MongoLeaderboardStore, leaderboards
 
-from models import Game, Player
+from models import GamePlayed, User
 from routes import api_router
-from ws import ws_router
+from snapshots import snapshots
+from users import MongoUserStore, history, users
+from ws import manager, ws_router
 
 
 @asynccontextmanager
@@ -19,11 +26,44 @@ async def lifespan(app: FastAPI):
         config.mongo_dsn
     )
 
-    # await init_beanie(client.beanie_db, document_models=[Game, Player])
+    await init_beanie(client[config.mongo_db], document_models=[User, GamePlayed])
+    users.store = MongoUserStore()
+    users.size = config.user_cache_size
+    users.ttl = config.user_cache_ttl
+    users.flush_interval = config.user_flush_interval
+    history.backend = MongoBackend(GamePlayed.get_motor_collection())
+    event_log.backend = MongoBackend(client[config.mongo_db].game_events)
+    event_log.batch_size = config.event_log_batch_size
+    event_log.flush_interval = config.event_log_flush_interval
+    asyncio.create_task(event_log.backend.setup())
+    leaderboards.size = config.leaderboard_size
+    leaderboards.live = config.shard_workers == 1
+    await leaderboards.load(MongoLeaderboardStore())
+    leaderboards.start(MongoLeaderboardStore(), config.leaderboard_refresh)
+    # one file per worker: each holds only its own tables
+    snapshots.path = f"{config.snapshot_path}.{config.shard_worker_id}"
+    snapshots.interval = config.snapshot_interval
+    for game in await snapshots.restore(manager, manager.lobby.bot, event_log, manager.lobby.on_finish):
+        await manager.adopt(game)
+    snapshots.start()
+    metrics.event_logger.rate = config.event_sample_rate
+    metrics.monitor.interval = config.loop_lag_interval
+    metrics.monitor.start()
+    if config.webhook_url:
+        await bot.setup_webhook()
 
     # Load the ML model
     yield
     # Clean up the ML models and release the resources
+    metrics.monitor.stop()
+    leaderboards.stop()
+    await bot.shutdown()
+    await snapshots.stop()
+    if manager.lobby.bot is not None:
+        manager.lobby.bot.shutdown()
+    await event_log.close()
+    await users.close()
+    await history.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -31,4 +71,5 @@ app.mount("/assets", StaticFiles(directory="static/assets"), name="static")
 
 app.include_router(api_router)
 app.include_router(ws_router)
+app.include_router(bot.telegram_router)
 
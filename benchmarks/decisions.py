@@ -0,0 +1,86 @@
+import argparse
+import asyncio
+import random
+import time
+
+import numpy as np
+
+from bots import greedy_move, heuristic
+from cards import SUIT, deal, iter_cards, sample
+from decisions import BatchedBot, evaluate
+from engine import NullNotifier, VirtualClock
+from models import Game, Player
+
+# Bot decision throughput: the greedy policy called once per decision
+# against the same policy evaluated in NumPy batches, first on random
+# positions and then end to end with many bot-only tables sharing a service.
+
+
+def positions(count: int, seed: int = 0) -> list[tuple[int, list[int], bool]]:
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        hands = deal(rng)
+        hand = sample(hands[0], rng.randint(1, 13), rng)
+        table = [rng.choice(list(iter_cards(hands[1])))] if rng.random() < 0.75 else []
+        rows.append((hand, table, rng.random() < 0.5))
+    return rows
+
+
+def per_decision(rows) -> float:
+    started = time.process_time()
+    for hand, table, opened in rows:
+        greedy_move(hand, table, opened)
+    return (time.process_time() - started) / len(rows) * 1e6
+
+
+def batched(rows, size: int) -> float:
+    started = time.process_time()
+    for i in range(0, len(rows), size):
+        chunk = rows[i : i + size]
+        evaluate(
+            np.array([hand for hand, _, _ in chunk], dtype=np.uint64),
+            np.array([SUIT[table[0]] if table else -1 for _, table, _ in chunk]),
+            np.array([opened for _, _, opened in chunk]),
+        ).tolist()
+    return (time.process_time() - started) / len(rows) * 1e6
+
+
+async def tables(count: int, bot) -> tuple[float, int]:
+    async def play():
+        game = Game().bind(NullNotifier(), clock, bot)
+        for _ in range(4):
+            await game.submit("join", player=Player.get_bot())
+        await game.submit("start")
+        return game
+
+    clock = VirtualClock()
+    started = time.process_time()
+    games = await asyncio.gather(*(play() for _ in range(count)))
+    # every card of every round was one bot decision
+    decisions = sum(g.round_number for g in games) * 52
+    return (time.process_time() - started) / decisions * 1e6, decisions
+
+
+def run(count: int, games: int):
+    rows = positions(count)
+    print(f"greedy per call     {per_decision(rows):7.2f} µs/decision")
+    for size in (16, 256, 4096):
+        print(f"numpy batch {size:<6}  {batched(rows, size):7.2f} µs/decision")
+    for name, bot in (("heuristic", heuristic), ("batched", BatchedBot(window=0))):
+        cost, decisions = asyncio.run(tables(games, bot))
+        print(f"{games} tables {name:10} {cost:7.2f} µs/decision end to end ({decisions} decisions)")
+        if isinstance(bot, BatchedBot):
+            print(f"  {bot.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot decisions per second, one by one and batched")
+    parser.add_argument("-n", "--positions", type=int, default=100_000)
+    parser.add_argument("-g", "--games", type=int, default=200, help="bot-only tables played at once")
+    args = parser.parse_args()
+    run(args.positions, args.games)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from fastapi import FastAPI
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed
+
+from cards import BIT, NAMES, iter_cards, legal_moves, parse, to_mask
+
+# Synthetic players against /ws/{telegram_id} on a uvicorn worker. Each
+# client speaks the JSON protocol like the web client: it tracks its seat,
+# hand and the trick on the table from the patches, passes three cards,
+# plays a legal card when it is its turn, votes to start if its table is
+# slow to fill and now and then chats. When a game ends it reconnects and
+# is seated again.
+#
+# The latency of an event is measured from the moment a client sends the
+# move to the moment each client at the table receives the "played" patch
+# for it. Server CPU is read from /proc for the worker started here, or
+# for --pid when pointed at a running server with --url.
+
+
+def server() -> FastAPI:
+    # the game routes without the Mongo lifespan: users and the event log
+    # stay in memory, so only the table and socket code is measured
+    from routes import api_router
+    from ws import ws_router
+
+    app = FastAPI()
+    app.include_router(api_router)
+    app.include_router(ws_router)
+    return app
+
+
+def cpu_seconds(pid: int) -> float | None:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    # utime and stime, fields 14 and 15 of the whole line
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summary(values: list[float]) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.5) * 1e3, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1e3, 3),
+        "max_ms": round(values[-1] * 1e3, 3) if values else 0.0,
+    }
+
+
+class Stats:
+    def __init__(self):
+        self.measuring = False
+        self.sent: dict[tuple[str, str], float] = {}
+        self.latency: list[float] = []
+        self.own: list[float] = []
+        self.received = 0
+        self.sent_messages = 0
+        self.events = Counter()
+        self.errors = Counter()
+        self.games = 0
+        self.tables: dict[str, list[float]] = {}
+
+    def table_seconds(self, start: float, end: float) -> float:
+        total = 0.0
+        for began, ended in self.tables.values():
+            total += max(0.0, min(ended or end, end) - max(began, start))
+        return total
+
+
+class Client:
+    def __init__(self, url: str, telegram_id: int, stats: Stats, args: argparse.Namespace, rng: random.Random):
+        self.url = url
+        self.telegram_id = telegram_id
+        self.stats = stats
+        self.args = args
+        self.rng = rng
+        self.reset()
+
+    def reset(self):
+        self.game = ""
+        self.seat = 0
+        self.hand = 0
+        self.table: list[int] = []
+        self.score_opened = False
+        self.started = False
+        self.passing = False
+        # between the last trick of a round and the next "round" patch the
+        # new hand has arrived but the seats have not been rotated yet
+        self.dealing = False
+        self.moved = -1
+
+    async def run(self, deadline: float):
+        while time.monotonic() < deadline:
+            self.reset()
+            try:
+                async with connect(f"{self.url}/ws/{self.telegram_id}", max_queue=None) as ws:
+                    await self.play(ws, deadline)
+            except (ConnectionClosed, OSError) as e:
+                self.stats.errors[type(e).__name__] += 1
+                await asyncio.sleep(1)
+
+    async def send(self, ws, event: str, **data):
+        self.stats.sent_messages += self.stats.measuring
+        await ws.send(json.dumps({"event": event, **data}))
+
+    async def play(self, ws, deadline: float):
+        vote = asyncio.get_running_loop().call_later(self.args.vote_after, lambda: asyncio.ensure_future(self.vote(ws)))
+        try:
+            while True:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), timeout)
+                except asyncio.TimeoutError:
+                    return
+                received = time.perf_counter()
+                message = json.loads(raw)
+                if "error" in message:
+                    self.stats.errors[message["error"]] += 1
+                    continue
+                if self.stats.measuring:
+                    self.stats.received += 1
+                    self.stats.events[message["event"]] += 1
+                if await self.handle(ws, message["event"], message["data"], received):
+                    return
+        finally:
+            vote.cancel()
+
+    async def vote(self, ws):
+        if not self.started:
+            try:
+                await self.send(ws, "vote_to_start")
+            except ConnectionClosed:
+                pass
+
+    async def handle(self, ws, event: str, data: dict, received: float) -> bool:
+        match event:
+            case "state":
+                self.game = data["id"]
+                self.seat = next(i for i, p in enumerate(data["players"]) if p["telegram_id"] == self.telegram_id)
+                self.table = [parse(card) for card in data["table"]]
+                self.score_opened = data["score_opened"]
+                self.started = bool(data["started_at"])
+                self.passing = data["waiting_for_pass"]
+            case "joined":
+                pass
+            case "left":
+                # seats only shift before the start; the next state has them
+                if not self.started:
+                    await self.send(ws, "sync")
+            case "started":
+                self.started = True
+                self.dealing = True
+                self.stats.tables.setdefault(self.game, [time.monotonic(), 0.0])
+            case "hand":
+                self.hand = to_mask(data["hand"])
+            case "round":
+                self.seat = (self.seat - data["seat"]) % 4
+                self.table = []
+                self.score_opened = False
+                self.dealing = False
+                self.passing = data["waiting_for_pass"]
+            case "waiting_pass":
+                await asyncio.sleep(self.think())
+                cards = self.rng.sample(list(iter_cards(self.hand)), 3)
+                await self.send(ws, "pass_cards", cards=[NAMES[c] for c in cards])
+            case "got":
+                # the hand after the pass follows
+                self.passing = False
+                self.hand = 0
+            case "played":
+                card = parse(data["card"])
+                self.table.append(card)
+                sent = self.stats.sent.get((self.game, data["card"]))
+                if sent is not None and self.stats.measuring:
+                    self.stats.latency.append(received - sent)
+                    if data["seat"] == self.seat:
+                        self.stats.own.append(received - sent)
+                if data["seat"] == self.seat:
+                    self.hand &= ~BIT[card]
+            case "trick":
+                self.seat = (self.seat - data["seat"]) % 4
+                self.table = []
+                self.score_opened = data["score_opened"]
+                self.dealing = not self.hand
+                if self.rng.random() < self.args.chat:
+                    await self.send(ws, "message", message="gg")
+            case "game_over":
+                self.stats.games += self.stats.measuring
+                if table := self.stats.tables.get(self.game):
+                    table[1] = time.monotonic()
+                return True
+        if self.started and not self.dealing and not self.passing and self.hand and len(self.table) == self.seat and self.moved != self.hand:
+            # one move per hand, whatever else arrives before the played patch
+            self.moved = self.hand
+            await asyncio.sleep(self.think())
+            moves = legal_moves(self.hand, self.table, self.score_opened)
+            card = NAMES[self.rng.choice(list(iter_cards(moves)))]
+            self.stats.sent[(self.game, card)] = time.perf_counter()
+            await self.send(ws, "player_move", card=card)
+        return False
+
+    def think(self) -> float:
+        return self.rng.uniform(0, 2 * self.args.think) if self.args.think else 0.0
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_for(host: str, port: int, seconds: float = 30.0):
+    deadline = time.monotonic() + seconds
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+async def run(args: argparse.Namespace) -> dict:
+    process = None
+    url, pid = args.url, args.pid
+    if not url:
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", args.app, "--factory", "--port", str(port), "--log-level", "warning"],
+            env={**os.environ, "PYTHONPATH": os.getcwd()},
+        )
+        url, pid = f"ws://127.0.0.1:{port}", process.pid
+        await wait_for("127.0.0.1", port)
+    stats = Stats()
+    rng = random.Random(args.seed)
+    try:
+        deadline = time.monotonic() + args.ramp + args.warmup + args.duration
+        clients = [Client(url, args.base_id + i, stats, args, random.Random(rng.random())) for i in range(args.clients)]
+        tasks = []
+        for i, client in enumerate(clients):
+            tasks.append(asyncio.create_task(client.run(deadline)))
+            if args.ramp:
+                await asyncio.sleep(args.ramp / args.clients)
+        await asyncio.sleep(args.warmup)
+        stats.measuring = True
+        cpu_start, client_start = cpu_seconds(pid) if pid else None, time.process_time()
+        start = time.monotonic()
+        await asyncio.sleep(max(0.0, deadline - start))
+        end = time.monotonic()
+        cpu_end, client_end = cpu_seconds(pid) if pid else None, time.process_time()
+        stats.measuring = False
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    elapsed = end - start
+    table_seconds = stats.table_seconds(start, end)
+    server_cpu = cpu_end - cpu_start if cpu_start is not None and cpu_end is not None else None
+    return {
+        "commit": commit(),
+        "clients": args.clients,
+        "seconds": round(elapsed, 2),
+        "tables": round(table_seconds / elapsed, 1),
+        "games_finished": stats.games,
+        "latency": summary(stats.latency),
+        "move_latency": summary(stats.own),
+        "messages_received_per_second": round(stats.received / elapsed, 1),
+        "messages_sent_per_second": round(stats.sent_messages / elapsed, 1),
+        "server_cpu_seconds": None if server_cpu is None else round(server_cpu, 2),
+        "server_cpu_ms_per_table_second": (
+            round(server_cpu / table_seconds * 1e3, 3) if server_cpu is not None and table_seconds else None
+        ),
+        "client_cpu_seconds": round(client_end - client_start, 2),
+        "events": dict(stats.events.most_common()),
+        "errors": dict(stats.errors.most_common()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket load generator and end-to-end latency benchmark")
+    parser.add_argument("-c", "--clients", type=int, default=400)
+    parser.add_argument("-d", "--duration", type=float, default=30.0, help="seconds measured")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which clients connect")
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--think", type=float, default=0.2, help="mean seconds before a move or pass")
+    parser.add_argument("--vote-after", type=float, default=10.0, help="vote to start if not started by then")
+    parser.add_argument("--chat", type=float, default=0.02, help="chance of a chat message per trick")
+    parser.add_argument("--url", help="a running server, e.g. ws://127.0.0.1:8080; started here if not given")
+    parser.add_argument("--pid", type=int, help="the running server's pid, for its CPU time")
+    parser.add_argument("--app", default="benchmarks.load:server", help="uvicorn app factory to start")
+    parser.add_argument("--base-id", type=int, default=10**9)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+    for k, v in results.items():
+        print(f"{k}: {v}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
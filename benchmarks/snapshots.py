@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from engine import NullNotifier, ReplayClock
+from models import Game, Player, games_by_player
+from replay import run as step
+from snapshots import Snapshotter, decode, encode
+
+# Table snapshot cost: tables are dealt with one human and three bots and
+# played to a random point, then encoded, written, read back and restored.
+
+
+def midgame(rng: random.Random) -> Game:
+    game = Game().bind(NullNotifier(), ReplayClock())
+    game._endgame_tricks = 0
+    game.players.append(Player(telegram_id=rng.getrandbits(40), display_name="human"))
+    for _ in range(3):
+        game.players.append(Player.get_bot())
+    step(game.start())
+    for _ in range(rng.randrange(40)):
+        if game.ended_at:
+            break
+        if game.waiting_for_pass:
+            step(game.on_pass_timeout(game.round_number))
+        else:
+            step(game.auto_move())
+    return game
+
+
+async def restore(snapshotter: Snapshotter) -> float:
+    started = time.perf_counter()
+    games = await snapshotter.restore(NullNotifier())
+    # the resumes are queued on every table; let them run
+    await asyncio.gather(*(g._runner for g in games))
+    return time.perf_counter() - started
+
+
+def run(count: int, seed: int):
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    tables = [midgame(rng) for _ in range(count)]
+    print(f"built {count} tables in {time.perf_counter() - started:.1f}s")
+    for game in tables:
+        games_by_player[next(p for p in game.players if not p.is_bot).telegram_id] = game
+
+    started = time.perf_counter()
+    records = [encode(game) for game in tables]
+    elapsed = time.perf_counter() - started
+    print(f"encode            {elapsed / count * 1e6:8.2f} µs/table  {sum(map(len, records)) / count:6.0f} bytes/table")
+    started = time.perf_counter()
+    for record in records:
+        decode(record)
+    print(f"decode            {(time.perf_counter() - started) / count * 1e6:8.2f} µs/table")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tables.snapshot")
+        snapshotter = Snapshotter(path)
+        asyncio.run(snapshotter.save())
+        print(f"first save        {snapshotter.encode_seconds * 1e3:8.2f} ms encoding  {snapshotter.write_seconds * 1e3:8.2f} ms writing")
+        asyncio.run(snapshotter.save())
+        print(f"unchanged save    {snapshotter.encode_seconds * 1e3:8.2f} ms encoding  {snapshotter.write_seconds * 1e3:8.2f} ms writing")
+        games_by_player.clear()
+        print(f"restore {count} tables {asyncio.run(restore(Snapshotter(path))) * 1e3:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Table snapshot encode, write and restore cost")
+    parser.add_argument("-n", "--tables", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run(args.tables, args.seed)
+
+
+if __name__ == "__main__":
+    main()
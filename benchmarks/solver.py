@@ -0,0 +1,61 @@
+import argparse
+import random
+import time
+
+from bots import greedy_move
+from cards import BIT, deal, points, trick_winner
+from solver import Position, Solver
+
+# Endgame solver cost by depth: random deals are played greedily down to
+# the given number of tricks per hand, then solved exactly from there.
+
+
+def endgame(rng: random.Random, tricks: int) -> Position:
+    hands = deal(rng)
+    leader, table, opened, scores = 0, [], False, [0] * 4
+    for _ in range((13 - tricks) * 4):
+        seat = (leader + len(table)) % 4
+        card = greedy_move(hands[seat], table, opened)
+        hands[seat] &= ~BIT[card]
+        table.append(card)
+        if len(table) == 4:
+            taken = points(sum(BIT[c] for c in table))
+            leader = (leader + trick_winner(table)) % 4
+            scores[leader] += taken
+            opened = opened or taken > 0
+            table = []
+    return Position(tuple(hands), (), leader, opened, tuple(scores))
+
+
+def run(depths: int, positions: int, seed: int):
+    rng = random.Random(seed)
+    for tricks in range(1, depths + 1):
+        solver = Solver()
+        nodes = entries = 0
+        elapsed = 0.0
+        for _ in range(positions):
+            position = endgame(rng, tricks)
+            solver.nodes = 0
+            started = time.perf_counter()
+            solver.best_move(position)
+            elapsed += time.perf_counter() - started
+            nodes += solver.nodes
+            entries += len(solver.transpositions)
+        print(
+            f"{tricks:2} tricks  {elapsed / positions * 1e3:9.2f} ms/solve  "
+            f"{nodes / positions:10.0f} nodes  {nodes / elapsed:9.0f} nodes/s  "
+            f"{entries / positions:9.0f} tt entries"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Endgame solver nodes/s and solve time by tricks left")
+    parser.add_argument("-d", "--depth", type=int, default=5, help="deepest endgame, in tricks per hand")
+    parser.add_argument("-n", "--positions", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run(args.depth, args.positions, args.seed)
+
+
+if __name__ == "__main__":
+    main()
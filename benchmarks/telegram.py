@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import time
+from collections import Counter, defaultdict
+
+import httpx
+from aiohttp import web
+from fastapi import FastAPI
+
+import bot
+from config import config
+
+# An onboarding spike against a fake Bot API that enforces Telegram's flood
+# limits: a global rate and one message a second per chat, answered with
+# 429 and retry_after past them. Every user sends /start, some of them
+# twice, through the webhook. "inline" is what the handler used to do,
+# awaiting set_chat_menu_button and the reply for every message; "outbox"
+# queues them through bot.outbox and bot.menus. The outbox tests run
+# against the same fake, with errors queued per chat.
+
+
+class FakeBotAPI:
+    def __init__(self, rate: int = 30, chat_interval: float = 1.0, latency: float = 0.02, retry_after: int = 1):
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self.latency = latency
+        self.retry_after = retry_after
+        self.window: list[float] = []
+        self.last: dict[str, float] = {}
+        self.calls = Counter()
+        self.limited = 0
+        self.delivered: set[str] = set()
+        # every request as it arrives, and status codes to answer a chat with
+        self.requests: list[tuple[float, str, dict]] = []
+        self.errors: dict[str, list[int]] = defaultdict(list)
+
+    def flooded(self, chat_id: str | None, message: bool) -> bool:
+        now = time.monotonic()
+        self.window = [t for t in self.window if now - t < 1.0]
+        if len(self.window) >= self.rate:
+            return True
+        if message and now - self.last.get(chat_id, -1e9) < self.chat_interval:
+            return True
+        self.window.append(now)
+        if message:
+            self.last[chat_id] = now
+        return False
+
+    def error(self, status: int) -> web.Response:
+        if status == 429:
+            description = f"Too Many Requests: retry after {self.retry_after}"
+            body = {"ok": False, "error_code": 429, "description": description, "parameters": {"retry_after": self.retry_after}}
+        else:
+            body = {"ok": False, "error_code": status, "description": "Bad Request: chat not found"}
+        return web.json_response(body, status=status)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        chat_id = data.get("chat_id")
+        self.calls[method] += 1
+        self.requests.append((time.monotonic(), method, dict(data)))
+        await asyncio.sleep(self.latency)
+        if errors := self.errors.get(chat_id):
+            return self.error(errors.pop(0))
+        if self.flooded(chat_id, method.startswith("send")):
+            self.limited += 1
+            return self.error(429)
+        match method:
+            case "sendMessage":
+                self.delivered.add(chat_id)
+                result = {
+                    "message_id": sum(self.calls.values()),
+                    "date": int(time.time()),
+                    "chat": {"id": int(chat_id), "type": "private"},
+                    "text": data.get("text"),
+                }
+            case _:
+                result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", port)
+        await site.start()
+        return f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def update(i: int, chat_id: int) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": f"u{chat_id}"}
+    return {
+        "update_id": i,
+        "message": {"message_id": i, "date": 0, "chat": {"id": chat_id, "type": "private"}, "from": user, "text": "/start"},
+    }
+
+
+async def inline(message):
+    # the handler as it was: both calls awaited, nothing retried
+    aa = "telegram_id=" + str(message.from_user.id)
+    info = bot.types.WebAppInfo(url=f"{config.webapp_url}/?{aa}")
+    await message.bot.set_chat_menu_button(chat_id=message.chat.id, menu_button=bot.types.MenuButtonWebApp(text="zz", web_app=info))
+    await message.reply("yo")
+
+
+async def run(mode: str, users: int, repeat: float, timeout: float) -> dict:
+    fake = FakeBotAPI()
+    config.telegram_api_url = await fake.start()
+    config.bot_token = "123456:fake"
+    config.webhook_secret = "fake"
+    bot.bot = bot.create_bot()
+    outbox = bot.outbox = bot.Outbox(config.telegram_rate, config.telegram_chat_interval, config.telegram_concurrency)
+    bot.menus = bot.MenuButtons(outbox)
+    handlers = list(bot.dp.message.handlers)
+    if mode == "inline":
+        bot.dp.message.handlers.clear()
+        bot.dp.message.register(inline)
+    else:
+        outbox.start(bot.bot)
+    app = FastAPI()
+    app.include_router(bot.telegram_router)
+    updates = [update(i, 1000 + i) for i in range(users)]
+    updates += [update(users + i, 1000 + i) for i in range(int(users * repeat))]
+    failed = 0
+    started = time.perf_counter()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as client:
+
+        async def post(body: dict):
+            nonlocal failed
+            response = await client.post(
+                "/telegram/webhook", json=body, headers={"X-Telegram-Bot-Api-Secret-Token": config.webhook_secret}
+            )
+            failed += response.status_code != 200
+
+        await asyncio.gather(*(post(u) for u in updates), return_exceptions=True)
+    answered = time.perf_counter() - started
+    while len(fake.delivered) < users and time.perf_counter() - started < timeout:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    await outbox.close(0)
+    await bot.bot.session.close()
+    await fake.stop()
+    bot.dp.message.handlers[:] = handlers
+    return {
+        "mode": mode,
+        "updates": len(updates),
+        "webhook_seconds": round(answered, 2),
+        "webhook_errors": failed,
+        "users_answered": len(fake.delivered),
+        "seconds_to_answer_all": round(elapsed, 2),
+        "calls": dict(fake.calls),
+        "flood_limited": fake.limited,
+        **({"outbox": outbox.stats(), "menu_skipped": bot.menus.skipped} if mode == "outbox" else {}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Onboarding spike against a fake, flood-limited Bot API")
+    parser.add_argument("-n", "--users", type=int, default=200)
+    parser.add_argument("--repeat", type=float, default=0.5, help="share of users who send /start twice")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--mode", choices=["inline", "outbox", "both"], default="both")
+    args = parser.parse_args()
+    for mode in ("inline", "outbox") if args.mode == "both" else (args.mode,):
+        for k, v in asyncio.run(run(mode, args.users, args.repeat, args.timeout)).items():
+            print(f"{k}: {v}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import random
+import time
+
+from users import MemoryUserStore, UserCache
+
+# Connect-time user lookups against a store with a fixed round-trip time.
+# "direct" is what User.get_or_create did: a find, then a write of the
+# fields given. "cached" goes through UserCache with writes behind.
+
+
+class SlowStore(MemoryUserStore):
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.round_trips = 0
+
+    async def load(self, telegram_id: int):
+        self.round_trips += 1
+        await asyncio.sleep(self.latency)
+        return await super().load(telegram_id)
+
+    async def apply(self, updates: dict[int, dict]):
+        self.round_trips += 1
+        await asyncio.sleep(self.latency)
+        await super().apply(updates)
+
+
+async def direct(store: SlowStore, telegram_id: int):
+    await store.load(telegram_id)
+    await store.apply({telegram_id: {"$set": {"display_name": f"u{telegram_id}"}}})
+
+
+async def run(connects: int, users: int, latency: float, burst: int) -> None:
+    rng = random.Random(0)
+    # half the connects come from a few regulars reconnecting, as after a
+    # network blip; the rest from anybody
+    ids = [
+        int(rng.paretovariate(1.2)) % users if rng.random() < 0.5 else rng.randrange(users) for _ in range(connects)
+    ]
+    for name in ("direct", "cached"):
+        store = SlowStore(latency)
+        cache = UserCache(store, flush_interval=0.05)
+        waits = []
+
+        async def connect(telegram_id: int):
+            started = time.perf_counter()
+            if name == "direct":
+                await direct(store, telegram_id)
+            else:
+                await cache.get(telegram_id, display_name=f"u{telegram_id}")
+            waits.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for i in range(0, connects, burst):
+            await asyncio.gather(*(connect(t) for t in ids[i : i + burst]))
+        await cache.close()
+        elapsed = time.perf_counter() - started
+        waits.sort()
+        print(
+            f"{name:7} {sum(waits) / len(waits) * 1e3:7.2f} ms avg  {waits[len(waits) * 99 // 100] * 1e3:7.2f} ms p99  "
+            f"{store.round_trips / connects:5.2f} round trips/connect  {elapsed:6.2f}s"
+        )
+        if name == "cached":
+            print(f"        {cache.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Connect latency with and without the user cache")
+    parser.add_argument("-n", "--connects", type=int, default=20_000)
+    parser.add_argument("-u", "--users", type=int, default=5_000)
+    parser.add_argument("-l", "--latency", type=float, default=0.002, help="store round trip, seconds")
+    parser.add_argument("-b", "--burst", type=int, default=500, help="connects arriving at once")
+    args = parser.parse_args()
+    asyncio.run(run(args.connects, args.users, args.latency, args.burst))
+
+
+if __name__ == "__main__":
+    main()
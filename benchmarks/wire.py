@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+
+import wire
+from engine import RecordingNotifier, VirtualClock
+from models import Game, Player
+
+# Bytes and encode time per event, JSON against the MessagePack protocol,
+# over the notifications of whole games with one human seat.
+
+
+async def notifications(games: int) -> list:
+    events = []
+    for _ in range(games):
+        notifier = RecordingNotifier()
+        game = Game().bind(notifier, VirtualClock())
+        human = Player(telegram_id=1, display_name="human", auto_move=True)
+        await game.submit("join", player=human)
+        for _ in range(3):
+            await game.submit("join", player=Player.get_bot())
+        await game.submit("start")
+        await game.sync(human)
+        events += [(game, n) for _, n in notifier.events if n.event in wire.CODES and n.event != "state"]
+        # state is cached by version, so encode it while the version is current
+        game.touch()
+        events.append((game, next(n for _, n in reversed(notifier.events) if n.event == "state")))
+    return events
+
+
+def run(games: int):
+    events = asyncio.run(notifications(games))
+    sizes = defaultdict(lambda: [0, 0, 0])
+    elapsed = [0.0, 0.0]
+    for game, n in events:
+        started = time.perf_counter()
+        text = n.model_dump_json(exclude_none=True)
+        middle = time.perf_counter()
+        binary = wire.encode(game, n)
+        elapsed[0] += middle - started
+        elapsed[1] += time.perf_counter() - middle
+        entry = sizes[n.event]
+        entry[0] += 1
+        entry[1] += len(text)
+        entry[2] += len(binary)
+    print(f"{'event':16} {'count':>7} {'json B':>8} {'msgpack B':>10}")
+    for event, (count, text, binary) in sorted(sizes.items(), key=lambda kv: -kv[1][1]):
+        print(f"{event:16} {count:7} {text / count:8.1f} {binary / count:10.1f}")
+    total_text = sum(s[1] for s in sizes.values())
+    total_binary = sum(s[2] for s in sizes.values())
+    print(f"bytes per game   json {total_text // games}  msgpack {total_binary // games}")
+    print(f"encode per event json {elapsed[0] / len(events) * 1e6:.2f} µs  msgpack {elapsed[1] / len(events) * 1e6:.2f} µs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wire size and encode time, JSON against MessagePack")
+    parser.add_argument("-n", "--games", type=int, default=20)
+    args = parser.parse_args()
+    run(args.games)
+
+
+if __name__ == "__main__":
+    main()
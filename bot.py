@@ -1,44 +1,93 @@
 import asyncio
-import json
+import hmac
 import logging
-import os
 import urllib.parse
 
-import hmac
-import hashlib
-
 from aiogram import Bot, Dispatcher, types
-from aiogram.methods import Request
-from aiogram.types import InlineQueryResultArticle, InputTextMessageContent, ReplyKeyboardMarkup
-from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
-from aiogram.utils.web_app import safe_parse_webapp_init_data
-from aiohttp.web_response import json_response
-from beanie.odm.actions import wrap_with_actions
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from fastapi import APIRouter, Header, HTTPException, Request
+from starlette import status
 
 from config import config
+from outbox import MenuButtons, Outbox
 
-logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
-bot = Bot(config.bot_token)
 dp = Dispatcher()
+outbox = Outbox(config.telegram_rate, config.telegram_chat_interval, config.telegram_concurrency)
+menus = MenuButtons(outbox)
+bot: Bot | None = None
+telegram_router = APIRouter()
+
+
+def create_bot() -> Bot:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(config.telegram_api_url)) if config.telegram_api_url else None
+    return Bot(config.bot_token, session=session)
+
 
 @dp.message()
 async def start(message: types.Message):
+    # nothing here waits on Telegram: the replies go through the outbox
     data = {'telegram_id': str(message.from_user.id)}
     data['key'] = hmac.new(config.secret_key.encode(), data['telegram_id'].encode(), 'sha256').hexdigest()
 
     aa=urllib.parse.urlencode(data)
 
-    print(f"https://04e9-94-29-26-16.ngrok-free.app/?{aa}")
-    webAppInfo = types.WebAppInfo(url=f"https://2219-94-29-26-16.ngrok-free.app/?{aa}")
-    await bot.set_chat_menu_button(message.chat.id, types.MenuButtonWebApp(text='zz', web_app=webAppInfo))
+    webAppInfo = types.WebAppInfo(url=f"{config.webapp_url}/?{aa}")
+    menus.set(message.chat.id, types.MenuButtonWebApp(text='zz', web_app=webAppInfo))
+
+    outbox.send(message.chat.id, message.reply('yo'))
+
 
-    await message.reply('yo')
+@telegram_router.post("/telegram/webhook")
+async def webhook(request: Request, x_telegram_bot_api_secret_token: str = Header("")):
+    if bot is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND)
+    if not config.webhook_secret or not hmac.compare_digest(x_telegram_bot_api_secret_token, config.webhook_secret):
+        raise HTTPException(status.HTTP_403_FORBIDDEN)
+    update = types.Update.model_validate(await request.json(), context={"bot": bot})
+    await dp.feed_update(bot, update)
+    return {"ok": True}
+
+
+@telegram_router.get("/telegram/stats")
+async def telegram_stats():
+    return {**outbox.stats(), "menu_buttons": len(menus.buttons), "menu_skipped": menus.skipped}
+
+
+async def setup_webhook() -> Bot:
+    global bot
+    if not config.webhook_secret:
+        # without one anybody could post updates as Telegram
+        raise RuntimeError("webhook_secret must be set to serve the bot from a webhook")
+    bot = create_bot()
+    outbox.start(bot)
+    await bot.set_webhook(
+        f"{config.webhook_url}/telegram/webhook",
+        secret_token=config.webhook_secret,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    return bot
+
+
+async def shutdown():
+    await outbox.close()
+    if bot is not None:
+        await bot.session.close()
 
 
 async def main():
+    # long polling, for running the bot on its own
+    global bot
+    logging.basicConfig(level=logging.INFO)
+    bot = create_bot()
+    outbox.start(bot)
     await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
-    
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await shutdown()
+
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,219 @@
+import asyncio
+import multiprocessing
+import random
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import NamedTuple, Protocol, TYPE_CHECKING
+
+from cards import (
+    BIT,
+    FULL_DECK,
+    HEARTS,
+    INDEX,
+    PENALTY,
+    QUEEN_OF_SPADES,
+    RANK,
+    SPADES,
+    SUIT,
+    SUIT_MASKS,
+    highest,
+    iter_cards,
+    legal_moves,
+    lowest,
+    points,
+    trick_winner,
+)
+
+if TYPE_CHECKING:
+    from models import Game, Player
+
+# the spades that can be stuck with the queen
+HIGH_SPADES = QUEEN_OF_SPADES | BIT[INDEX["ks"]] | BIT[INDEX["as"]]
+
+
+def greedy_move(hand: int, table: list[int], score_opened: bool) -> int:
+    legal = legal_moves(hand, table, score_opened)
+    if not table:
+        return lowest(legal & ~PENALTY or legal & ~QUEEN_OF_SPADES or legal)
+    if legal & SUIT_MASKS[SUIT[table[0]]]:
+        return (legal & -legal).bit_length() - 1
+    if legal & QUEEN_OF_SPADES:
+        return QUEEN_OF_SPADES.bit_length() - 1
+    return highest(legal & PENALTY or legal)
+
+
+def greedy_pass(hand: int, count: int) -> int:
+    # Dump the high spades unless enough low ones guard them, then hearts
+    # and high cards, shortest suits first so that voids open up.
+    guarded = (hand & SPADES & ~HIGH_SPADES).bit_count() >= 4
+    lengths = [(hand & mask).bit_count() for mask in SUIT_MASKS]
+
+    def danger(card: int) -> tuple:
+        return (
+            not guarded and bool(BIT[card] & HIGH_SPADES),
+            bool(BIT[card] & HEARTS) and RANK[card] >= 8,
+            RANK[card] - lengths[SUIT[card]],
+        )
+
+    chosen = sorted(iter_cards(hand), key=danger, reverse=True)[:count]
+    return sum(BIT[card] for card in chosen)
+
+
+class Bot(Protocol):
+    async def choose_move(self, game: "Game") -> int: ...
+
+    def choose_pass(self, player: "Player", count: int) -> int: ...
+
+
+class HeuristicBot:
+    async def choose_move(self, game: "Game") -> int:
+        return game.choose_move()
+
+    def choose_pass(self, player: "Player", count: int) -> int:
+        return greedy_pass(player.hand, count)
+
+    def shutdown(self):
+        pass
+
+
+class Observation(NamedTuple):
+    # What the seat to move can see. Seats are numbered from the leader of
+    # the current trick, so the observer sits at len(table).
+    hand: int
+    table: tuple[int, ...]
+    played: int
+    score_opened: bool
+    sizes: tuple[int, ...]
+    voids: tuple[int, ...]
+    points: tuple[int, ...]
+
+    @classmethod
+    def from_game(cls, game: "Game") -> "Observation":
+        return cls(
+            hand=game.players[len(game.table)].hand,
+            table=tuple(game.table),
+            played=game.played,
+            score_opened=game.score_opened,
+            sizes=tuple(p.hand.bit_count() for p in game.players),
+            voids=tuple(p.voids for p in game.players),
+            points=tuple(p.scores[-1] for p in game.players),
+        )
+
+
+def determinize(obs: Observation, rng: random.Random) -> list[int] | None:
+    # Deal the unseen cards to the other seats, keeping their hand sizes and
+    # the suits they have shown to be void in.
+    me = len(obs.table)
+    unseen = list(iter_cards(FULL_DECK & ~obs.played & ~obs.hand))
+    rng.shuffle(unseen)
+    hands = [0] * 4
+    hands[me] = obs.hand
+    need = [0 if seat == me else obs.sizes[seat] for seat in range(4)]
+    for card in unseen:
+        seats = [s for s in range(4) if need[s] and not obs.voids[s] & BIT[card]]
+        if not seats:
+            return None
+        seat = rng.choice(seats)
+        hands[seat] |= BIT[card]
+        need[seat] -= 1
+    return hands
+
+
+def rollout(obs: Observation, hands: list[int], move: int) -> float:
+    # Play the round out greedily for everybody and score it from the
+    # observer's side: its points against the average of the others.
+    me = len(obs.table)
+    hands = hands.copy()
+    table = list(obs.table)
+    scores = list(obs.points)
+    opened = obs.score_opened
+    leader = 0
+    card = move
+    while True:
+        turn = (leader + len(table)) % 4
+        hands[turn] &= ~BIT[card]
+        table.append(card)
+        if len(table) == 4:
+            trick = points(sum(BIT[c] for c in table))
+            opened = opened or trick > 0
+            leader = (leader + trick_winner(table)) % 4
+            scores[leader] += trick
+            table = []
+            if not hands[leader]:
+                break
+        turn = (leader + len(table)) % 4
+        card = greedy_move(hands[turn], table, opened)
+    if 26 in scores:
+        scores = [0 if s == 26 else 26 for s in scores]
+    return scores[me] - (sum(scores) - scores[me]) / 3
+
+
+def search(obs: Observation, budget: float, seed: int) -> tuple[int, int]:
+    # Flat determinized Monte Carlo: every legal move is tried against the
+    # same sampled deals until the budget runs out, the lowest average wins.
+    moves = list(iter_cards(legal_moves(obs.hand, list(obs.table), obs.score_opened)))
+    if len(moves) == 1:
+        return moves[0], 0
+    rng = random.Random(seed)
+    totals = dict.fromkeys(moves, 0.0)
+    deadline = time.monotonic() + budget
+    runs = 0
+    while time.monotonic() < deadline:
+        if (hands := determinize(obs, rng)) is None:
+            continue
+        for move in moves:
+            totals[move] += rollout(obs, hands, move)
+        runs += 1
+    if not runs:
+        return greedy_move(obs.hand, list(obs.table), obs.score_opened), 0
+    return min(moves, key=totals.__getitem__), runs
+
+
+class MonteCarloBot(HeuristicBot):
+    # Searches in a process pool so that the event loop keeps serving other
+    # tables; a move that is not back within the budget is played greedily.
+    def __init__(self, budget: float = 0.2, workers: int = 2, executor: Executor | None = None):
+        self.budget = budget
+        self.workers = workers
+        self._executor = executor
+        self.searches = 0
+        self.simulations = 0
+        self.fallbacks = 0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def choose_move(self, game: "Game") -> int:
+        obs = Observation.from_game(game)
+        loop = asyncio.get_running_loop()
+        try:
+            move, runs = await asyncio.wait_for(
+                loop.run_in_executor(self.executor, search, obs, self.budget, random.getrandbits(32)),
+                # the search stops itself at the budget, this only covers a
+                # pool that is too busy to start it in time
+                self.budget * 2,
+            )
+        except Exception:
+            self.fallbacks += 1
+            return game.choose_move()
+        self.searches += 1
+        self.simulations += runs
+        return move
+
+    def stats(self) -> dict:
+        return {
+            "searches": self.searches,
+            "simulations_per_search": round(self.simulations / self.searches, 1) if self.searches else 0.0,
+            "fallbacks": self.fallbacks,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+heuristic = HeuristicBot()
@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Mapping, NamedTuple, Sequence
+
+from engine import Clock, NullNotifier, Notifier, VirtualClock
+from models import Game, Player, games_by_player, players
+
+# Multi-table tournaments. Every round seats all entrants at tables of
+# four, Swiss style: the first round at random, later ones in order of
+# their standing, so players meet others with similar totals. Tables of
+# bots only are played headless in worker processes, in chunks sized so
+# every worker stays busy to the end of the round; tables with a human
+# are played on the event loop. Standings are updated as each chunk
+# reports back. Seats left over when entrants don't divide by four go to
+# house bots, which are not ranked. A human seat is given the Player their
+# session holds, by default the one last seated in models.players; a human
+# still playing at another table is sat in for by a bot under their id.
+
+
+class Seat(NamedTuple):
+    telegram_id: int
+    name: str
+    human: bool = False
+
+
+class Table(NamedTuple):
+    number: int
+    seed: int
+    seats: tuple[Seat, ...]
+    max_score: int
+
+
+class Result(NamedTuple):
+    telegram_id: int
+    score: int
+    place: int
+
+
+class Standing:
+    __slots__ = ("seat", "total", "games", "wins", "places")
+
+    def __init__(self, seat: Seat):
+        self.seat = seat
+        self.total = 0
+        self.games = 0
+        self.wins = 0
+        self.places = 0
+
+    def key(self) -> tuple:
+        # fewest points first; wins, then average place break ties
+        return self.total, -self.wins, self.places / self.games if self.games else 0.0, self.seat.telegram_id
+
+    def as_dict(self) -> dict:
+        return {
+            "telegram_id": self.seat.telegram_id,
+            "name": self.seat.name,
+            "total": self.total,
+            "games": self.games,
+            "wins": self.wins,
+            "avg_place": round(self.places / self.games, 2) if self.games else None,
+        }
+
+
+def house(number: int) -> Seat:
+    # negative ids never clash with telegram ids
+    return Seat(-number, f"house {number}")
+
+
+def seat_player(seat: Seat, humans: Mapping[int, Player]) -> Player:
+    busy = (game := games_by_player.get(seat.telegram_id)) is not None and not game.ended_at
+    if seat.human and not busy and (player := humans.get(seat.telegram_id)) is not None:
+        # the player's own object, which their session sends events for
+        player.hand = player.pass_cards = player.voids = 0
+        player.scores = []
+        player.auto_move = False
+        return player
+    # bots, and humans busy elsewhere, stay out of the player maps
+    human = seat.human and not busy
+    return Player(telegram_id=seat.telegram_id, display_name=seat.name, auto_move=not human, is_bot=not human)
+
+
+async def play(
+    table: Table,
+    notifier: Notifier | None = None,
+    clock: Clock | None = None,
+    humans: Mapping[int, Player] | None = None,
+    on_finish: Sequence[Callable[[Game], object]] = (),
+) -> list[Result]:
+    game = Game(seed=table.seed, max_score=table.max_score).bind(
+        notifier or NullNotifier(), clock or VirtualClock(), on_finish=on_finish
+    )
+    # the join queues the start; with a human seated the game outlives any
+    # one command, so wait for it to end
+    await game.submit("join_many", new_players=[seat_player(s, humans or {}) for s in table.seats])
+    await game.ended()
+    return [Result(r["player"].telegram_id, r["score"], r["place"]) for r in game.results]
+
+
+def play_many(tables: list[Table]) -> list[tuple[int, list[Result]]]:
+    # runs in a worker process: headless, so time only moves when asked to
+    async def run():
+        return [(table.number, await play(table)) for table in tables]
+
+    return asyncio.run(run())
+
+
+class Tournament:
+    def __init__(
+        self,
+        seats: list[Seat],
+        rounds: int = 5,
+        max_score: int = 100,
+        workers: int = 1,
+        seed: int | None = None,
+        notifier: Notifier | None = None,
+        clock: Clock | None = None,
+        humans: Mapping[int, Player] = players,
+        on_finish: Sequence[Callable[[Game], object]] = (),
+    ):
+        self.rounds = rounds
+        self.max_score = max_score
+        self.workers = workers
+        self.rng = random.Random(seed)
+        self.notifier = notifier
+        self.clock = clock
+        self.humans = humans
+        self.on_finish = on_finish
+        self.standings = {s.telegram_id: Standing(s) for s in seats}
+        self.round = 0
+        self.tables_played = 0
+        self.round_seconds: list[float] = []
+
+    def seating(self) -> list[Table]:
+        if self.round == 1:
+            order = list(self.standings.values())
+            self.rng.shuffle(order)
+        else:
+            order = self.ranking()
+        seats = [s.seat for s in order]
+        seats += [house(i) for i in range(1, -len(seats) % 4 + 1)]
+        return [
+            Table(self.tables_played + i, self.rng.getrandbits(63), tuple(seats[4 * i : 4 * i + 4]), self.max_score)
+            for i in range(len(seats) // 4)
+        ]
+
+    def ranking(self) -> list[Standing]:
+        return sorted(self.standings.values(), key=Standing.key)
+
+    def report(self, results: list[Result]):
+        for result in results:
+            if (standing := self.standings.get(result.telegram_id)) is None:
+                continue
+            standing.total += result.score
+            standing.games += 1
+            standing.wins += result.place == 1
+            standing.places += result.place
+        self.tables_played += 1
+
+    async def play_round(self, pool: ProcessPoolExecutor | None):
+        self.round += 1
+        started = time.perf_counter()
+        tables = self.seating()
+        local = [t for t in tables if any(s.human for s in t.seats)]
+        headless = [t for t in tables if not any(s.human for s in t.seats)]
+        pending = [asyncio.ensure_future(self.play_local(t)) for t in local]
+        if pool is None:
+            pending += [asyncio.ensure_future(self.play_local(t)) for t in headless]
+        elif headless:
+            # a few chunks per worker, so one slow chunk doesn't idle the rest
+            size = max(1, len(headless) // (self.workers * 4))
+            loop = asyncio.get_running_loop()
+            pending += [
+                loop.run_in_executor(pool, play_many, headless[i : i + size]) for i in range(0, len(headless), size)
+            ]
+        for done in asyncio.as_completed(pending):
+            for _, results in await done:
+                self.report(results)
+        self.round_seconds.append(time.perf_counter() - started)
+
+    async def play_local(self, table: Table) -> list[tuple[int, list[Result]]]:
+        # only tables with a human record results; bot tables are practice
+        on_finish = self.on_finish if any(s.human for s in table.seats) else ()
+        return [(table.number, await play(table, self.notifier, self.clock, self.humans, on_finish))]
+
+    async def run(self) -> list[Standing]:
+        pool = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn")) if self.workers > 1 else None
+        try:
+            while self.round < self.rounds:
+                await self.play_round(pool)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        return self.ranking()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play a multi-table tournament of bots")
+    parser.add_argument("-n", "--players", type=int, default=1000)
+    parser.add_argument("-r", "--rounds", type=int, default=5)
+    parser.add_argument("--max-score", type=int, default=100)
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    seats = [Seat(i, f"bot {i}") for i in range(1, args.players + 1)]
+    tournament = Tournament(seats, args.rounds, args.max_score, args.workers, args.seed)
+    started = time.perf_counter()
+    ranking = asyncio.run(tournament.run())
+    elapsed = time.perf_counter() - started
+    for place, standing in enumerate(ranking[: args.top], 1):
+        print(place, standing.as_dict())
+    print(f"players: {args.players}")
+    print(f"tables: {tournament.tables_played}")
+    print(f"seconds: {elapsed:.1f}")
+    print(f"round_seconds: {[round(s, 1) for s in tournament.round_seconds]}")
+    print(f"tables_per_sec: {tournament.tables_played / elapsed:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import random
+from typing import Iterable, Iterator
+
+# A card is an index 0..51 laid out suit-major in "cdsh" order, so that
+# iterating the bits of a hand from low to high yields it already sorted the
+# way the client displays it. Hands, the table and played-card sets are
+# 52-bit integers with one bit per card.
+
+RANKS = "23456789tjqka"
+SUITS = "cdsh"
+
+NAMES = [r + s for s in SUITS for r in RANKS]
+INDEX = {name: i for i, name in enumerate(NAMES)}
+BIT = [1 << i for i in range(52)]
+RANK = [i % 13 for i in range(52)]
+SUIT = [i // 13 for i in range(52)]
+
+SUIT_MASKS = [((1 << 13) - 1) << (13 * s) for s in range(4)]
+CLUBS, DIAMONDS, SPADES, HEARTS = SUIT_MASKS
+FULL_DECK = (1 << 52) - 1
+
+QUEEN_OF_SPADES = BIT[INDEX["qs"]]
+TWO_OF_CLUBS = BIT[INDEX["2c"]]
+PENALTY = HEARTS | QUEEN_OF_SPADES
+
+SCORE = [13 if BIT[i] == QUEEN_OF_SPADES else 1 if BIT[i] & HEARTS else 0 for i in range(52)]
+
+# Names of the cards in every 13-bit suit pattern, so that a hand is turned
+# into strings with four lookups. Built by doubling: after rank r the first
+# 2**(r+1) entries are complete.
+SUIT_NAMES = []
+for _suit in range(4):
+    _table = [()]
+    for _rank in range(13):
+        _name = NAMES[_suit * 13 + _rank]
+        _table += [cards + (_name,) for cards in _table]
+    SUIT_NAMES.append(_table)
+
+
+def parse(card: str | int) -> int:
+    if isinstance(card, int):
+        if not 0 <= card < 52:
+            raise ValueError("Unknown card")
+        return card
+    try:
+        return INDEX[card.lower()]
+    except (KeyError, AttributeError):
+        raise ValueError("Unknown card")
+
+
+def to_mask(cards: Iterable[str | int]) -> int:
+    mask = 0
+    for card in cards:
+        mask |= BIT[parse(card)]
+    return mask
+
+
+def iter_cards(mask: int) -> Iterator[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def names(mask: int) -> list[str]:
+    clubs, diamonds, spades, hearts = SUIT_NAMES
+    return [
+        *clubs[mask & 0x1FFF],
+        *diamonds[mask >> 13 & 0x1FFF],
+        *spades[mask >> 26 & 0x1FFF],
+        *hearts[mask >> 39],
+    ]
+
+
+def points(mask: int) -> int:
+    return (mask & HEARTS).bit_count() + (13 if mask & QUEEN_OF_SPADES else 0)
+
+
+def lowest(mask: int) -> int:
+    # lowest rank across all suits; ties go to the first suit in "cdsh" order
+    best = -1
+    for suit_mask in SUIT_MASKS:
+        if part := mask & suit_mask:
+            card = (part & -part).bit_length() - 1
+            if best < 0 or RANK[card] < RANK[best]:
+                best = card
+    return best
+
+
+def highest(mask: int) -> int:
+    best = -1
+    for suit_mask in SUIT_MASKS:
+        if part := mask & suit_mask:
+            card = part.bit_length() - 1
+            if best < 0 or RANK[card] >= RANK[best]:
+                best = card
+    return best
+
+
+def legal_moves(hand: int, table: list[int], score_opened: bool) -> int:
+    moves = hand
+    if table and (follow := hand & SUIT_MASKS[SUIT[table[0]]]):
+        moves = follow
+    if not score_opened and (safe := moves & ~PENALTY):
+        moves = safe
+    return moves
+
+
+def trick_winner(table: list[int]) -> int:
+    lead = SUIT_MASKS[SUIT[table[0]]]
+    trick = 0
+    for card in table:
+        trick |= BIT[card]
+    return table.index((trick & lead).bit_length() - 1)
+
+
+def sample(mask: int, k: int, rng: random.Random = random) -> int:
+    return to_mask(rng.sample(list(iter_cards(mask)), k))
+
+
+def deal(rng: random.Random = random) -> list[int]:
+    deck = list(range(52))
+    rng.shuffle(deck)
+    return [to_mask(deck[i * 13 : (i + 1) * 13]) for i in range(4)]
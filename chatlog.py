@@ -0,0 +1,63 @@
+from bisect import bisect_left
+from collections import deque
+from heapq import merge
+
+
+class ChatLog:
+    # The last size messages of a table, numbered from 1 as they come.
+    # Public messages are indexed under None and private ones under both
+    # the sender and the recipient, so the history a player may see is
+    # two index slices merged, never a filter over everything said. The
+    # messages, each index and the number of indexes are all bounded, so a
+    # table's chat takes the same memory however long it runs.
+    def __init__(self, size: int = 200):
+        self.size = size
+        self.messages: deque = deque(maxlen=size)
+        self.index: dict[int | None, deque[int]] = {None: deque(maxlen=size)}
+        self.last = 0
+
+    @property
+    def first(self) -> int:
+        return self.last - len(self.messages) + 1
+
+    def append(self, chat) -> int:
+        self.last += 1
+        chat.id = self.last
+        self.messages.append(chat)
+        if chat.private_to is None:
+            keys = {None}
+        else:
+            keys = {chat.private_to.telegram_id}
+            if chat.player is not None:
+                keys.add(chat.player.telegram_id)
+        for key in keys:
+            if (index := self.index.get(key)) is None:
+                index = self.index[key] = deque(maxlen=self.size)
+            index.append(self.last)
+        if self.last % self.size == 0:
+            self._prune()
+        return self.last
+
+    def _prune(self):
+        # drops the indexes of players whose messages have all rolled off
+        first = self.first
+        for key, index in list(self.index.items()):
+            while index and index[0] < first:
+                index.popleft()
+            if not index and key is not None:
+                del self.index[key]
+
+    def page(self, telegram_id: int | None, before: int | None = None, limit: int = 50) -> list:
+        # the latest limit messages the player may see older than before,
+        # oldest first
+        first = self.first
+        end = self.last + 1 if before is None else min(before, self.last + 1)
+        slices = []
+        for key in {None, telegram_id}:
+            if not (index := self.index.get(key)):
+                continue
+            stop = bisect_left(index, end)
+            start = max(bisect_left(index, first), stop - limit)
+            slices.append([index[i] for i in range(start, stop)])
+        ids = list(merge(*slices))[-limit:]
+        return [self.messages[n - first] for n in ids]
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import SettingsConfigDict, BaseSettings
 
 
@@ -8,6 +10,55 @@ class Settings(BaseSettings):
     mongo_db: str = "beanie_db"
     bot_token: str
     secret_key: str = 'SECRET'
+    send_queue_size: int = 64
+    slow_consumer_policy: Literal["drop", "coalesce", "disconnect"] = "coalesce"
+    lobby_backfill_after: float = 30.0
+    lobby_batch_window: float = 0.05
+    shard_worker_id: int = 0
+    shard_workers: int = 1
+    shard_backend: str = ""
+    shard_base_port: int = 8080
+    shard_url: str = "ws://127.0.0.1:{port}"
+    bot_engine: Literal["heuristic", "montecarlo", "batched"] = "heuristic"
+    bot_move_budget: float = 0.2
+    bot_workers: int = 2
+    bot_batch_window: float = 0.005
+    bot_endgame_tricks: int = 0
+    bot_endgame_samples: int = 8
+    event_log_batch_size: int = 500
+    event_log_flush_interval: float = 1.0
+    snapshot_path: str = "tables.snapshot"
+    snapshot_interval: float = 5.0
+    resume_buffer_size: int = 256
+    resume_grace: float = 30.0
+    user_cache_size: int = 100_000
+    user_cache_ttl: float = 300.0
+    user_flush_interval: float = 1.0
+    event_sample_rate: float = 0.01
+    leaderboard_size: int = 1000
+    leaderboard_refresh: float = 10.0
+    ws_rate: float = 10.0
+    ws_burst: float = 20.0
+    ws_event_limits: dict[str, tuple[float, float]] = {
+        "message": (0.5, 3),
+        "player_move": (4.0, 8),
+        "pass_cards": (2.0, 4),
+        "notify_state": (1.0, 3),
+        "sync": (1.0, 3),
+        "vote_to_start": (1.0, 2),
+        "leave": (1.0, 2),
+    }
+    ws_max_frame: int = 2048
+    ws_max_strikes: int = 50
+    chat_max_length: int = 500
+    webapp_url: str = "https://2219-94-29-26-16.ngrok-free.app"
+    webhook_url: str = ""
+    webhook_secret: str = ""
+    telegram_api_url: str = ""
+    telegram_rate: float = 25.0
+    telegram_chat_interval: float = 1.0
+    telegram_concurrency: int = 8
+    loop_lag_interval: float = 0.25
 
     @property
     def mongo_dsn(self):
@@ -0,0 +1,118 @@
+import asyncio
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from bots import HeuristicBot
+from cards import PENALTY, QUEEN_OF_SPADES, RANK, SUIT, SUIT_MASKS
+from engine import Clock, real_clock
+
+if TYPE_CHECKING:
+    from models import Game
+
+# A batch is a column of uint64 hand masks: every row is the 52 columns of
+# a hand packed into one word, so the legal-move and candidate masks below
+# are computed with a handful of bitwise operations over the whole batch.
+SUIT_COLUMN = np.array([*SUIT_MASKS, 0], dtype=np.uint64)  # index -1: nothing led
+PENALTY_BITS = np.uint64(PENALTY)
+QUEEN_BITS = np.uint64(QUEEN_OF_SPADES)
+QUEEN = QUEEN_OF_SPADES.bit_length() - 1
+# greedy_move picks the lowest rank with the first suit winning ties, or the
+# highest rank with the last suit winning ties. Respreading a hand rank-major
+# (bit rank * 4 + suit) turns both into the lowest or highest set bit.
+RANK_MAJOR = np.zeros((4, 1 << 13), dtype=np.uint64)
+for _suit in range(4):
+    for _rank in range(13):
+        # doubling, as for cards.SUIT_NAMES
+        RANK_MAJOR[_suit, 1 << _rank : 2 << _rank] = RANK_MAJOR[_suit, : 1 << _rank] | np.uint64(1 << (_rank * 4 + _suit))
+CARD_AT = np.array(sorted(range(52), key=lambda i: RANK[i] * 4 + SUIT[i]))
+CHUNK = np.uint64(0x1FFF)
+
+
+def rank_major(masks: np.ndarray) -> np.ndarray:
+    return (
+        RANK_MAJOR[0][masks & CHUNK]
+        | RANK_MAJOR[1][masks >> np.uint64(13) & CHUNK]
+        | RANK_MAJOR[2][masks >> np.uint64(26) & CHUNK]
+        | RANK_MAJOR[3][masks >> np.uint64(39)]
+    )
+
+
+def top_bit(masks: np.ndarray) -> np.ndarray:
+    # exact: masks are below 2**52 and fit a double's mantissa
+    return np.frexp(masks.astype(np.float64))[1] - 1
+
+
+def either(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    return np.where(first != 0, first, second)
+
+
+def legal_masks(hands: np.ndarray, leads: np.ndarray, opened: np.ndarray) -> np.ndarray:
+    # legal_moves() for a batch; leads is the suit led, or -1
+    moves = either(hands & SUIT_COLUMN[leads], hands)
+    safe = moves & ~PENALTY_BITS
+    return np.where(~opened & (safe != 0), safe, moves)
+
+
+def evaluate(hands: np.ndarray, leads: np.ndarray, opened: np.ndarray) -> np.ndarray:
+    # The same choice as greedy_move() for every row at once, from hand
+    # masks (uint64), the suit led (-1 when leading) and score_opened.
+    legal = legal_masks(hands, leads, opened)
+    leading = leads < 0
+    following = (legal & SUIT_COLUMN[leads]) != 0
+    queen = ~leading & ~following & ((legal & QUEEN_BITS) != 0)
+    candidates = np.where(
+        leading,
+        either(legal & ~PENALTY_BITS, either(legal & ~QUEEN_BITS, legal)),
+        np.where(following, legal, either(legal & PENALTY_BITS, legal)),
+    )
+    spread = rank_major(candidates)
+    low = top_bit(spread & (~spread + np.uint64(1)))
+    position = np.where(leading | following, low, top_bit(spread))
+    return np.where(queen, QUEEN, CARD_AT[position])
+
+
+class BatchedBot(HeuristicBot):
+    # Bot seats from every table queue their decision here; every window the
+    # queue is evaluated as one NumPy batch and each table gets its move.
+    def __init__(self, window: float = 0.005, clock: Clock = real_clock):
+        self.window = window
+        self.clock = clock
+        self.pending: list[tuple[int, int, bool, asyncio.Future]] = []
+        self.batches = 0
+        self.decisions = 0
+        self._flusher: asyncio.Task | None = None
+
+    def choose_move(self, game: "Game") -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        lead = SUIT[game.table[0]] if game.table else -1
+        self.pending.append((game.players[len(game.table)].hand, lead, game.score_opened, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run())
+        return future
+
+    async def _run(self):
+        while self.pending:
+            await self.clock.sleep(self.window)
+            self.flush()
+
+    def flush(self):
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        hands, leads, opened, futures = zip(*batch)
+        moves = evaluate(
+            np.array(hands, dtype=np.uint64), np.array(leads), np.array(opened)
+        )
+        self.batches += 1
+        self.decisions += len(batch)
+        for future, move in zip(futures, moves.tolist()):
+            if not future.done():
+                future.set_result(move)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "decisions": self.decisions,
+            "avg_batch": round(self.decisions / self.batches, 1) if self.batches else 0.0,
+        }
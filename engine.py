@@ -0,0 +1,101 @@
+import asyncio
+import time
+from typing import Callable, Protocol, TYPE_CHECKING
+
+from timers import Timer, wheel
+
+if TYPE_CHECKING:
+    from models import Game, Notification, Player
+
+
+class Notifier(Protocol):
+    async def notify_player(self, game: "Game", player: "Player", notification: "Notification"): ...
+
+    async def notify_game(self, game: "Game", notification: "Notification"): ...
+
+
+class NullNotifier:
+    async def notify_player(self, game: "Game", player: "Player", notification: "Notification"):
+        pass
+
+    async def notify_game(self, game: "Game", notification: "Notification"):
+        pass
+
+
+class RecordingNotifier:
+    def __init__(self):
+        self.events: list[tuple[int | None, "Notification"]] = []
+
+    async def notify_player(self, game: "Game", player: "Player", notification: "Notification"):
+        self.events.append((player.telegram_id, notification))
+
+    async def notify_game(self, game: "Game", notification: "Notification"):
+        self.events.append((None, notification))
+
+
+class Clock:
+    def now(self) -> float:
+        return time.monotonic()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+    def call_later(self, delay: float, callback: Callable[[], object]) -> Timer:
+        return wheel.call_later(delay, callback)
+
+
+class VirtualClock(Clock):
+    # Time only moves when somebody sleeps, and sleeping just yields to the
+    # event loop, so headless tables run as fast as the CPU allows.
+    def __init__(self, start: float = 0.0):
+        self.time = start
+
+    def now(self) -> float:
+        return self.time
+
+    async def sleep(self, seconds: float):
+        self.time += seconds
+        await asyncio.sleep(0)
+
+    def call_later(self, delay: float, callback: Callable[[], object]) -> "VirtualTimer":
+        return VirtualTimer(self, self.time + delay, callback)
+
+
+class VirtualTimer:
+    # Fires on the next loop iteration, jumping virtual time to its deadline.
+    def __init__(self, clock: VirtualClock, deadline: float, callback: Callable[[], object]):
+        self.clock = clock
+        self.deadline = deadline
+        self.callback = callback
+        self.handle = asyncio.get_running_loop().call_soon(self._fire)
+
+    def _fire(self):
+        self.clock.time = max(self.clock.time, self.deadline)
+        self.callback()
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - self.clock.time)
+
+    def cancel(self):
+        self.handle.cancel()
+
+
+class ReplayClock(VirtualClock):
+    # Never yields and never fires: a replay drives every step itself, so a
+    # game coroutine runs to completion on the first send().
+    async def sleep(self, seconds: float):
+        self.time += seconds
+
+    def call_later(self, delay: float, callback: Callable[[], object]) -> "InertTimer":
+        return InertTimer()
+
+
+class InertTimer:
+    def remaining(self) -> float:
+        return 0.0
+
+    def cancel(self):
+        pass
+
+
+real_clock = Clock()
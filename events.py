@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from typing import Protocol
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+
+class Backend(Protocol):
+    async def insert_many(self, documents: list[dict]): ...
+
+
+class MemoryBackend:
+    def __init__(self):
+        self.documents: list[dict] = []
+
+    async def insert_many(self, documents: list[dict]):
+        self.documents.extend(documents)
+
+
+class MongoBackend:
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def setup(self):
+        try:
+            await self.collection.create_index([("game", 1), ("seq", 1)], unique=True)
+        except Exception:
+            logger.exception("Could not create the event log index")
+
+    async def insert_many(self, documents: list[dict]):
+        # unordered, so one duplicate from a retried batch does not stop the rest
+        try:
+            await self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+
+
+class EventWriter:
+    # Append-only log of game events. append() only puts the event in a
+    # buffer; a writer task flushes it with one insert_many whenever
+    # batch_size events are waiting or flush_interval has passed. A failed
+    # batch goes back to the front of the buffer, and past max_buffer new
+    # events are dropped and counted rather than slowing the tables down.
+    def __init__(
+        self,
+        backend: Backend | None = None,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_buffer: int = 100_000,
+    ):
+        self.backend = backend or MemoryBackend()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.buffer: list[dict] = []
+        self.full = asyncio.Event()
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self.flush_seconds = 0.0
+        self._writer: asyncio.Task | None = None
+
+    def append(self, event: dict):
+        if len(self.buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self.buffer.append(event)
+        if len(self.buffer) >= self.batch_size:
+            self.full.set()
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self.buffer:
+            try:
+                await asyncio.wait_for(self.full.wait(), self.flush_interval)
+            except TimeoutError:
+                pass
+            self.full.clear()
+            if not await self.flush():
+                # the backend is down: keep buffering, try again next interval
+                await asyncio.sleep(self.flush_interval)
+
+    async def flush(self) -> bool:
+        while self.buffer:
+            batch, self.buffer = self.buffer[: self.batch_size], self.buffer[self.batch_size :]
+            started = time.perf_counter()
+            try:
+                await self.backend.insert_many(batch)
+            except asyncio.CancelledError:
+                self.buffer[:0] = batch
+                raise
+            except Exception:
+                logger.exception("Event log flush failed")
+                self.failures += 1
+                self.buffer[:0] = batch
+                return False
+            self.flush_seconds = time.perf_counter() - started
+            self.written += len(batch)
+            self.batches += 1
+        return True
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self.buffer),
+            "written": self.written,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "last_flush_ms": round(self.flush_seconds * 1e3, 2),
+        }
+
+
+event_log = EventWriter()
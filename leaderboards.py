@@ -0,0 +1,215 @@
+import asyncio
+import logging
+from bisect import bisect_left, insort
+from datetime import datetime, time, timedelta
+from typing import Protocol
+
+from beanie.operators import In
+
+from models import Game, GamePlayed, User
+from users import users
+
+logger = logging.getLogger(__name__)
+
+
+class Board:
+    # The top size players by wins, kept sorted as games end. A key only
+    # ever improves (more wins; reaching a count first wins the tie), so a
+    # player who falls out of the top can only come back by winning, which
+    # is when they are looked at again. Pages are built once per change.
+    def __init__(self, name: str, size: int = 1000, period: str = ""):
+        self.name = name
+        self.size = size
+        self.period = period
+        self.entries: list[tuple[int, int, int]] = []
+        self.keys: dict[int, tuple[int, int, int]] = {}
+        self.names: dict[int, str] = {}
+        # wins of those seen since the last prune, for the periodic boards
+        # that count their own
+        self.wins: dict[int, int] = {}
+        self.order = 0
+        self._rows: list[dict] | None = None
+
+    def set(self, telegram_id: int, name: str, wins: int):
+        self.order += 1
+        key = (-wins, self.order, telegram_id)
+        if (old := self.keys.get(telegram_id)) is not None:
+            if old[0] == key[0]:
+                return
+            del self.entries[bisect_left(self.entries, old)]
+        elif len(self.entries) >= self.size and key >= self.entries[-1]:
+            return
+        insort(self.entries, key)
+        self.keys[telegram_id] = key
+        self.names[telegram_id] = name
+        if len(self.entries) > self.size:
+            dropped = self.entries.pop()
+            del self.keys[dropped[2]]
+            del self.names[dropped[2]]
+        self._rows = None
+
+    def add(self, telegram_id: int, name: str, wins: int = 1):
+        self.wins[telegram_id] = total = self.wins.get(telegram_id, 0) + wins
+        self.set(telegram_id, name, total)
+        if len(self.wins) > 2 * self.size:
+            self.prune()
+
+    def prune(self):
+        # Keeps the counts of the top size only. Somebody pruned counts from
+        # zero again until the boards are next loaded from the store.
+        self.wins = {telegram_id: -key[0] for telegram_id, key in self.keys.items()}
+
+    def rows(self) -> list[dict]:
+        if self._rows is None:
+            self._rows = [
+                {"rank": rank, "telegram_id": telegram_id, "name": self.names[telegram_id], "wins": -wins}
+                for rank, (wins, _, telegram_id) in enumerate(self.entries, 1)
+            ]
+        return self._rows
+
+    def page(self, offset: int = 0, limit: int = 50) -> dict:
+        return {
+            "board": self.name,
+            "period": self.period,
+            "total": len(self.entries),
+            "entries": self.rows()[offset : offset + limit],
+        }
+
+
+def periods(when: datetime) -> dict[str, str]:
+    year, week, _ = when.isocalendar()
+    return {"daily": when.date().isoformat(), "weekly": f"{year}-W{week:02d}"}
+
+
+class LeaderboardStore(Protocol):
+    async def top(self, size: int) -> list[tuple[int, str, int]]: ...
+
+    async def wins_since(self, since: datetime, limit: int) -> dict[int, int]: ...
+
+    async def names(self, telegram_ids: list[int]) -> dict[int, str]: ...
+
+
+class MongoLeaderboardStore:
+    async def top(self, size: int) -> list[tuple[int, str, int]]:
+        users = await User.find(User.wins > 0).sort(-User.wins).limit(size).to_list()
+        return [(u.telegram_id, u.display_name or u.username or "", u.wins) for u in users]
+
+    async def wins_since(self, since: datetime, limit: int) -> dict[int, int]:
+        pipeline = [
+            {"$match": {"ended_at": {"$gte": since}, "place": 1}},
+            {"$group": {"_id": "$telegram_id", "wins": {"$sum": 1}}},
+            {"$sort": {"wins": -1}},
+            {"$limit": limit},
+        ]
+        rows = await GamePlayed.get_motor_collection().aggregate(pipeline).to_list(None)
+        return {row["_id"]: row["wins"] for row in rows}
+
+    async def names(self, telegram_ids: list[int]) -> dict[int, str]:
+        users = await User.find(In(User.telegram_id, telegram_ids)).to_list()
+        return {u.telegram_id: u.display_name or u.username or "" for u in users}
+
+
+class Leaderboards:
+    # Global, daily and weekly top-k boards. The counts are persisted by
+    # the writes that are made anyway, the User counters and the
+    # games_played rows, and the boards are loaded from them on startup.
+    # With live set, each game is then applied as it ends: the global board
+    # follows User.wins, the periodic ones count wins themselves and start
+    # over when the period turns. With several workers live is off and the
+    # boards are reloaded every refresh seconds instead, so that every
+    # worker serves the same boards, the ones in the store.
+    def __init__(self, size: int = 1000, live: bool = True):
+        self.size = size
+        self.live = live
+        self.boards = self.empty()
+        self.tasks: set[asyncio.Task] = set()
+        self._refresher: asyncio.Task | None = None
+
+    def empty(self) -> dict[str, Board]:
+        now = periods(datetime.now())
+        return {
+            "global": Board("global", self.size),
+            "daily": Board("daily", self.size, now["daily"]),
+            "weekly": Board("weekly", self.size, now["weekly"]),
+        }
+
+    def roll(self, when: datetime):
+        for name, period in periods(when).items():
+            if self.boards[name].period != period:
+                self.boards[name] = Board(name, self.size, period)
+
+    def record(self, game: Game):
+        # after users.record_game, so the User counters include this game
+        if not self.live:
+            return
+        self.roll(game.ended_at or datetime.now())
+        for result in game.results:
+            player = result["player"]
+            if player.is_bot or result["place"] != 1:
+                continue
+            name = player.display_name or ""
+            if (user := users.cached(player.telegram_id)) is not None:
+                self.boards["global"].set(player.telegram_id, name, user.wins)
+            else:
+                task = asyncio.create_task(self._record_global(player.telegram_id, name))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            self.boards["daily"].add(player.telegram_id, name)
+            self.boards["weekly"].add(player.telegram_id, name)
+
+    async def _record_global(self, telegram_id: int, name: str):
+        # evicted from the cache: read the counter back, with the pending
+        # increment for this game applied
+        try:
+            user = await users.get(telegram_id)
+        except Exception:
+            logger.exception("Could not read the wins of %s", telegram_id)
+            return
+        if user is not None:
+            self.boards["global"].set(telegram_id, name, user.wins)
+
+    async def load(self, store: LeaderboardStore):
+        # built aside and swapped in, so a failed load keeps the old boards
+        boards = self.empty()
+        now = datetime.now()
+        today = datetime.combine(now.date(), time())
+        try:
+            for telegram_id, name, wins in await store.top(self.size):
+                boards["global"].set(telegram_id, name, wins)
+            for board, since in (("daily", today), ("weekly", today - timedelta(days=now.weekday()))):
+                board = boards[board]
+                for telegram_id, wins in (await store.wins_since(since, self.size)).items():
+                    board.add(telegram_id, "", wins)
+                board.names.update(await store.names(list(board.keys)))
+                board._rows = None
+        except Exception:
+            logger.exception("Could not load the leaderboards")
+            return
+        self.boards = boards
+
+    async def _refresh(self, store: LeaderboardStore, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.load(store)
+
+    def start(self, store: LeaderboardStore, interval: float):
+        # live boards are ahead of the store until the write-behind flushes
+        # land, so reloading them would move them backwards
+        if self.live:
+            return
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.create_task(self._refresh(store, interval))
+
+    def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+
+    def page(self, board: str, offset: int = 0, limit: int = 50) -> dict | None:
+        self.roll(datetime.now())
+        if (b := self.boards.get(board)) is None:
+            return None
+        return b.page(offset, limit)
+
+
+leaderboards = Leaderboards()
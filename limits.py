@@ -0,0 +1,53 @@
+import json
+
+import metrics
+from config import config
+from engine import Clock, real_clock
+from models import public_methods
+from ratelimit import TokenBucket
+
+# Commands where only the latest of those still queued matters: a newer
+# pass replaces an older one, and one state or sync answers them all.
+COALESCED = {"pass_cards", "notify_state", "sync", "vote_to_start"}
+
+
+class Limiter:
+    # One per connection. Checks go from cheapest to dearest: frame size,
+    # the connection's bucket, then JSON, the event name, its own bucket
+    # and the length of a chat message; nothing that fails one reaches a
+    # table's inbox. Past max_strikes rejections in a row the connection
+    # should be dropped.
+    def __init__(self, clock: Clock = real_clock):
+        self.clock = clock
+        now = clock.now()
+        self.bucket = TokenBucket(config.ws_rate, config.ws_burst, now)
+        self.events = {event: TokenBucket(rate, burst, now) for event, (rate, burst) in config.ws_event_limits.items()}
+        self.strikes = 0
+
+    def reject(self, reason: str) -> None:
+        metrics.rejected.inc(reason)
+        self.strikes += 1
+        return None
+
+    @property
+    def abusive(self) -> bool:
+        return self.strikes > config.ws_max_strikes
+
+    def admit(self, raw: str | bytes | None) -> dict | None:
+        if not raw or len(raw) > config.ws_max_frame:
+            return self.reject("size")
+        now = self.clock.now()
+        if not self.bucket.take(now):
+            return self.reject("rate")
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return self.reject("invalid")
+        if not isinstance(data, dict) or (event := data.get("event")) not in public_methods:
+            return self.reject("unknown")
+        if (bucket := self.events.get(event)) is not None and not bucket.take(now):
+            return self.reject(event)
+        if event == "message" and len(str(data.get("message", ""))) > config.chat_max_length:
+            return self.reject("too_long")
+        self.strikes = 0
+        return data
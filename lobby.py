@@ -0,0 +1,129 @@
+import asyncio
+import time
+from datetime import datetime
+from collections import defaultdict, deque
+from functools import partial
+from typing import Callable, NamedTuple, Sequence
+
+from bots import Bot
+from engine import Clock, real_clock
+from events import EventWriter
+from models import Game, Player
+
+
+class Criteria(NamedTuple):
+    stake: int = 0
+    latency: int = 0
+
+    @classmethod
+    def from_request(cls, stake: int = 0, latency_ms: int = 0) -> "Criteria":
+        # players are only matched with others in the same 100ms latency band
+        return cls(stake=stake, latency=latency_ms // 100)
+
+
+class QueueStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+        }
+
+
+class Matchmaker:
+    # Connecting players are queued and seated in batches: every batch_window
+    # the queue is drained, grouped by criteria and poured into the open
+    # tables for that criteria, so a spike of connections fills many tables
+    # at once with one join command per table instead of one per player.
+    def __init__(
+        self,
+        backfill_after: float = 30.0,
+        batch_window: float = 0.05,
+        clock: Clock = real_clock,
+        bot: Bot | None = None,
+        log: EventWriter | None = None,
+        on_finish: Sequence[Callable[[Game], object]] = (),
+    ):
+        self.backfill_after = backfill_after
+        self.batch_window = batch_window
+        self.clock = clock
+        self.bot = bot
+        self.log = log
+        self.on_finish = on_finish
+        self.tables: dict[Criteria, deque[Game]] = defaultdict(deque)
+        self.waiting: deque[tuple[Player, Criteria, float, asyncio.Future]] = deque()
+        self.seat_wait = QueueStats()
+        self.fill_time = QueueStats()
+        self._flusher: asyncio.Task | None = None
+
+    def seat(self, player: Player, criteria: Criteria = Criteria()) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append((player, criteria, time.monotonic(), future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run())
+        return future
+
+    async def _run(self):
+        while self.waiting:
+            await self.clock.sleep(self.batch_window)
+            await self.flush()
+
+    def open_table(self, criteria: Criteria, reserved: dict[int, tuple[Game, list]]) -> Game:
+        tables = self.tables[criteria]
+        while tables:
+            game = tables[0]
+            seated = len(game.players) + len(reserved.get(id(game), (game, []))[1])
+            if not game.started_at and seated < 4:
+                return game
+            tables.popleft()
+            self.fill_time.add((datetime.now() - game.created_at).total_seconds())
+        game = Game().bind(clock=self.clock, bot=self.bot, log=self.log, on_finish=self.on_finish)
+        tables.append(game)
+        return game
+
+    async def flush(self):
+        batch, self.waiting = self.waiting, deque()
+        reserved: dict[int, tuple[Game, list]] = {}
+        for entry in batch:
+            game = self.open_table(entry[1], reserved)
+            reserved.setdefault(id(game), (game, []))[1].append(entry)
+        await asyncio.gather(*(self._join(game, group) for game, group in reserved.values()))
+
+    async def _join(self, game: Game, group: list):
+        try:
+            await game.submit("join_many", new_players=[player for player, *_ in group])
+        except ValueError:
+            # the table filled up or was started by a vote while the batch was queued
+            self.waiting.extend(group)
+            return
+        except Exception as e:
+            # anything else is a bug; the players waiting on it must not hang
+            for *_, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if len(game.players) == len(group) < 4:
+            self.clock.call_later(self.backfill_after, partial(game.submit, "fill_with_bots"))
+        now = time.monotonic()
+        for player, criteria, enqueued_at, future in group:
+            self.seat_wait.add(now - enqueued_at)
+            if not future.done():
+                future.set_result(game)
+
+    def stats(self) -> dict:
+        return {
+            "waiting_players": len(self.waiting),
+            "open_tables": sum(len(tables) for tables in self.tables.values()),
+            "seat_wait": self.seat_wait.as_dict(),
+            "fill_time": self.fill_time.as_dict(),
+        }
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import logging
+import random
+from bisect import bisect_left
+from typing import Callable
+
+# Prometheus text format, written by hand: a handful of counters and
+# histograms updated on the hot path, and gauges read when scraped. Each
+# metric has at most one label. Updating one is a dict lookup and an add.
+LATENCY = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _labels(label: str | None, value: str, extra: str = "") -> str:
+    pairs = [f'{label}="{value}"'] if label else []
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label: str | None = None):
+        self.name, self.help, self.label = name, help, label
+        self.values: dict[str, float] = {}
+
+    def inc(self, key: str = "", amount: float = 1):
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.label, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label: str | None = None, buckets: tuple[float, ...] = LATENCY):
+        self.name, self.help, self.label, self.buckets = name, help, label, buckets
+        # per label value: count per bucket (the last one is +Inf), then the sum
+        self.series: dict[str, list] = {}
+
+    def observe(self, value: float, key: str = ""):
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    # read when scraped; read() returns a number, or one per label value
+    def __init__(self, name: str, help: str, read: Callable[[], float | dict[str, float]], label: str | None = None):
+        self.name, self.help, self.read, self.label = name, help, read, label
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        values = self.read()
+        if not isinstance(values, dict):
+            values = {"": values}
+        for key, value in values.items():
+            lines.append(f"{self.name}{_labels(self.label, key)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Counter | Histogram | Gauge] = {}
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, label: str | None = None) -> Counter:
+        return self.add(Counter(name, help, label))
+
+    def histogram(self, name: str, help: str, label: str | None = None, buckets: tuple[float, ...] = LATENCY) -> Histogram:
+        return self.add(Histogram(name, help, label, buckets))
+
+    def gauge(self, name: str, help: str, read: Callable, label: str | None = None) -> Gauge:
+        return self.add(Gauge(name, help, read, label))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                lines += metric.render()
+            except Exception:
+                logging.getLogger(__name__).exception("Could not read %s", metric.name)
+        return "\n".join(lines) + "\n"
+
+
+class LoopMonitor:
+    # Sleeps interval at a time; whatever it oversleeps by is time some
+    # callback held the loop.
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self.lag = 0.0
+        self._task: asyncio.Task | None = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - started - self.interval)
+            loop_lag.observe(self.lag)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class EventLogger:
+    # One JSON line per sampled event on the "hearts.events" logger. The
+    # sampling decision comes first, so an unsampled event costs a random().
+    def __init__(self, rate: float = 0.01):
+        self.rate = rate
+        self.logger = logging.getLogger("hearts.events")
+
+    def sampled(self) -> bool:
+        return self.rate > 0 and random.random() < self.rate and self.logger.isEnabledFor(logging.INFO)
+
+    def log(self, **fields):
+        self.logger.info(json.dumps(fields, default=str, separators=(",", ":")))
+
+
+registry = Registry()
+commands = registry.histogram("hearts_command_seconds", "Time a table spends on one command, pauses included", "command")
+fanout = registry.histogram("hearts_fanout_seconds", "Time to encode and queue a table event for every seat", "event")
+messages = registry.counter("hearts_messages_total", "Messages queued to players", "event")
+dropped = registry.counter("hearts_messages_dropped_total", "Messages dropped by a full send queue", "policy")
+decisions = registry.histogram("hearts_bot_decision_seconds", "Time a bot takes to choose a move", "bot")
+timeouts = registry.counter("hearts_timeouts_total", "Moves and passes made for a player who ran out of time", "kind")
+rejected = registry.counter("hearts_rejected_total", "Client frames rejected before reaching a table", "reason")
+coalesced = registry.counter("hearts_coalesced_total", "Client commands merged into one already queued", "command")
+loop_lag = registry.histogram("hearts_loop_lag_seconds", "How late the event loop woke a sleeping task")
+registry.gauge("hearts_loop_lag_last_seconds", "Most recent event loop lag sample", lambda: monitor.lag)
+monitor = LoopMonitor()
+event_logger = EventLogger()
+
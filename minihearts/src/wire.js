@@ -0,0 +1,128 @@
+// Decoder for the "hearts.msgpack" subprotocol; the tables match wire.py.
+// A frame is the message number followed by [code, seq, private, ...fields],
+// expanded here into the same shape as the JSON messages.
+export const SUBPROTOCOL = 'hearts.msgpack'
+
+const EVENTS = [
+  'state', 'hand', 'joined', 'left', 'started', 'round', 'waiting_pass', 'pass', 'got',
+  'played', 'took', 'trick', 'shoot_the_moon', 'deadline', 'chat', 'game_over',
+]
+const PLAYER = ['telegram_id', 'display_name', 'scores', 'auto_move', 'is_bot']
+const FIELDS = {
+  hand: ['hand'],
+  joined: PLAYER,
+  left: PLAYER,
+  started: ['started_at'],
+  round: ['round_number', 'seat', 'waiting_for_pass'],
+  waiting_pass: ['where'],
+  pass: ['where', 'cards'],
+  got: ['where', 'cards'],
+  played: ['seat', 'card'],
+  took: ['seat', 'score'],
+  trick: ['seat', 'score', 'score_opened'],
+  shoot_the_moon: ['seat'],
+  deadline: ['seconds'],
+  chat: ['id', 'player', 'text', 'private_to', 'created_at'],
+  game_over: ['results', 'endgame'],
+}
+const STATE = [
+  'id', 'players', 'score_opened', 'round_number', 'table', 'votes', 'created_at',
+  'started_at', 'ended_at', 'waiting_for_pass', 'max_score', 'turn_deadline', 'version',
+]
+const WHERE = ['left', 'right', 'across']
+const CARDS = [...'cdsh'].flatMap(suit => [...'23456789tjqka'].map(rank => rank + suit))
+
+const text = new TextDecoder()
+
+function unpack(view, bytes, at) {
+  // returns [value, next offset]; only the types wire.py writes
+  const b = view.getUint8(at)
+  if (b < 0x80) return [b, at + 1]
+  if (b >= 0xe0) return [b - 0x100, at + 1]
+  if ((b & 0xf0) === 0x90) return array(view, bytes, at + 1, b & 0x0f)
+  if ((b & 0xf0) === 0x80) return map(view, bytes, at + 1, b & 0x0f)
+  if ((b & 0xe0) === 0xa0) return [text.decode(bytes.subarray(at + 1, at + 1 + (b & 0x1f))), at + 1 + (b & 0x1f)]
+  switch (b) {
+    case 0xc0: return [null, at + 1]
+    case 0xc2: return [false, at + 1]
+    case 0xc3: return [true, at + 1]
+    case 0xcc: return [view.getUint8(at + 1), at + 2]
+    case 0xcd: return [view.getUint16(at + 1), at + 3]
+    case 0xce: return [view.getUint32(at + 1), at + 5]
+    case 0xcf: return [Number(view.getBigUint64(at + 1)), at + 9]
+    case 0xd2: return [view.getInt32(at + 1), at + 5]
+    case 0xd3: return [Number(view.getBigInt64(at + 1)), at + 9]
+    case 0xcb: return [view.getFloat64(at + 1), at + 9]
+    case 0xd9: {
+      const size = view.getUint8(at + 1)
+      return [text.decode(bytes.subarray(at + 2, at + 2 + size)), at + 2 + size]
+    }
+    case 0xdb: {
+      const size = view.getUint32(at + 1)
+      return [text.decode(bytes.subarray(at + 5, at + 5 + size)), at + 5 + size]
+    }
+    case 0xdd: return array(view, bytes, at + 5, view.getUint32(at + 1))
+    case 0xdf: return map(view, bytes, at + 5, view.getUint32(at + 1))
+  }
+  throw new Error(`Unknown MessagePack type 0x${b.toString(16)}`)
+}
+
+function array(view, bytes, at, size) {
+  const out = []
+  for (let i = 0; i < size; i++) {
+    let value
+    [value, at] = unpack(view, bytes, at)
+    out.push(value)
+  }
+  return [out, at]
+}
+
+function map(view, bytes, at, size) {
+  const out = {}
+  for (let i = 0; i < size; i++) {
+    let key, value
+    [key, at] = unpack(view, bytes, at)
+    ;[value, at] = unpack(view, bytes, at)
+    out[key] = value
+  }
+  return [out, at]
+}
+
+function time(ms) {
+  return ms === null ? null : new Date(ms).toISOString()
+}
+
+function field(name, value) {
+  switch (name) {
+    case 'card': return CARDS[value]
+    case 'cards': case 'hand': case 'table': return value.map(c => CARDS[c])
+    case 'where': return WHERE[value] ?? ''
+    case 'started_at': case 'created_at': case 'ended_at': case 'turn_deadline': return time(value)
+    case 'results': return value.map(([player, score, place]) => ({player, score, place}))
+    case 'endgame': return value.map(([player, moves, lost]) => ({player, moves, lost}))
+    case 'players': return value.map(p => fields(PLAYER, p))
+  }
+  return value
+}
+
+function fields(names, values) {
+  const data = {}
+  names.forEach((name, i) => data[name] = field(name, values[i]))
+  return data
+}
+
+export function decode(buffer, telegram_id) {
+  const bytes = new Uint8Array(buffer)
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength)
+  const [n, at] = unpack(view, bytes, 0)
+  const [[code, seq, own, ...values]] = unpack(view, bytes, at)
+  const event = EVENTS[code]
+  return {
+    n,
+    event,
+    seq,
+    // JSON names the recipient of a private event; only its presence matters
+    player: own ? telegram_id : null,
+    data: fields(event === 'state' ? STATE : FIELDS[event], values),
+  }
+}
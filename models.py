@@ -1,77 +1,102 @@
 import asyncio
+import logging
 import random
+import time
+import uuid
 from collections import deque
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import partial
 from decimal import Decimal
 from weakref import WeakValueDictionary
-from typing import Annotated, TypedDict
+from typing import Annotated, Callable, Sequence
 
 from beanie import Document, Indexed
+from pymongo import ASCENDING, DESCENDING, IndexModel
 
 # from bson import ObjectId
 from faker import Faker
 from pydantic import (
     Field,
     BaseModel,
+    BeforeValidator,
     PlainSerializer,
     computed_field,
     field_serializer,
 )
-from pydantic_core.core_schema import SerializationInfo
+
+import metrics
+from bots import Bot, greedy_move, heuristic
+from chatlog import ChatLog
+from engine import Clock, Notifier, real_clock
+from events import EventWriter
+from solver import Position, analyse
+from timers import Timer
+from cards import (
+    BIT,
+    NAMES,
+    SUIT,
+    SUIT_MASKS,
+    SUITS,
+    TWO_OF_CLUBS,
+    deal,
+    legal_moves,
+    names,
+    parse,
+    points,
+    to_mask,
+    trick_winner,
+)
+
+logger = logging.getLogger(__name__)
 
 PlayerRef = Annotated[
     "Player", PlainSerializer(lambda x: x.telegram_id, return_type=int)
 ]
 
 
-def rank(card) -> int:
-    return "23456789tjqka".index(card[0])
-
-
-def score(card) -> int:
-    if card == "qs":
-        return 13
-    elif card[1] == "h":
-        return 1
-    return 0
-
-def sort_hand(hand):
-    return list(sorted(hand, key=lambda c: ('cdsh'.index(c[1]), rank(c))))
-
+Card = Annotated[int, BeforeValidator(parse), PlainSerializer(lambda x: NAMES[x], return_type=str)]
+Hand = Annotated[int, PlainSerializer(names, return_type=list[str])]
 
-def max_rank(cards):
-    return cards.index(max(filter(lambda c: c[1] == cards[0][1], cards), key=rank))
 
-
-def get_deck() -> list[str]:
-    l = []
-    for suit in "chsd":
-        for rank in "23456789tjqka":
-            l.append(f"{rank}{suit}")
-    random.shuffle(l)
-    return l
-
-
-class GameResult(TypedDict):
+class GamePlayed(Document):
+    # One per human and finished game; kept out of User so that user
+    # documents stay small, and written in bulk by users.history.
+    telegram_id: int
+    game: str
     ended_at: datetime
     place: int
-    balance_changed: Decimal
+    score: int
+    balance_changed: Decimal = Decimal(0)
+
+    class Settings:
+        name = "games_played"
+        indexes = [
+            IndexModel([("telegram_id", ASCENDING), ("ended_at", DESCENDING)]),
+            IndexModel([("game", ASCENDING), ("telegram_id", ASCENDING)], unique=True),
+            IndexModel([("ended_at", DESCENDING)]),
+        ]
 
 
 class User(Document):
-    telegram_id: int = Annotated[str, Indexed(unique=True)]
+    telegram_id: Annotated[int, Indexed(unique=True)]
     username: str = None
     display_name: str = None
     balance: Decimal = Field(default_factory=lambda: Decimal(0))
     created_at: datetime = Field(default_factory=datetime.now)
-    games_played: list[GameResult] = Field(default_factory=list)
+    games: int = 0
+    wins: Annotated[int, Indexed()] = 0
+    places: int = 0
+    moons: int = 0
 
     @classmethod
     async def get_or_create(cls, **data) -> "User":
-        obj = await cls.find_one(
-            Player.telegram_id == data["telegram_id"]
-        ) or cls.insert_one(**data)
-        await obj.set(**data)
+        # uncached; users.UserCache is the path connections take
+        obj = await cls.find_one(cls.telegram_id == data["telegram_id"])
+        if obj is None:
+            obj = cls(**data)
+            await obj.insert()
+        elif changed := {k: v for k, v in data.items() if getattr(obj, k) != v}:
+            await obj.set(changed)
         return obj
 
     @property
@@ -92,27 +117,39 @@ class Player(BaseModel):
     telegram_id: int
     # user_id: ObjectId | None = None
     display_name: str = None
-    hand: list[str] = Field(default_factory=list, exclude=True)
-    pass_cards: list[str] = Field(default_factory=list, exclude=True)
+    hand: Hand = Field(default=0, exclude=True)
+    pass_cards: Hand = Field(default=0, exclude=True)
+    voids: int = Field(default=0, exclude=True)
     scores: list[int] = Field(default_factory=list)
     auto_move: bool = False
     is_bot: bool = False
+    _bot: Bot | None = None
 
     async def get_user(self):
         return await User.get(self.user_id)
 
+    @property
+    def total(self) -> int:
+        return sum(self.scores)
+
     @property
     def by_suits(self):
-        return {suit: [c for c in self.hand if c[1] == suit] for suit in 'chsd'}
+        return {suit: names(self.hand & mask) for suit, mask in zip(SUITS, SUIT_MASKS)}
 
     @classmethod
-    def get_bot(cls) -> "Player":
-        return Player(
-            telegram_id=0, auto_move=True, display_name=Faker().name(), is_bot=True
+    def get_bot(cls, bot: Bot | None = None) -> "Player":
+        player = Player(
+            telegram_id=0, auto_move=True, display_name=fake.name(), is_bot=True
         )
+        player._bot = bot
+        return player
+
+
+fake = Faker()
 
 
 class Chat(BaseModel):
+    id: int = 0
     player: PlayerRef | None = None
     text: str
     private_to: PlayerRef | None = None
@@ -123,6 +160,7 @@ class Notification(BaseModel):
     event: str
     player: PlayerRef | None = None
     data: dict
+    seq: int = 0
     created_at: datetime = Field(default_factory=datetime.now)
 
 
@@ -130,52 +168,194 @@ games_by_player = WeakValueDictionary()
 
 
 class Game(BaseModel):
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    seed: int = Field(default_factory=lambda: random.getrandbits(63), exclude=True)  # fits a BSON int64
     players: deque[Player] = Field(default_factory=deque)
     score_opened: bool = False
     round_number: int = 0
-    table: list[str] = Field(default_factory=list)
-    _timeout: asyncio.Task | None = None
+    table: list[Card] = Field(default_factory=list)
+    played: Hand = Field(default=0, exclude=True)
+    _timeout: Timer | None = None
+    _move_timeout = 7
+    _pass_timeout = 2
+    _turn: int = 0
+    _pass_index: int = 0
+    _inbox: deque = deque()
+    _runner: asyncio.Task | None = None
+    _notifier: Notifier | None = None
+    _clock: Clock = real_clock
+    _bot: Bot = heuristic
+    _endgame_tricks = 3
+    _endgame_moves: list[tuple[Player, Position, int]] = []
+    _log: EventWriter | None = None
+    _rng: random.Random | None = None
+    _logged: int = 0
+    _ended: asyncio.Future | None = None
+    # called with the game as it ends; only games bound by the server record
+    # results, so replays and headless tables don't count twice
+    _on_finish: tuple[Callable[["Game"], object], ...] = ()
     _pass_to = [-1, 1, 2, 0]
     _pass_names = ["left", "right", "across", ""]
+    # chat is kept out of the state: clients page through it with chat_page
+    _chat: ChatLog | None = None
+    _chat_history = 200
     votes: set[int] = Field(default_factory=set)
-    chat_messages: list[Chat] = Field(default_factory=list, exclude=True)
     created_at: datetime = Field(default_factory=datetime.now)
     started_at: datetime = None
+    ended_at: datetime = None
     waiting_for_pass: bool = False
+    max_score: int = 100
+    turn_deadline: datetime = None
+    version: int = 0
+    dumps: dict = Field(default_factory=dict, exclude=True)
+    seq: int = Field(default=0, exclude=True)
 
     @field_serializer("players")
     def get_players(self, v: deque[PlayerRef]) -> list[Player]:
         return list(self.players)
 
-    @field_serializer("chat_messages")
-    def get_chat_messages(self, v: list[Chat], info: SerializationInfo) -> list[Chat]:
-        player = info.context.get("player")
-        return [
-            chat
-            for chat in self.chat_messages
-            if not chat.private_to or chat.player == player
-        ]
+    def bind(
+        self,
+        notifier: Notifier | None = None,
+        clock: Clock | None = None,
+        bot: Bot | None = None,
+        log: EventWriter | None = None,
+        on_finish: Sequence[Callable[["Game"], object]] = (),
+    ) -> "Game":
+        self._notifier = notifier
+        self._clock = clock or real_clock
+        self._bot = bot or heuristic
+        self._log = log
+        self._on_finish = tuple(on_finish)
+        return self
+
+    def bot_for(self, player: Player) -> Bot:
+        return player._bot or self._bot
+
+    @property
+    def rng(self) -> random.Random:
+        # every deal of the game comes from here, so the seed reproduces it
+        if self._rng is None:
+            self._rng = random.Random(self.seed)
+        return self._rng
+
+    @property
+    def notifier(self) -> Notifier:
+        if self._notifier is None:
+            from ws import manager
+
+            return manager
+        return self._notifier
+
+    def submit(self, method: str, **kwargs) -> asyncio.Future:
+        # Every change to a table goes through its inbox and is applied by a
+        # single runner task, one command at a time. The runner exits when the
+        # inbox is drained and is restarted by the next submit.
+        future = asyncio.get_running_loop().create_future()
+        self._inbox.append((method, kwargs, future))
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+        return future
+
+    def submit_latest(self, method: str, **kwargs) -> asyncio.Future:
+        # The same command from the same player still waiting in the inbox
+        # is replaced in place, and its future answers both.
+        player = kwargs.get("player")
+        for i, (queued, queued_kwargs, future) in enumerate(self._inbox):
+            if queued == method and queued_kwargs.get("player") is player:
+                self._inbox[i] = (method, kwargs, future)
+                metrics.coalesced.inc(method)
+                return future
+        return self.submit(method, **kwargs)
+
+    async def _run(self):
+        while self._inbox:
+            method, kwargs, future = self._inbox.popleft()
+            started = time.perf_counter()
+            try:
+                result = await getattr(self, method)(**kwargs)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+            metrics.commands.observe(time.perf_counter() - started, method)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._inbox)
+
+    def touch(self):
+        # Must be called after every change to serialized state: the cached
+        # dumps below are reused by every recipient until the version moves.
+        # Written through __dict__ because pydantic's __setattr__ costs more
+        # than the dumps it saves.
+        self.__dict__["version"] += 1
+
+    def _cached(self, part: str, build) -> dict:
+        cached = self.dumps.get(part)
+        if cached is None or cached[0] != self.version:
+            cached = self.dumps[part] = (self.version, build())
+        return cached[1]
+
+    def dump_state(self) -> dict:
+        return self._cached("state", self.model_dump)
+
+    def record(self, event: str, **data):
+        # Appends to the event log without waiting for it. Players are named
+        # by seat in the current order; the deal lists who sits where.
+        if self._log is not None:
+            self._logged += 1
+            self._log.append(
+                {"game": self.id, "seq": self._logged, "event": event, "data": data, "created_at": datetime.now()}
+            )
 
     async def message(self, player: Player, message: str, private_to: PlayerRef|None=None):
         chat_message = Chat(player=player, text=message, private_to=private_to)
-        await self.notify("chat", chat_message.private_to, chat_message.model_dump())
+        await self.chat(chat_message)
+
+    @property
+    def chat_log(self) -> ChatLog:
+        if self._chat is None:
+            self._chat = ChatLog(self._chat_history)
+        return self._chat
+
+    def chat_page(self, player: Player | None, before: int | None = None, limit: int = 50) -> list[Chat]:
+        return self.chat_log.page(player.telegram_id if player else None, before, limit)
 
     async def chat(self, chat_message: Chat):
+        self.chat_log.append(chat_message)
+        self.record("chat", **chat_message.model_dump(exclude={"id", "created_at"}))
         await self.notify("chat", chat_message.private_to, chat_message.model_dump())
 
     async def join(self, player: Player):
+        await self.join_many([player])
+
+    async def join_many(self, new_players: list[Player]):
         if self.started_at:
             raise ValueError('Game already started')
-        self.players.append(player)
-        players[player.telegram_id] = player
-        games_by_player[player.telegram_id] = self
-        await self.notify("joined", None, player.model_dump())
-
-        await self.notify("players", None, self.model_dump(include={"players"}))
-        await self.notify_state(player)
+        if len(self.players) + len(new_players) > 4:
+            raise ValueError('Game is full')
+        for player in new_players:
+            self.players.append(player)
+            if not player.is_bot:
+                # bots share ids with other bots, and seats with no session
+                players[player.telegram_id] = player
+                games_by_player[player.telegram_id] = self
+            self.touch()
+            await self.notify("joined", None, player.model_dump())
+
+        for player in new_players:
+            await self.notify_state(player)
 
         if len(self.players) == 4:
-            await self.start()
+            self.submit("start")
+
+    async def fill_with_bots(self):
+        if self.started_at or all(p.is_bot for p in self.players):
+            return
+        await self.join_many([Player.get_bot() for _ in range(4 - len(self.players))])
 
     async def leave(self, player: Player):
         if self.started_at:
@@ -190,195 +370,357 @@ class Game(BaseModel):
                     break
         games_by_player.pop(player.telegram_id, None)
         players.pop(player.telegram_id, None)
+        self.touch()
         await self.notify("left", None, player.model_dump())
-        await self.notify("players", None, self.model_dump(include={"players"}))
 
     async def start(self):
+        if self.started_at:
+            return
         self.started_at = datetime.now()
-        for player in self.players:
-            await self.notify_state(player)
+        self.touch()
+        self.record(
+            "start", players=[p.telegram_id for p in self.players], seed=self.seed, max_score=self.max_score
+        )
+        await self.notify("started", None, {"started_at": self.started_at})
 
         await self.deal()
+        await self.next_turn()
 
     async def vote_to_start(self, player: PlayerRef):
         self.votes.add(player.telegram_id)
+        self.touch()
         if len(self.votes) == len(self.players) >= 1:
-            while len(self.players) < 4:
-                await self.join(Player.get_bot())
-            await self.start()
+            await self.fill_with_bots()
 
     async def notify(self, event: str, player: Player | None, data: dict) -> None:
-        if player and player.is_bot:
+        # Events for the whole table are patches numbered by seq: a client
+        # applies them in order and asks for a sync when it sees a gap.
+        # Private events carry the current seq without advancing it.
+        if player is None:
+            self.seq += 1
+        elif player.is_bot:
             return
-        from ws import manager
 
-        msg = Notification(event=event, player=player, data=data)
+        msg = Notification(event=event, player=player, data=data, seq=self.seq)
         if player:
-            await manager.notify_player(player, msg)
+            await self.notifier.notify_player(self, player, msg)
         else:
-            await manager.notify_game(self, msg)
-
-        print(msg.model_dump())
+            await self.notifier.notify_game(self, msg)
 
     async def notify_state(self, player: Player) -> None:
-        from ws import manager
-
         msg = Notification(
             event="state",
             player=player,
-            data=self.model_dump(context={"player": player}),
+            data=self.dump_state(),
+            seq=self.seq,
         )
-        await manager.notify_player(player, msg)
+        await self.notifier.notify_player(self, player, msg)
+
+    async def sync(self, player: Player) -> None:
+        await self.notify_state(player)
+        if self.started_at:
+            await self.notify("hand", player, {"hand": names(player.hand)})
 
     async def deal(self):
         self.score_opened = False
         self.table = []
-
-        if scores := [p.scores for p in self.players]:
-            if any(s == 26 for s in scores[-1]):
-                for p in self.players:
-                    p.scores[-1] = 0 if p.scores[-1] == 26 else 26
-                await self.notify('shoot_the_moon', None, {})
-
-        deck = get_deck()
-        for p in self.players:
-            p.hand = sort_hand([deck.pop(0) for _ in range(13)])
-            await self.notify("hand", p, {"hand": p.hand})
+        self.played = 0
+
+        if self.players and self.players[0].scores:
+            if (shooter := next((i for i, p in enumerate(self.players) if p.scores[-1] == 26), None)) is not None:
+                for i, p in enumerate(self.players):
+                    p.scores[-1] = 0 if i == shooter else 26
+                self.touch()
+                self.record("shoot_the_moon", seat=shooter)
+                await self.notify("shoot_the_moon", None, {"seat": shooter})
+            if max(p.total for p in self.players) >= self.max_score:
+                return await self.finish()
+
+        self.touch()
+        for p, hand in zip(self.players, deal(self.rng)):
+            p.hand = hand
+            p.voids = 0
+            await self.notify("hand", p, {"hand": names(p.hand)})
             p.scores.append(0)
 
-        for i, p in enumerate(self.players):
-            if "2c" in p.hand:
-                self.players.rotate(-i)
-                await self.notify("players", None, self.model_dump(include={"players"}))
-                break
-        if pass_to := self._pass_to[self.round_number % 4]:
-            self.waiting_for_pass = True
-            for p in self.players:
-                p.pass_cards = []
-                await self.notify(
-                    "waiting_pass",
-                    p,
-                    {
-                        "to": self.players[(i + pass_to) % 4].telegram_id,
-                        "where": self._pass_names[self.round_number % 4],
-                    },
-                )
-            await asyncio.sleep(2)
+        first = next(i for i, p in enumerate(self.players) if p.hand & TWO_OF_CLUBS)
+        self.players.rotate(-first)
+        self._pass_index = self.round_number % 4
+        self.round_number += 1
+        pass_to = self._pass_to[self._pass_index]
+        self.waiting_for_pass = bool(pass_to)
+        self.touch()
+        self.record(
+            "deal",
+            round_number=self.round_number,
+            players=[p.telegram_id for p in self.players],
+            hands=[names(p.hand) for p in self.players],
+        )
+        await self.notify(
+            "round",
+            None,
+            {
+                "round_number": self.round_number,
+                "seat": first,
+                "waiting_for_pass": self.waiting_for_pass,
+            },
+        )
+        if pass_to:
             for i, p in enumerate(self.players):
-                while len(p.pass_cards) < 3:
-                    card = random.choice(p.hand)
-                    p.pass_cards.append(card)
-                    p.hand.remove(card)
-                while len(p.pass_cards) > 3:
-                    p.hand.append(p.pass_cards.pop(0))
-                self.players[(i + pass_to) % 4].hand.extend(p.pass_cards)
+                p.pass_cards = 0
                 await self.notify(
-                    "pass",
+                    "waiting_pass",
                     p,
                     {
                         "to": self.players[(i + pass_to) % 4].telegram_id,
-                        "where": self._pass_names[self.round_number % 4],
-                        "cards": p.pass_cards,
+                        "where": self._pass_names[self._pass_index],
                     },
                 )
-                await self.notify(
-                    "got",
-                    self.players[(i + pass_to) % 4],
-                    {
-                        "from": p,
-                        "where": self._pass_names[self.round_number % 4],
-                        "cards": p.pass_cards,
-                    },
-                )
-                p.pass_cards = []
-            for p in self.players:
-                await self.notify("hand",p , {"hand": p.hand})
-            self.waiting_for_pass = False
+            if all(p.auto_move for p in self.players):
+                await self.finish_pass()
+            else:
+                await self._arm(self._pass_timeout, "on_pass_timeout", round_number=self.round_number)
+
+    async def finish_pass(self):
+        pass_to = self._pass_to[self._pass_index]
+        where = self._pass_names[self._pass_index]
+        for p in self.players:
+            if missing := 3 - p.pass_cards.bit_count():
+                extra = self.bot_for(p).choose_pass(p, missing)
+                p.pass_cards |= extra
+                p.hand &= ~extra
+        for i, p in enumerate(self.players):
+            self.players[(i + pass_to) % 4].hand |= p.pass_cards
+            self.record("pass", seat=i, to=(i + pass_to) % 4, cards=names(p.pass_cards))
+            await self.notify(
+                "pass",
+                p,
+                {
+                    "to": self.players[(i + pass_to) % 4].telegram_id,
+                    "where": where,
+                    "cards": names(p.pass_cards),
+                },
+            )
+            await self.notify(
+                "got",
+                self.players[(i + pass_to) % 4],
+                {
+                    "from": p,
+                    "where": where,
+                    "cards": names(p.pass_cards),
+                },
+            )
+            p.pass_cards = 0
+        self.waiting_for_pass = False
+        self.touch()
+        for p in self.players:
+            await self.notify("hand", p, {"hand": names(p.hand)})
 
-        self.round_number += 1
-        if self._timeout:
-            self._timeout.cancel()
-        if self.players[len(self.table)].auto_move:
-            await self.auto_move()
-        else:
-            self._timeout = asyncio.create_task(self.timeout_task())
+    @property
+    def results(self) -> list[dict]:
+        ranked = sorted(self.players, key=lambda p: p.total)
+        return [
+            {"player": p, "score": p.total, "place": place}
+            for place, p in enumerate(ranked, 1)
+        ]
+
+    async def finish(self):
+        self.ended_at = datetime.now()
+        self._cancel_timeout()
+        self.touch()
+        self.record(
+            "game_over",
+            results=[{"player": r["player"].telegram_id, "score": r["score"], "place": r["place"]} for r in self.results],
+        )
+        for hook in self._on_finish:
+            try:
+                hook(self)
+            except Exception:
+                logger.exception("Recording the results of %s failed", self.id)
+        # the solver runs for tens of milliseconds a game, so not on the loop
+        endgame = await asyncio.to_thread(self.endgame_analysis) if self._endgame_moves else []
+        await self.notify("game_over", None, {"results": self.results, "endgame": endgame})
+        if self._ended is not None and not self._ended.done():
+            self._ended.set_result(self)
+
+    def ended(self) -> asyncio.Future:
+        # resolves once the game is over, however long its commands take
+        if self._ended is None:
+            self._ended = asyncio.get_running_loop().create_future()
+            if self.ended_at:
+                self._ended.set_result(self)
+        return self._ended
+
+    def position(self) -> Position:
+        return Position(
+            tuple(p.hand for p in self.players),
+            tuple(self.table),
+            0,
+            self.score_opened,
+            tuple(p.scores[-1] for p in self.players),
+        )
+
+    def endgame_analysis(self) -> list[dict]:
+        # Points each human gave away in the last tricks of every round,
+        # against perfect play with all hands known.
+        report = {}
+        for player, position, card in self._endgame_moves:
+            entry = report.setdefault(player.telegram_id, {"player": player.telegram_id, "moves": 0, "lost": 0})
+            entry["moves"] += 1
+            entry["lost"] += analyse(position, card)
+        return list(report.values())
 
     async def player_move(self, player: Player, card):
+        if self.waiting_for_pass:
+            raise ValueError("Cannot move while passing")
         if self.players[len(self.table)] != player:
             raise ValueError("Not your move")
-        await self.move(card)
+        await self.move(parse(card))
+
+    def legal_moves(self) -> int:
+        return legal_moves(self.players[len(self.table)].hand, self.table, self.score_opened)
+
+    async def move(self, card: int):
+        await self.play(card)
+        await self.next_turn()
 
-    async def move(self, card):
+    async def play(self, card: int):
+        # the pass spans several inbox commands; nobody plays until it is done
+        if self.waiting_for_pass:
+            raise ValueError("Cannot move while passing")
         move_of = self.players[len(self.table)]
-        if card not in move_of.hand:
+        bit = BIT[card]
+        if not move_of.hand & bit:
             raise ValueError("You don't have that card")
-        if score(card) and not self.score_opened:
+        if not self.legal_moves() & bit:
+            if self.table and move_of.hand & SUIT_MASKS[SUIT[self.table[0]]]:
+                raise ValueError("Wrong suit")
             raise ValueError("Wrong move")
-        if self.table:
-            suit = self.table[0][1]
-            if any(c[1] == suit for c in move_of.hand):
-                if card[1] != suit:
-                    raise ValueError("Wrong suit")
+        if not move_of.auto_move and move_of.hand.bit_count() <= self._endgame_tricks:
+            self._endgame_moves.append((move_of, self.position(), card))
+        self.record("move", seat=len(self.table), card=NAMES[card])
+        if self.table and SUIT[card] != SUIT[self.table[0]]:
+            move_of.voids |= SUIT_MASKS[SUIT[self.table[0]]]
         self.table.append(card)
-        move_of.hand.remove(card)
-        await self.notify("table", None, self.model_dump(include={"table", "score_opened"}))
-        await self.notify("hand", move_of, {"hand": move_of.hand})
+        self._turn += 1
+        self.played |= bit
+        move_of.hand &= ~bit
+        self.touch()
+        # Patches name players by seat in the current order, as bots share
+        # telegram_id 0. The player's own client drops the card from its hand.
+        await self.notify("played", None, {"seat": len(self.table) - 1, "card": NAMES[card]})
         if len(self.table) == 4:
-            scores = sum(map(score, self.table))
+            scores = points(to_mask(self.table))
+            took = trick_winner(self.table)
+            self.record("trick", seat=took, score=scores)
+            await self.notify("took", None, {"seat": took, "score": scores})
+            await self._clock.sleep(2)
             if scores:
                 self.score_opened = True
-            took = max_rank(self.table)
-            # notify
-            await self.notify(
-                "took", None, {"took": self.players[took], "score": scores}
-            )
-            await asyncio.sleep(2)
             self.players[took].scores[-1] += scores
             self.players.rotate(-took)
-            await self.notify("players", None, self.model_dump(include={"players"}))
             self.table = []
+            self.touch()
+            await self.notify(
+                "trick",
+                None,
+                {"seat": took, "score": scores, "score_opened": self.score_opened},
+            )
             if all(not p.hand for p in self.players):
                 await self.deal()
 
-        await self.notify("table", None, self.model_dump(include={"table", "score_opened"}))
+    async def next_turn(self):
+        # Bots are played in a loop rather than by recursing through move(),
+        # so a bot-only table can run a whole game without growing the stack.
+        if self.waiting_for_pass:
+            return
+        self._cancel_timeout()
+        while not self.ended_at and (player := self.players[len(self.table)]).auto_move:
+            await self.play(await self.decide(player))
+            if self.waiting_for_pass:
+                return
+        if not self.ended_at:
+            await self._arm(self._move_timeout, "on_timeout", turn=self._turn)
+
+    async def resume(self):
+        # Re-arms the timeout a restored table was waiting on, keeping what
+        # was left of it; bots whose turn it is just play on.
+        if not self.started_at or self.ended_at:
+            return
+        delay = max(0.0, (self.turn_deadline - datetime.now()).total_seconds()) if self.turn_deadline else 0.0
+        if self.waiting_for_pass:
+            await self._arm(delay, "on_pass_timeout", round_number=self.round_number)
+        elif self.players[len(self.table)].auto_move:
+            await self.next_turn()
+        else:
+            await self._arm(delay, "on_timeout", turn=self._turn)
+
+    async def _arm(self, delay: float, method: str, **kwargs):
+        self._cancel_timeout()
+        self._timeout = self._clock.call_later(delay, partial(self.submit, method, **kwargs))
+        self.turn_deadline = datetime.now() + timedelta(seconds=delay)
+        self.touch()
+        await self.notify("deadline", None, {"deadline": self.turn_deadline, "seconds": delay})
+
+    def _cancel_timeout(self):
         if self._timeout:
             self._timeout.cancel()
-        if self.players[len(self.table)].auto_move:
-            await self.auto_move()
-        else:
-            self._timeout = asyncio.create_task(self.timeout_task())
+        self._timeout = None
+        if self.turn_deadline:
+            self.turn_deadline = None
+            self.touch()
+
+    def choose_move(self) -> int:
+        return greedy_move(self.players[len(self.table)].hand, self.table, self.score_opened)
+
+    async def decide(self, player: Player) -> int:
+        bot = self.bot_for(player)
+        started = time.perf_counter()
+        card = await bot.choose_move(self)
+        metrics.decisions.observe(time.perf_counter() - started, type(bot).__name__)
+        return card
 
     async def auto_move(self):
-        move_of = self.players[len(self.table)]
-        if not self.table:
-            return await self.move(min(move_of.hand, key=lambda c: (score(c), rank(c))))
-        suit = self.table[0][1]
-        if any(c[1] == suit for c in move_of.hand):
-            return await self.move(
-                min(filter(lambda c: c[1] == suit, move_of.hand), key=rank)
-            )
-        return await self.move(max(move_of.hand, key=lambda c: (score(c), rank(c))))
+        player = self.players[len(self.table)]
+        await self.move(await self.decide(player))
+
+    async def on_timeout(self, turn: int):
+        # a move may have been queued ahead of the timeout that fired for it
+        if turn == self._turn and not self.ended_at and not self.waiting_for_pass:
+            metrics.timeouts.inc("move")
+            await self.auto_move()
 
-    async def timeout_task(self):
-        await asyncio.sleep(7)
-        await self.auto_move()
+    async def on_pass_timeout(self, round_number: int):
+        if round_number == self.round_number and self.waiting_for_pass:
+            metrics.timeouts.inc("pass")
+            await self.finish_pass()
+            await self.next_turn()
 
     async def pass_cards(self, player: Player, cards):
         if not self.waiting_for_pass:
             raise ValueError("Cannot pass cards")
         if len(cards) != 3:
             raise ValueError("Should be 3 cards")
-        for card in cards:
-            try:
-                player.hand.pop(player.hand.index(card))
-            except ValueError:
-                raise ValueError("You don't have that card")
+        player.hand |= player.pass_cards
+        player.pass_cards = 0
+        mask = to_mask(cards)
+        if mask.bit_count() != 3:
+            raise ValueError("Should be 3 cards")
+        if mask & ~player.hand:
+            raise ValueError("You don't have that card")
+        player.hand &= ~mask
+        player.pass_cards = mask
+        self.touch()
+        if all(p.auto_move or p.pass_cards for p in self.players):
+            await self.finish_pass()
+            await self.next_turn()
 
 public_methods = (
     "message",
     "player_move",
     "pass_cards",
     "notify_state",
+    "sync",
     "leave",
     "vote_to_start",
 )
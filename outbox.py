@@ -0,0 +1,213 @@
+import asyncio
+import heapq
+import logging
+from collections import OrderedDict, deque
+from typing import Hashable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import SetChatMenuButton, TelegramMethod
+from aiogram.types import MenuButton
+
+from engine import Clock, real_clock
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+MESSAGES = ("send", "forward", "copy")
+
+
+class Call:
+    __slots__ = ("chat_id", "method", "key", "future", "attempts")
+
+    def __init__(self, chat_id: int, method: TelegramMethod, key: Hashable | None):
+        self.chat_id = chat_id
+        self.method = method
+        self.key = key
+        self.future = asyncio.get_running_loop().create_future()
+        self.attempts = 0
+
+
+class Outbox:
+    # Outgoing Bot API calls, queued per chat. Calls go out no faster than
+    # rate per second overall and messages one per chat_interval per chat,
+    # in order within a chat, with up to concurrency of them in flight. A 429 holds
+    # back the chat it was for by its retry_after, or every chat if it came
+    # for a call with no chat (chat_id 0), and the call is sent again;
+    # network and server errors are retried with backoff up to attempts
+    # times. A call queued under a key replaces the one still waiting under
+    # the same key.
+    def __init__(
+        self,
+        rate: float = 25.0,
+        chat_interval: float = 1.0,
+        concurrency: int = 8,
+        attempts: int = 5,
+        clock: Clock = real_clock,
+    ):
+        self.bot: Bot | None = None
+        self.chat_interval = chat_interval
+        self.attempts = attempts
+        self.clock = clock
+        self.bucket = TokenBucket(rate, rate, clock.now())
+        self.slots = asyncio.Semaphore(concurrency)
+        self.queues: dict[int, deque[Call]] = {}
+        self.keys: dict[Hashable, Call] = {}
+        # chats waiting for their turn: (not before, order, chat_id)
+        self.ready: list[tuple[float, int, int]] = []
+        # chats in ready or with a call in flight
+        self.busy: set[int] = set()
+        self.next_at: dict[int, float] = {}
+        self.paused_until = 0.0
+        self.order = 0
+        self.wake = asyncio.Event()
+        self.inflight: set[asyncio.Task] = set()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.replaced = 0
+        self._task: asyncio.Task | None = None
+
+    def send(self, chat_id: int, method: TelegramMethod, key: Hashable | None = None) -> asyncio.Future:
+        if key is not None and (call := self.keys.get(key)) is not None:
+            call.method = method
+            self.replaced += 1
+            return call.future
+        call = Call(chat_id, method, key)
+        if key is not None:
+            self.keys[key] = call
+        self.queues.setdefault(chat_id, deque()).append(call)
+        if chat_id not in self.busy:
+            self._schedule(chat_id, self.clock.now())
+        return call.future
+
+    def _schedule(self, chat_id: int, at: float):
+        self.busy.add(chat_id)
+        self.order += 1
+        heapq.heappush(self.ready, (max(at, self.next_at.get(chat_id, 0.0)), self.order, chat_id))
+        self.wake.set()
+
+    async def _sleep(self, seconds: float):
+        # woken early when something new is queued
+        self.wake.clear()
+        try:
+            await asyncio.wait_for(self.wake.wait(), seconds)
+        except TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            now = self.clock.now()
+            if not self.ready:
+                # idle: forget the chats that may send again
+                self.next_at = {c: t for c, t in self.next_at.items() if t > now}
+                await self._sleep(3600)
+                continue
+            at = max(self.ready[0][0], self.paused_until)
+            if at > now:
+                await self._sleep(at - now)
+                continue
+            if not self.bucket.take(now):
+                await self.clock.sleep(1 / self.bucket.rate)
+                continue
+            await self.slots.acquire()
+            _, _, chat_id = heapq.heappop(self.ready)
+            call = self.queues[chat_id].popleft()
+            if call.key is not None:
+                self.keys.pop(call.key, None)
+            task = asyncio.create_task(self._send(call))
+            self.inflight.add(task)
+            task.add_done_callback(self.inflight.discard)
+
+    async def _send(self, call: Call):
+        chat_id = call.chat_id
+        # Telegram's per-chat limit is on messages; other calls only keep order
+        delay = self.chat_interval if call.method.__api_method__.startswith(MESSAGES) else 0.0
+        try:
+            result = await self.bot(call.method)
+        except TelegramRetryAfter as e:
+            self.retried += 1
+            delay = e.retry_after
+            if not chat_id:
+                self.paused_until = self.clock.now() + delay
+            self.queues[chat_id].appendleft(call)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            call.attempts += 1
+            if call.attempts < self.attempts:
+                self.retried += 1
+                delay = min(30.0, 2.0**call.attempts)
+                self.queues[chat_id].appendleft(call)
+            else:
+                self.failed += 1
+                if not call.future.done():
+                    call.future.set_exception(e)
+        except Exception as e:
+            # a bad request stays bad; the caller sees why
+            self.failed += 1
+            if not call.future.done():
+                call.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not call.future.done():
+                call.future.set_result(result)
+        finally:
+            self.slots.release()
+            self.next_at[chat_id] = max(self.next_at.get(chat_id, 0.0), self.clock.now() + delay)
+            if self.queues[chat_id]:
+                self._schedule(chat_id, self.next_at[chat_id])
+            else:
+                self.busy.discard(chat_id)
+                del self.queues[chat_id]
+
+    def start(self, bot: Bot):
+        self.bot = bot
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = 5.0):
+        # gives what is queued a little time to go out
+        deadline = self.clock.now() + timeout
+        while (self.ready or self.inflight) and self.clock.now() < deadline:
+            await self.clock.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "queued": sum(len(q) for q in self.queues.values()),
+            "chats": len(self.queues),
+            "inflight": len(self.inflight),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "replaced": self.replaced,
+        }
+
+
+class MenuButtons:
+    # The menu button last set for each chat, so it is only set again when
+    # it changes; a change still waiting in the outbox is replaced.
+    def __init__(self, outbox: Outbox, size: int = 100_000):
+        self.outbox = outbox
+        self.size = size
+        self.buttons: OrderedDict[int, MenuButton] = OrderedDict()
+        self.skipped = 0
+
+    def set(self, chat_id: int, button: MenuButton) -> asyncio.Future | None:
+        if self.buttons.get(chat_id) == button:
+            self.buttons.move_to_end(chat_id)
+            self.skipped += 1
+            return None
+        self.buttons[chat_id] = button
+        self.buttons.move_to_end(chat_id)
+        while len(self.buttons) > self.size:
+            self.buttons.popitem(last=False)
+        future = self.outbox.send(chat_id, SetChatMenuButton(chat_id=chat_id, menu_button=button), key=("menu", chat_id))
+        future.add_done_callback(lambda f: self._failed(chat_id, button, f))
+        return future
+
+    def _failed(self, chat_id: int, button: MenuButton, future: asyncio.Future):
+        if future.cancelled() or future.exception() is not None:
+            if self.buttons.get(chat_id) == button:
+                del self.buttons[chat_id]
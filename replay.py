@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Iterable, Iterator, NamedTuple
+
+from cards import BIT, HEARTS, INDEX, QUEEN_OF_SPADES, TWO_OF_CLUBS, deal, legal_moves, to_mask, trick_winner
+from engine import NullNotifier, ReplayClock
+from events import EventWriter
+from models import Game, Player
+
+# A game is fully described by its seed, the cards passed and the cards
+# played: everything else follows from the rules. Replays rebuild the Game
+# step by step; rescoring re-runs only the rules on bit masks, fast enough
+# to go through an archive of games on a process pool.
+
+PASS_TO = Game.__private_attributes__["_pass_to"].default
+
+
+class Record(NamedTuple):
+    game: str
+    seed: int
+    players: tuple[int, ...]
+    max_score: int
+    passes: tuple[tuple[int, int, int, int], ...]  # per passing round, by seat
+    moves: tuple[int, ...]
+
+    @classmethod
+    def from_events(cls, events: Iterable[dict]) -> "Record":
+        passes: list[list[int]] = []
+        moves: list[int] = []
+        start = None
+        for event in sorted(events, key=lambda e: e["seq"]):
+            data = event["data"]
+            match event["event"]:
+                case "start":
+                    start = event
+                case "deal":
+                    passing = None
+                case "pass":
+                    if passing is None:
+                        passing = [0] * 4
+                        passes.append(passing)
+                    passing[data["seat"]] = to_mask(data["cards"])
+                case "move":
+                    moves.append(INDEX[data["card"]])
+        if start is None:
+            raise ValueError("No start event")
+        return cls(
+            start["game"],
+            start["data"]["seed"],
+            tuple(start["data"]["players"]),
+            start["data"]["max_score"],
+            tuple(tuple(p) for p in passes),
+            tuple(moves),
+        )
+
+
+def run(coro):
+    # Nothing awaited during a replay ever suspends, so the coroutine
+    # finishes on its first step without an event loop.
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("Replay step suspended")
+
+
+def replay(record: Record) -> Iterator[Game]:
+    # Yields the same Game after the deal, after every pass and after every
+    # move; copy it if a step has to be kept.
+    game = Game(id=record.game, seed=record.seed, max_score=record.max_score).bind(NullNotifier(), ReplayClock())
+    game._endgame_tricks = 0
+    for seat, telegram_id in enumerate(record.players):
+        # bots share a telegram_id, so the name keeps the join seat
+        game.players.append(Player(telegram_id=telegram_id, display_name=str(seat)))
+    run(game.start())
+    yield game
+    passes, moves = iter(record.passes), iter(record.moves)
+    while not game.ended_at:
+        if game.waiting_for_pass:
+            if (passing := next(passes, None)) is None:
+                return
+            for seat, mask in enumerate(passing):
+                run(game.pass_cards(game.players[seat], [i for i in range(52) if mask & BIT[i]]))
+        else:
+            if (card := next(moves, None)) is None:
+                return
+            run(game.move(card))
+        yield game
+
+
+class Rules(NamedTuple):
+    heart: int = 1
+    queen: int = 13
+    moon: bool = True
+    max_score: int | None = None  # None: as the game was played
+
+
+class Score(NamedTuple):
+    game: str
+    totals: tuple[int, int, int, int]  # by seat in join order
+    rounds: int
+    finished: bool
+    illegal: int | None = None  # index of the first move the rules reject
+
+
+def rescore(record: Record, rules: Rules = Rules()) -> Score:
+    # Game.deal() and Game.play() on masks: order[i] is the join seat now at
+    # position i, which is rotated to the 2c holder and to every trick taker.
+    rng = random.Random(record.seed)
+    max_score = rules.max_score or record.max_score
+    everything = 13 * rules.heart + rules.queen
+    totals = [0] * 4
+    order = [0, 1, 2, 3]
+    passes, moves = iter(record.passes), iter(record.moves)
+    played = rounds = 0
+    while True:
+        hands = deal(rng)
+        first = next(i for i, hand in enumerate(hands) if hand & TWO_OF_CLUBS)
+        hands = hands[first:] + hands[:first]
+        order = order[first:] + order[:first]
+        pass_to = PASS_TO[rounds % 4]
+        rounds += 1
+        if pass_to:
+            if (passing := next(passes, None)) is None:
+                return Score(record.game, tuple(totals), rounds, False)
+            for seat, mask in enumerate(passing):
+                if mask.bit_count() != 3 or mask & ~hands[seat]:
+                    return Score(record.game, tuple(totals), rounds, False, played)
+                hands[seat] &= ~mask
+            for seat, mask in enumerate(passing):
+                hands[(seat + pass_to) % 4] |= mask
+        scores = [0] * 4
+        opened = False
+        for _ in range(13):
+            table = []
+            for seat in range(4):
+                if (card := next(moves, None)) is None:
+                    return Score(record.game, tuple(totals), rounds, False)
+                if not legal_moves(hands[seat], table, opened) & BIT[card]:
+                    return Score(record.game, tuple(totals), rounds, False, played)
+                hands[seat] &= ~BIT[card]
+                table.append(card)
+                played += 1
+            taken = to_mask(table)
+            score = (taken & HEARTS).bit_count() * rules.heart + (rules.queen if taken & QUEEN_OF_SPADES else 0)
+            took = trick_winner(table)
+            if taken & (HEARTS | QUEEN_OF_SPADES):
+                opened = True
+            scores[order[took]] += score
+            hands = hands[took:] + hands[:took]
+            order = order[took:] + order[:took]
+        if rules.moon and everything in scores:
+            shooter = scores.index(everything)
+            scores = [0 if seat == shooter else everything for seat in range(4)]
+        for seat in range(4):
+            totals[seat] += scores[seat]
+        if max(totals) >= max_score:
+            return Score(record.game, tuple(totals), rounds, True)
+
+
+def rescore_many(records: list[Record], rules: Rules) -> list[Score]:
+    return [rescore(record, rules) for record in records]
+
+
+def batch(records: list[Record], rules: Rules = Rules(), workers: int = 1, chunk: int = 500) -> list[Score]:
+    if workers <= 1:
+        return rescore_many(records, rules)
+    chunks = [records[i : i + chunk] for i in range(0, len(records), chunk)]
+    with ProcessPoolExecutor(workers, mp_context=get_context("spawn")) as pool:
+        return [score for scores in pool.map(rescore_many, chunks, [rules] * len(chunks)) for score in scores]
+
+
+def load(path: str) -> list[Record]:
+    # one event per line, as the event log stores them
+    games: dict[str, list[dict]] = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            event = json.loads(line)
+            games[event["game"]].append(event)
+    return [Record.from_events(events) for events in games.values()]
+
+
+async def generate(path: str, games: int):
+    # bot-only games played headless, logged as they would be in production
+    log = EventWriter()
+    for _ in range(games):
+        game = Game().bind(NullNotifier(), ReplayClock(), log=log)
+        for _ in range(4):
+            await game.submit("join", player=Player.get_bot())
+        await game.submit("start")
+    await log.close()
+    with open(path, "w") as f:
+        for event in log.backend.documents:
+            f.write(json.dumps(event, default=str) + "\n")
+
+
+def verify(record: Record) -> bool:
+    # the fast rules against the full engine
+    for game in replay(record):
+        pass
+    totals = [0] * 4
+    for p in game.players:
+        totals[int(p.display_name)] = p.total
+    score = rescore(record)
+    return score.finished == bool(game.ended_at) and score.totals == tuple(totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay and re-score archived games")
+    commands = parser.add_subparsers(dest="command", required=True)
+    gen = commands.add_parser("generate", help="log bot-only games to a file")
+    gen.add_argument("path")
+    gen.add_argument("-n", "--games", type=int, default=1000)
+    score = commands.add_parser("rescore", help="re-score logged games")
+    score.add_argument("path")
+    score.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    score.add_argument("--heart", type=int, default=1, help="points per heart")
+    score.add_argument("--queen", type=int, default=13, help="points for the queen of spades")
+    score.add_argument("--no-moon", action="store_true")
+    score.add_argument("--max-score", type=int)
+    score.add_argument("--verify", type=int, default=0, help="also replay this many games through Game")
+    args = parser.parse_args()
+    if args.command == "generate":
+        asyncio.run(generate(args.path, args.games))
+        return
+    records = load(args.path)
+    rules = Rules(args.heart, args.queen, not args.no_moon, args.max_score)
+    started = time.perf_counter()
+    scores = batch(records, rules, args.workers)
+    elapsed = time.perf_counter() - started
+    print(f"games: {len(scores)}")
+    print(f"seconds: {elapsed:.2f}")
+    print(f"games_per_hour: {len(scores) / elapsed * 3600:.0f}")
+    print(f"unfinished: {sum(not s.finished for s in scores)}")
+    print(f"illegal: {sum(s.illegal is not None for s in scores)}")
+    if args.verify:
+        mismatches = sum(not verify(record) for record in records[: args.verify])
+        print(f"verified: {min(args.verify, len(records))} mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends
-from starlette.responses import HTMLResponse
+from fastapi import APIRouter, Depends, HTTPException, Query
+from starlette.responses import HTMLResponse, Response
 from typing import Annotated
 
+import metrics
 from models import games_by_player, Game, Chat, Player, players
+from leaderboards import leaderboards
+from users import history, stats, users
+from ws import manager
 
 
 
@@ -23,28 +27,68 @@ async def root():
     return open('static/index.html').read()
 
 @api_router.post("/leave")
-async def leave(game: Annotated[Game, Depends(get_game)]):
-    await game.leave()
+async def leave(player: Annotated[Player, Depends(get_current_player)], game: Annotated[Game, Depends(get_game)]):
+    await game.submit("leave", player=player)
 
 
 @api_router.post("/chat")
 async def chat(msg: Chat, player: Annotated[Player, Depends(get_current_player)], game: Annotated[Game, Depends(get_game)]):
     msg.player = player
-    await game.chat(msg)
+    await game.submit("chat", chat_message=msg)
+
+@api_router.get("/chat")
+async def chat_history(
+    player: Annotated[Player, Depends(get_current_player)],
+    game: Annotated[Game, Depends(get_game)],
+    before: int | None = None,
+    limit: Annotated[int, Query(ge=1, le=100)] = 50,
+):
+    if game is None:
+        raise HTTPException(404, "Not at a table")
+    messages = game.chat_page(player, before, limit)
+    return {"messages": messages, "before": messages[0].id if messages else None}
 
 @api_router.post("/move")
 async def move(card: str, player: Annotated[Player, Depends(get_current_player)], game: Annotated[Game, Depends(get_game)]):
-    await game.player_move(player, card)
+    await game.submit("player_move", player=player, card=card)
 
 @api_router.post("/vote_to_start")
 async def vote_to_start(player: Annotated[Player, Depends(get_current_player)], game: Annotated[Game, Depends(get_game)]):
-    await game.vote_to_start(player)
+    await game.submit("vote_to_start", player=player)
 
 
 @api_router.post("/pass_cards")
 async def pass_cards(cards: list[str], player: Annotated[Player, Depends(get_current_player)], game: Annotated[Game, Depends(get_game)]):
-    await game.pass_cards(player, cards)
+    await game.submit("pass_cards", player=player, cards=cards)
+
+@api_router.get("/lobby")
+async def lobby_stats():
+    return manager.lobby.stats()
+
+@api_router.get("/sessions")
+async def session_stats():
+    return manager.stats()
+
+@api_router.get("/users/stats")
+async def user_stats():
+    return {"cache": users.stats(), "history": history.stats()}
 
 @api_router.post("/state")
 async def get_state(game: Annotated[Game, Depends(get_game)]) -> Game:
     return game
+
+@api_router.get("/leaderboards/{board}")
+async def leaderboard(board: str, offset: Annotated[int, Query(ge=0)] = 0, limit: Annotated[int, Query(ge=1, le=100)] = 50):
+    if (page := leaderboards.page(board, offset, limit)) is None:
+        raise HTTPException(404, "Unknown leaderboard")
+    return page
+
+@api_router.get("/players/{telegram_id}/stats")
+async def player_stats(telegram_id: int):
+    if (user := await users.find(telegram_id)) is None:
+        raise HTTPException(404, "Unknown player")
+    return stats(user)
+
+@api_router.get("/metrics")
+async def prometheus_metrics():
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from typing import Protocol
+
+
+class Backend(Protocol):
+    async def get(self, key: str) -> str | None: ...
+
+    async def set(self, key: str, value: str): ...
+
+    async def delete(self, key: str): ...
+
+    async def incr(self, key: str) -> int: ...
+
+    async def purge(self, prefix: str, value: str): ...
+
+
+class InProcessBackend:
+    def __init__(self):
+        self.data: dict[str, str] = {}
+
+    async def get(self, key: str) -> str | None:
+        return self.data.get(key)
+
+    async def set(self, key: str, value: str):
+        self.data[key] = value
+
+    async def delete(self, key: str):
+        self.data.pop(key, None)
+
+    async def incr(self, key: str) -> int:
+        value = int(self.data.get(key, 0)) + 1
+        self.data[key] = str(value)
+        return value
+
+    async def purge(self, prefix: str, value: str):
+        for key in [k for k, v in self.data.items() if v == value and k.startswith(prefix)]:
+            del self.data[key]
+
+
+class UnixSocketBackend:
+    # Client for BackendServer: one JSON request per line, answered in order.
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = asyncio.Lock()
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+
+    async def call(self, op: str, *args):
+        async with self.lock:
+            if self.writer is None or self.writer.is_closing():
+                self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+            self.writer.write(json.dumps([op, *args]).encode() + b"\n")
+            await self.writer.drain()
+            line = await self.reader.readline()
+            if not line:
+                self.writer = None
+                raise ConnectionError("Shard backend went away")
+            return json.loads(line)
+
+    async def get(self, key: str) -> str | None:
+        return await self.call("get", key)
+
+    async def set(self, key: str, value: str):
+        await self.call("set", key, value)
+
+    async def delete(self, key: str):
+        await self.call("delete", key)
+
+    async def incr(self, key: str) -> int:
+        return await self.call("incr", key)
+
+    async def purge(self, prefix: str, value: str):
+        await self.call("purge", prefix, value)
+
+
+class BackendServer:
+    def __init__(self, path: str, backend: InProcessBackend | None = None):
+        self.path = path
+        self.backend = backend or InProcessBackend()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                op, *args = json.loads(line)
+                result = await getattr(self.backend, op)(*args)
+                writer.write(json.dumps(result).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self.handle, self.path)
+        async with server:
+            await server.serve_forever()
+
+
+class ShardRouter:
+    # A player is owned by the worker holding their table. New players are
+    # spread across workers in groups of four per lobby criteria, so that
+    # consecutive arrivals land on the same worker and fill a table there.
+    def __init__(self, worker_id: int = 0, workers: int = 1, backend: Backend | None = None, url_template: str = "", base_port: int = 8080):
+        self.worker_id = worker_id
+        self.workers = workers
+        self.backend = backend or InProcessBackend()
+        self.url_template = url_template
+        self.base_port = base_port
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 1
+
+    def url(self, worker_id: int) -> str:
+        return self.url_template.format(worker=worker_id, port=self.base_port + worker_id)
+
+    async def owner(self, telegram_id: int, criteria: tuple) -> int:
+        if not self.enabled:
+            return self.worker_id
+        if (worker := await self.backend.get(f"player:{telegram_id}")) is not None:
+            return int(worker)
+        arrivals = await self.backend.incr(f"lobby:{':'.join(map(str, criteria))}")
+        worker = (arrivals - 1) // 4 % self.workers
+        # remember the choice so the redirected connection is not routed again
+        await self.backend.set(f"player:{telegram_id}", str(worker))
+        return worker
+
+    async def claim(self, telegram_id: int):
+        if self.enabled:
+            await self.backend.set(f"player:{telegram_id}", str(self.worker_id))
+
+    async def release(self, telegram_id: int):
+        if self.enabled:
+            await self.backend.delete(f"player:{telegram_id}")
+
+
+def run_worker(worker_id: int, workers: int, base_port: int, backend_path: str):
+    os.environ.update(
+        SHARD_WORKER_ID=str(worker_id),
+        SHARD_WORKERS=str(workers),
+        SHARD_BACKEND=backend_path,
+        SHARD_BASE_PORT=str(base_port),
+    )
+    import uvicorn
+
+    uvicorn.run("app:app", host="0.0.0.0", port=base_port + worker_id)
+
+
+async def supervise(workers: int, base_port: int, backend_path: str):
+    # Each worker is its own process: a crash loses that worker's tables only,
+    # its players are forgotten by the backend and the worker is restarted.
+    server = BackendServer(backend_path)
+    serving = asyncio.create_task(server.serve())
+    ctx = multiprocessing.get_context("spawn")
+    processes: dict[int, multiprocessing.Process] = {}
+    try:
+        while True:
+            for worker_id in range(workers):
+                process = processes.get(worker_id)
+                if process is None or not process.is_alive():
+                    if process is not None:
+                        await server.backend.purge("player:", str(worker_id))
+                    process = ctx.Process(
+                        target=run_worker,
+                        args=(worker_id, workers, base_port, backend_path),
+                        daemon=True,
+                    )
+                    process.start()
+                    processes[worker_id] = process
+            await asyncio.sleep(1)
+    finally:
+        serving.cancel()
+        for process in processes.values():
+            process.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run one game worker per core behind a shared shard backend")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("-p", "--port", type=int, default=8080, help="port of the first worker")
+    parser.add_argument("--backend", default="/tmp/hearts-shards.sock")
+    args = parser.parse_args()
+    asyncio.run(supervise(args.workers, args.port, args.backend))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import asyncio
+import time
+
+from engine import NullNotifier, RecordingNotifier, VirtualClock
+from models import Game, Player
+
+
+async def play_game(notifier=None, clock=None) -> Game:
+    game = Game().bind(notifier or NullNotifier(), clock or VirtualClock())
+    for _ in range(4):
+        await game.submit("join", player=Player.get_bot())
+    # the fourth join queued the start; this resolves once it has played out
+    await game.submit("start")
+    return game
+
+
+async def run(games: int, record: bool = False) -> dict:
+    rounds = events = sent = 0
+    started = time.perf_counter()
+    for _ in range(games):
+        notifier = RecordingNotifier() if record else NullNotifier()
+        game = await play_game(notifier)
+        rounds += game.round_number
+        if record:
+            events += len(notifier.events)
+            sent += sum(len(n.model_dump_json(exclude_none=True)) for _, n in notifier.events)
+    elapsed = time.perf_counter() - started
+    return {
+        "games": games,
+        "seconds": round(elapsed, 3),
+        "games_per_sec": round(games / elapsed, 1),
+        "rounds_per_game": round(rounds / games, 2),
+        "events": events,
+        "bytes_per_game": sent // games,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play bot-only games headless")
+    parser.add_argument("-n", "--games", type=int, default=100)
+    parser.add_argument("--record", action="store_true", help="record notifications instead of dropping them")
+    args = parser.parse_args()
+    result = asyncio.run(run(args.games, args.record))
+    for k, v in result.items():
+        print(f"{k}: {v}")
+
+
+if __name__ == "__main__":
+    main()
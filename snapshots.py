@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import os
+import random
+import struct
+import time
+from datetime import datetime
+from typing import Callable, Sequence
+
+from bots import Bot
+from cards import SUIT_MASKS
+from engine import Clock, Notifier, real_clock
+from events import EventWriter
+from models import Game, Player, games_by_player, players
+
+logger = logging.getLogger(__name__)
+
+# Snapshot file: MAGIC, table count, then per table its length and record.
+# A record is GAME, the cards on the table, then per player PLAYER, the
+# display name and the round scores. Times are epoch seconds, 0 for none.
+MAGIC = b"HSNP\x01"
+COUNT = struct.Struct("<I")
+# id, seed, started_at, turn_deadline, played, max_score, round_number,
+# _turn, _pass_index, _logged, seq, flags, table size, player count
+GAME = struct.Struct("<16sQddQHHIBIIBBB")
+# telegram_id, hand, pass_cards, void suits, flags, name length, rounds
+PLAYER = struct.Struct("<qQQBBBB")
+OPENED, PASSING = 1, 2
+AUTO, BOT = 1, 2
+
+
+def encode(game: Game) -> bytes:
+    table = bytes(game.table)
+    parts = [
+        GAME.pack(
+            bytes.fromhex(game.id),
+            game.seed,
+            game.started_at.timestamp(),
+            game.turn_deadline.timestamp() if game.turn_deadline else 0.0,
+            game.played,
+            game.max_score,
+            game.round_number,
+            game._turn,
+            game._pass_index,
+            game._logged,
+            game.seq,
+            game.score_opened * OPENED | game.waiting_for_pass * PASSING,
+            len(table),
+            len(game.players),
+        ),
+        table,
+    ]
+    for p in game.players:
+        name = (p.display_name or "").encode()[:255]
+        voids = sum(1 << suit for suit, mask in enumerate(SUIT_MASKS) if p.voids & mask)
+        parts.append(
+            PLAYER.pack(
+                p.telegram_id, p.hand, p.pass_cards, voids, p.auto_move * AUTO | p.is_bot * BOT, len(name), len(p.scores)
+            )
+        )
+        parts.append(name)
+        parts.append(struct.pack(f"<{len(p.scores)}h", *p.scores))
+    return b"".join(parts)
+
+
+def decode(data: bytes) -> Game:
+    (
+        id, seed, started_at, deadline, played, max_score, round_number,
+        turn, pass_index, logged, seq, flags, table_size, count,
+    ) = GAME.unpack_from(data)
+    offset = GAME.size
+    game = Game(
+        id=id.hex(),
+        seed=seed,
+        started_at=datetime.fromtimestamp(started_at),
+        turn_deadline=datetime.fromtimestamp(deadline) if deadline else None,
+        played=played,
+        max_score=max_score,
+        round_number=round_number,
+        table=list(data[offset : offset + table_size]),
+        score_opened=bool(flags & OPENED),
+        waiting_for_pass=bool(flags & PASSING),
+        seq=seq,
+    )
+    offset += table_size
+    for _ in range(count):
+        telegram_id, hand, pass_cards, voids, flags, name_size, rounds = PLAYER.unpack_from(data, offset)
+        offset += PLAYER.size
+        name = data[offset : offset + name_size].decode()
+        offset += name_size
+        scores = list(struct.unpack_from(f"<{rounds}h", data, offset))
+        offset += 2 * rounds
+        game.players.append(
+            Player(
+                telegram_id=telegram_id,
+                display_name=name,
+                hand=hand,
+                pass_cards=pass_cards,
+                voids=sum(mask for suit, mask in enumerate(SUIT_MASKS) if voids >> suit & 1),
+                scores=scores,
+                auto_move=bool(flags & AUTO),
+                is_bot=bool(flags & BOT),
+            )
+        )
+    game._turn, game._pass_index, game._logged = turn, pass_index, logged
+    # The generator is only used by deal(), so replaying the deals so far
+    # brings it back to where it was; their shuffles are all that draws.
+    rng = random.Random(seed)
+    deck = list(range(52))
+    for _ in range(round_number):
+        rng.shuffle(deck)
+    game._rng = rng
+    return game
+
+
+def write(path: str, data: bytes):
+    # a crash mid-write leaves the previous snapshot in place
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read(path: str) -> list[bytes]:
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a table snapshot")
+    (count,) = COUNT.unpack_from(data, len(MAGIC))
+    offset = len(MAGIC) + COUNT.size
+    records = []
+    for _ in range(count):
+        (size,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        records.append(data[offset : offset + size])
+        offset += size
+    return records
+
+
+class Snapshotter:
+    # Every interval the started tables that still have a human are encoded
+    # on the loop and the file is written from a thread. A table is only
+    # encoded again once its version, seq or log position has moved, and only
+    # while its runner is idle: mid-command (a finished trick waiting out its
+    # pause) the previous record is kept, so the file is always consistent.
+    # The loop is given back every chunk tables, each encoded whole.
+    def __init__(self, path: str = "", interval: float = 5.0, clock: Clock = real_clock, chunk: int = 500):
+        self.path = path
+        self.interval = interval
+        self.clock = clock
+        self.chunk = chunk
+        self.encoded: dict[str, tuple[tuple, bytes]] = {}
+        self.restored: dict[str, Game] = {}
+        self.saved = 0
+        self.encode_seconds = 0.0
+        self.write_seconds = 0.0
+        self.size = 0
+        self._task: asyncio.Task | None = None
+
+    def live(self) -> list[Game]:
+        # restored tables are held here until they end; no socket refers to them yet
+        self.restored = {k: g for k, g in self.restored.items() if not g.ended_at}
+        tables = {id(g): g for g in (*games_by_player.values(), *self.restored.values())}
+        return [
+            g
+            for g in tables.values()
+            if g.started_at and not g.ended_at and any(not p.auto_move for p in g.players)
+        ]
+
+    async def snapshot(self) -> bytes:
+        started = time.perf_counter()
+        encoded = {}
+        for i, game in enumerate(self.live()):
+            if i and not i % self.chunk:
+                await asyncio.sleep(0)
+            # read straight from pydantic's storage, as touch() does: these
+            # checks run for every table on every pass
+            private = game.__pydantic_private__
+            stamp = (game.version, game.seq, private["_logged"])
+            cached = self.encoded.get(game.id)
+            runner = private["_runner"]
+            idle = not private["_inbox"] and (runner is None or runner.done())
+            if cached is None or (cached[0] != stamp and idle):
+                if not idle:
+                    continue
+                cached = (stamp, encode(game))
+            encoded[game.id] = cached
+        self.encoded = encoded
+        parts = [MAGIC, COUNT.pack(len(encoded))]
+        for _, record in encoded.values():
+            parts.append(COUNT.pack(len(record)))
+            parts.append(record)
+        self.encode_seconds = time.perf_counter() - started
+        return b"".join(parts)
+
+    async def save(self):
+        data = await self.snapshot()
+        started = time.perf_counter()
+        await asyncio.to_thread(write, self.path, data)
+        self.write_seconds = time.perf_counter() - started
+        self.size = len(data)
+        self.saved += 1
+
+    async def _run(self):
+        while True:
+            await self.clock.sleep(self.interval)
+            try:
+                await self.save()
+            except Exception:
+                logger.exception("Table snapshot failed")
+
+    def start(self):
+        if self.path and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.path:
+            await self.save()
+
+    async def restore(
+        self,
+        notifier: Notifier | None = None,
+        bot: Bot | None = None,
+        log: EventWriter | None = None,
+        on_finish: Sequence[Callable[[Game], object]] = (),
+    ) -> list[Game]:
+        if not self.path:
+            return []
+        games = [decode(record) for record in await asyncio.to_thread(read, self.path)]
+        for game in games:
+            game.bind(notifier, self.clock, bot, log, on_finish)
+            for p in game.players:
+                if not p.is_bot:
+                    players[p.telegram_id] = p
+                    games_by_player[p.telegram_id] = game
+            self.restored[game.id] = game
+            game.submit("resume")
+        return games
+
+    def stats(self) -> dict:
+        return {
+            "tables": len(self.encoded),
+            "saved": self.saved,
+            "bytes": self.size,
+            "encode_ms": round(self.encode_seconds * 1e3, 2),
+            "write_ms": round(self.write_seconds * 1e3, 2),
+        }
+
+
+snapshots = Snapshotter()
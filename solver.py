@@ -0,0 +1,179 @@
+import math
+import random
+from typing import NamedTuple, TYPE_CHECKING
+
+from bots import Bot, Observation, determinize, greedy_move, heuristic
+from cards import BIT, PENALTY, SUIT, iter_cards, legal_moves, points, trick_winner
+
+if TYPE_CHECKING:
+    from models import Game, Player
+
+EXACT, LOWER, UPPER = 0, 1, 2
+# moon state: nobody has taken points yet, or they are split between seats;
+# otherwise the seat holding all of them so far
+NOBODY, SPLIT = -1, -2
+
+
+def moon_state(scores: tuple[int, ...] | list[int]) -> int:
+    takers = [seat for seat, score in enumerate(scores) if score]
+    if not takers:
+        return NOBODY
+    return takers[0] if len(takers) == 1 else SPLIT
+
+
+class Position(NamedTuple):
+    # Seats are absolute; leader is the seat that led the trick on the table.
+    hands: tuple[int, int, int, int]
+    table: tuple[int, ...]
+    leader: int
+    score_opened: bool
+    scores: tuple[int, int, int, int]
+
+    @property
+    def turn(self) -> int:
+        return (self.leader + len(self.table)) % 4
+
+
+class Solver:
+    # Paranoid alpha-beta: the root seat minimizes its own round score and
+    # the other three play together to maximize it. Scores follow deal():
+    # whoever takes all 26 points scores 0 and everybody else 26.
+    #
+    # Values are the root's points still to come, so a transposition entry
+    # does not depend on how many it already has. With the moon state in the
+    # key that is enough to finish the round.
+    def __init__(self):
+        self.transpositions: dict[tuple, tuple[int, int]] = {}
+        self.nodes = 0
+        self.me = 0
+
+    def values(self, position: Position) -> dict[int, int]:
+        # Final round score of the seat to move for each of its legal moves.
+        self.me = position.turn
+        self.transpositions.clear()
+        hands, table, leader, opened, scores = position
+        moon = moon_state(scores)
+        return {
+            card: scores[self.me] + self.play(hands, table, leader, opened, moon, card, -math.inf, math.inf)
+            for card in iter_cards(legal_moves(hands[self.me], list(table), opened))
+        }
+
+    def best_move(self, position: Position) -> tuple[int, int]:
+        values = self.values(position)
+        card = min(values, key=values.__getitem__)
+        return card, values[card]
+
+    def play(self, hands, table, leader, opened, moon, card, alpha, beta) -> int:
+        seat = (leader + len(table)) % 4
+        hands = (*hands[:seat], hands[seat] & ~BIT[card], *hands[seat + 1 :])
+        table = (*table, card)
+        if len(table) < 4:
+            return self.search(hands, table, leader, opened, moon, alpha, beta)
+        taken = points(sum(BIT[c] for c in table))
+        winner = (leader + trick_winner(list(table))) % 4
+        gained = taken if winner == self.me else 0
+        if taken:
+            opened = True
+            moon = winner if moon in (NOBODY, winner) else SPLIT
+        return gained + self.search(hands, (), winner, opened, moon, alpha - gained, beta - gained)
+
+    def search(self, hands, table, leader, opened, moon, alpha, beta) -> int:
+        self.nodes += 1
+        if not table and not hands[leader]:
+            if moon == self.me:
+                return -26
+            return 26 if moon >= 0 else 0
+        key = (hands, table, leader, opened, moon)
+        if entry := self.transpositions.get(key):
+            value, bound = entry
+            if bound == EXACT or (bound == LOWER and value >= beta) or (bound == UPPER and value <= alpha):
+                return value
+        seat = (leader + len(table)) % 4
+        minimizing = seat == self.me
+        start_alpha, start_beta = alpha, beta
+        best = math.inf if minimizing else -math.inf
+        for card in self.moves(hands, table, opened, seat):
+            value = self.play(hands, table, leader, opened, moon, card, alpha, beta)
+            if minimizing:
+                best = min(best, value)
+                beta = min(beta, value)
+            else:
+                best = max(best, value)
+                alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+        if best <= start_alpha:
+            bound = UPPER
+        elif best >= start_beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.transpositions[key] = (best, bound)
+        return best
+
+    def moves(self, hands, table, opened, seat) -> list[int]:
+        # Touching cards of a suit are interchangeable when nothing still in
+        # play lies between them and they score the same, so only the
+        # lowest of each run is tried. The greedy choice goes first.
+        legal = legal_moves(hands[seat], list(table), opened)
+        live = hands[0] | hands[1] | hands[2] | hands[3]
+        for card in table:
+            live |= BIT[card]
+        moves = []
+        previous = -1
+        for card in iter_cards(legal):
+            between = (BIT[card] - 1) & ~((BIT[previous] << 1) - 1) if previous >= 0 else 0
+            if not (
+                previous >= 0
+                and SUIT[previous] == SUIT[card]
+                and not between & live
+                and bool(BIT[previous] & PENALTY) == bool(BIT[card] & PENALTY)
+            ):
+                moves.append(card)
+            previous = card
+        first = greedy_move(hands[seat], list(table), opened)
+        if first in moves:
+            moves.remove(first)
+            moves.insert(0, first)
+        return moves
+
+
+class EndgameBot:
+    # Plays the last tricks of a round by solving sampled deals of the unseen
+    # cards exactly and keeping the move with the lowest average; earlier
+    # moves, passing and shutdown go to the wrapped engine. Solving runs
+    # inline, so tricks and samples bound the time taken per move.
+    def __init__(self, fallback: Bot = heuristic, tricks: int = 3, samples: int = 8):
+        self.fallback = fallback
+        self.tricks = tricks
+        self.samples = samples
+        self.solver = Solver()
+
+    async def choose_move(self, game: "Game") -> int:
+        obs = Observation.from_game(game)
+        if obs.hand.bit_count() > self.tricks:
+            return await self.fallback.choose_move(game)
+        rng = random.Random()
+        totals: dict[int, int] = {}
+        for _ in range(self.samples):
+            if (hands := determinize(obs, rng)) is None:
+                continue
+            position = Position(tuple(hands), obs.table, 0, obs.score_opened, obs.points)
+            for card, value in self.solver.values(position).items():
+                totals[card] = totals.get(card, 0) + value
+        if not totals:
+            return await self.fallback.choose_move(game)
+        return min(totals, key=totals.__getitem__)
+
+    def choose_pass(self, player: "Player", count: int) -> int:
+        return self.fallback.choose_pass(player, count)
+
+    def shutdown(self):
+        self.fallback.shutdown()
+
+
+def analyse(position: Position, card: int) -> int:
+    # Points the move cost the seat that made it against the best move,
+    # with every hand known.
+    values = Solver().values(position)
+    return values[card] - min(values.values())
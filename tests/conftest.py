@@ -0,0 +1,4 @@
+import os
+
+# config.Settings requires a token; nothing in the tests talks to Telegram
+os.environ.setdefault("BOT_TOKEN", "123456:test")
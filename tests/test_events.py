@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from events import EventWriter, MemoryBackend, MongoBackend
+
+
+def event(seq: int) -> dict:
+    return {"game": "g", "seq": seq, "event": "move", "data": {}}
+
+
+async def until(condition, timeout: float = 1.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.001)
+
+
+class FlakyBackend(MemoryBackend):
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+        self.calls = 0
+
+    async def insert_many(self, documents: list[dict]):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("down")
+        await super().insert_many(documents)
+
+
+class Collection:
+    # insert_many the way Motor reports an unordered bulk insert
+    def __init__(self):
+        self.documents: dict[tuple, dict] = {}
+
+    async def insert_many(self, documents: list[dict], ordered: bool = True):
+        errors = []
+        for i, document in enumerate(documents):
+            key = (document["game"], document["seq"])
+            if key in self.documents:
+                errors.append({"index": i, "code": 11000, "errmsg": "duplicate key"})
+            elif document.get("bad"):
+                errors.append({"index": i, "code": 121, "errmsg": "validation failed"})
+            else:
+                self.documents[key] = document
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(documents) - len(errors)})
+
+
+def test_flushes_when_a_batch_is_full():
+    async def main():
+        log = EventWriter(batch_size=3, flush_interval=60)
+        for seq in range(2):
+            log.append(event(seq))
+        await asyncio.sleep(0.01)
+        assert log.backend.documents == []
+        log.append(event(2))
+        await until(lambda: log.batches == 1)
+        assert [e["seq"] for e in log.backend.documents] == [0, 1, 2]
+        assert log.batches == 1
+        log.append(event(3))
+        await asyncio.sleep(0.01)
+        assert log.buffer == [event(3)]
+        await log.close()
+        assert len(log.backend.documents) == 4
+
+    asyncio.run(main())
+
+
+def test_flushes_after_the_interval():
+    async def main():
+        log = EventWriter(batch_size=500, flush_interval=0.05)
+        log.append(event(1))
+        await asyncio.sleep(0.01)
+        assert log.backend.documents == []
+        await until(lambda: log.backend.documents)
+        assert log.backend.documents == [event(1)]
+        assert log.stats()["buffered"] == 0
+
+    asyncio.run(main())
+
+
+def test_failed_batch_is_requeued_in_order():
+    async def main():
+        backend = FlakyBackend(failures=1)
+        log = EventWriter(backend, batch_size=2, flush_interval=0.02)
+        for seq in range(3):
+            log.append(event(seq))
+        await until(lambda: log.failures == 1)
+        assert [e["seq"] for e in log.buffer] == [0, 1, 2]
+        await until(lambda: log.written == 3)
+        assert [e["seq"] for e in backend.documents] == [0, 1, 2]
+        assert log.written == 3
+
+    asyncio.run(main())
+
+
+def test_drops_past_max_buffer():
+    async def main():
+        log = EventWriter(FlakyBackend(failures=100), batch_size=10, flush_interval=60, max_buffer=4)
+        for seq in range(6):
+            log.append(event(seq))
+        assert [e["seq"] for e in log.buffer] == [0, 1, 2, 3]
+        assert log.dropped == 2
+        log._writer.cancel()
+
+    asyncio.run(main())
+
+
+def test_duplicate_keys_are_tolerated():
+    async def main():
+        backend = MongoBackend(Collection())
+        await backend.insert_many([event(1), event(2)])
+        # a batch retried after a timeout that had in fact been written
+        await backend.insert_many([event(1), event(2), event(3)])
+        assert sorted(backend.collection.documents) == [("g", 1), ("g", 2), ("g", 3)]
+        with pytest.raises(BulkWriteError):
+            await backend.insert_many([event(3), {**event(4), "bad": True}])
+
+    asyncio.run(main())
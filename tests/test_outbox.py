@@ -0,0 +1,161 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import pytest
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendMessage, SetChatMenuButton
+from aiogram.types import MenuButtonWebApp, Message, WebAppInfo
+
+from benchmarks.telegram import FakeBotAPI
+from outbox import MenuButtons, Outbox
+
+
+@pytest.fixture
+def api() -> FakeBotAPI:
+    # flood limited a little below the outbox's pacing, so any call it lets
+    # through too early comes back as a 429
+    return FakeBotAPI(rate=1000, chat_interval=0.03, latency=0.005)
+
+
+@asynccontextmanager
+async def served(api: FakeBotAPI, **kwargs):
+    url = await api.start()
+    bot = Bot("123456:fake", session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+    outbox = Outbox(**{"rate": 1000, "chat_interval": 0.05, **kwargs})
+    outbox.start(bot)
+    try:
+        yield outbox
+    finally:
+        await outbox.close(0)
+        await bot.session.close()
+        await api.stop()
+
+
+def requests(api: FakeBotAPI, chat_id: int) -> list[tuple[float, str, dict]]:
+    return [r for r in api.requests if r[2].get("chat_id") == str(chat_id)]
+
+
+def message(chat_id: int, text: str = "yo") -> SendMessage:
+    return SendMessage(chat_id=chat_id, text=text)
+
+
+def button(url: str = "https://example.com") -> MenuButtonWebApp:
+    return MenuButtonWebApp(text="play", web_app=WebAppInfo(url=url))
+
+
+def test_messages_to_a_chat_are_paced_and_in_order(api):
+    async def main():
+        async with served(api) as outbox:
+            futures = [outbox.send(1, message(1, str(i))) for i in range(3)]
+            futures.append(outbox.send(2, message(2)))
+            results = await asyncio.gather(*futures)
+        assert all(isinstance(r, Message) for r in results)
+        sent = requests(api, 1)
+        assert [data["text"] for _, _, data in sent] == ["0", "1", "2"]
+        assert all(b[0] - a[0] >= 0.04 for a, b in zip(sent, sent[1:]))
+        assert api.limited == 0
+        # another chat does not wait behind the first
+        assert requests(api, 2)[0][0] < sent[1][0]
+
+    asyncio.run(main())
+
+
+def test_other_calls_keep_order_without_the_message_interval(api):
+    async def main():
+        async with served(api, chat_interval=1.0) as outbox:
+            await asyncio.gather(
+                outbox.send(1, SetChatMenuButton(chat_id=1, menu_button=button())), outbox.send(1, message(1))
+            )
+        (menu_at, menu, _), (message_at, _, _) = requests(api, 1)
+        assert menu == "setChatMenuButton"
+        assert message_at - menu_at < 0.5
+
+    asyncio.run(main())
+
+
+def test_retry_after_holds_the_chat_back_and_resends(api):
+    async def main():
+        api.errors["1"].append(429)
+        async with served(api) as outbox:
+            first = outbox.send(1, message(1))
+            other = outbox.send(2, message(2))
+            assert (await first).text == "yo"
+            await other
+            stats = outbox.stats()
+        (tried, _, _), (resent, _, _) = requests(api, 1)
+        assert resent - tried >= api.retry_after - 0.01
+        assert requests(api, 2)[0][0] < resent
+        assert stats["retried"] == 1
+        assert stats["sent"] == 2
+
+    asyncio.run(main())
+
+
+def test_a_bad_request_fails_its_future(api):
+    async def main():
+        api.errors["1"].append(400)
+        async with served(api) as outbox:
+            with pytest.raises(TelegramBadRequest):
+                await outbox.send(1, message(1))
+            assert outbox.stats()["failed"] == 1
+            assert (await outbox.send(1, message(1, "again"))).text == "again"
+
+    asyncio.run(main())
+
+
+def test_a_queued_call_is_replaced_under_its_key(api):
+    async def main():
+        async with served(api) as outbox:
+            first = outbox.send(1, message(1, "old"), key="greeting")
+            second = outbox.send(1, message(1, "new"), key="greeting")
+            assert first is second
+            await second
+            assert [data["text"] for _, _, data in requests(api, 1)] == ["new"]
+            assert outbox.stats()["replaced"] == 1
+            # once sent, the key is free again
+            await outbox.send(1, message(1, "later"), key="greeting")
+            assert len(requests(api, 1)) == 2
+
+    asyncio.run(main())
+
+
+def test_menu_button_is_only_set_when_it_changes(api):
+    async def main():
+        async with served(api) as outbox:
+            menus = MenuButtons(outbox)
+            await menus.set(1, button())
+            assert menus.set(1, button()) is None
+            assert menus.skipped == 1
+            await menus.set(1, button("https://example.com/other"))
+        urls = [json.loads(data["menu_button"])["web_app"]["url"] for _, _, data in requests(api, 1)]
+        assert urls == ["https://example.com", "https://example.com/other"]
+
+    asyncio.run(main())
+
+
+def test_menu_button_is_forgotten_when_setting_it_fails(api):
+    async def main():
+        api.errors["1"].append(400)
+        async with served(api) as outbox:
+            menus = MenuButtons(outbox)
+            with pytest.raises(TelegramBadRequest):
+                await menus.set(1, button())
+            assert 1 not in menus.buttons
+            await menus.set(1, button())
+        assert len(requests(api, 1)) == 2
+
+    asyncio.run(main())
+
+
+def test_menu_buttons_are_bounded(api):
+    async def main():
+        async with served(api) as outbox:
+            menus = MenuButtons(outbox, size=2)
+            await asyncio.gather(*(menus.set(chat_id, button()) for chat_id in range(3)))
+            assert list(menus.buttons) == [1, 2]
+
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+import asyncio
+
+from shards import BackendServer, InProcessBackend, ShardRouter, UnixSocketBackend
+
+CRITERIA = (100, "casual")
+
+
+def routers(workers: int = 3) -> list[ShardRouter]:
+    backend = InProcessBackend()
+    return [ShardRouter(i, workers, backend, "ws://w{worker}:{port}", 9000) for i in range(workers)]
+
+
+def test_single_worker_owns_everyone():
+    async def main():
+        router = ShardRouter()
+        assert not router.enabled
+        assert await router.owner(1, CRITERIA) == 0
+        await router.claim(1)
+        assert router.backend.data == {}
+
+    asyncio.run(main())
+
+
+def test_arrivals_are_spread_in_groups_of_four():
+    async def main():
+        router = routers()[0]
+        return [await router.owner(telegram_id, CRITERIA) for telegram_id in range(1, 14)]
+
+    assert asyncio.run(main()) == [0] * 4 + [1] * 4 + [2] * 4 + [0]
+
+
+def test_groups_are_counted_per_criteria():
+    async def main():
+        router = routers()[0]
+        for telegram_id in range(1, 5):
+            await router.owner(telegram_id, CRITERIA)
+        return await router.owner(5, (200, "casual")), await router.owner(6, CRITERIA)
+
+    assert asyncio.run(main()) == (0, 1)
+
+
+def test_owner_is_remembered_for_the_redirected_connection():
+    async def main():
+        first, second, _ = routers()
+        for telegram_id in range(1, 6):
+            await first.owner(telegram_id, CRITERIA)
+        # player 5 was sent to worker 1, and asking there again keeps them
+        assert await first.owner(5, CRITERIA) == 1
+        assert await second.owner(5, CRITERIA) == 1
+        assert first.url(1) == "ws://w1:9001"
+
+    asyncio.run(main())
+
+
+def test_claim_and_release():
+    async def main():
+        first, second, third = routers()
+        await first.owner(1, CRITERIA)
+        await third.claim(1)
+        assert await second.owner(1, CRITERIA) == 2
+        await third.release(1)
+        assert await second.backend.get("player:1") is None
+        # released players are routed as new arrivals
+        assert await second.owner(1, CRITERIA) == 0
+
+    asyncio.run(main())
+
+
+def test_backend_server_over_a_unix_socket(tmp_path):
+    async def main():
+        server = BackendServer(str(tmp_path / "shards.sock"))
+        serving = asyncio.create_task(server.serve())
+        while not (tmp_path / "shards.sock").exists():
+            await asyncio.sleep(0.01)
+        try:
+            router = ShardRouter(1, 2, UnixSocketBackend(server.path))
+            assert await router.owner(7, CRITERIA) == 0
+            await router.claim(8)
+            assert await router.owner(8, CRITERIA) == 1
+            await server.backend.purge("player:", "1")
+            assert await router.backend.get("player:8") is None
+            assert await router.backend.get("player:7") == "0"
+            await router.release(7)
+            assert server.backend.data == {"lobby:100:casual": "1"}
+            router.backend.writer.close()
+        finally:
+            serving.cancel()
+
+    asyncio.run(main())
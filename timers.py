@@ -0,0 +1,92 @@
+import asyncio
+import time
+from typing import Callable
+
+
+class Timer:
+    __slots__ = ("wheel", "deadline", "callback", "slot", "rounds")
+
+    def __init__(self, wheel: "TimingWheel", deadline: float, callback: Callable[[], object]):
+        self.wheel = wheel
+        self.deadline = deadline
+        self.callback = callback
+        self.slot: dict | None = None
+        self.rounds = 0
+
+    @property
+    def active(self) -> bool:
+        return self.slot is not None
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - self.wheel.now())
+
+    def cancel(self):
+        self.wheel.cancel(self)
+
+    def reschedule(self, delay: float):
+        self.wheel.reschedule(self, delay)
+
+
+class TimingWheel:
+    # Hashed timing wheel: a timer lands in slot (deadline tick % slots) with
+    # the number of full turns left before it is due. Scheduling, cancelling
+    # and rescheduling are O(1), and a single ticker task drives every table's
+    # timeouts instead of one sleeping task per turn.
+    def __init__(self, tick: float = 0.1, slots: int = 512, now: Callable[[], float] = time.monotonic):
+        self.tick = tick
+        self.now = now
+        self.slots: list[dict[Timer, None]] = [{} for _ in range(slots)]
+        self.count = 0
+        self.position = 0
+        self.ticked_at = now()
+        self._ticker: asyncio.Task | None = None
+
+    def call_later(self, delay: float, callback: Callable[[], object]) -> Timer:
+        timer = Timer(self, self.now() + delay, callback)
+        self._insert(timer)
+        return timer
+
+    def cancel(self, timer: Timer):
+        if timer.slot is not None:
+            del timer.slot[timer]
+            timer.slot = None
+            self.count -= 1
+
+    def reschedule(self, timer: Timer, delay: float):
+        self.cancel(timer)
+        timer.deadline = self.now() + delay
+        self._insert(timer)
+
+    def _insert(self, timer: Timer):
+        if self._ticker is None or self._ticker.done():
+            self.ticked_at = self.now()
+            self._ticker = asyncio.create_task(self._run())
+        ticks = max(1, round((timer.deadline - self.ticked_at) / self.tick))
+        timer.rounds, offset = divmod(ticks - 1, len(self.slots))
+        timer.slot = self.slots[(self.position + 1 + offset) % len(self.slots)]
+        timer.slot[timer] = None
+        self.count += 1
+
+    def advance(self):
+        self.position = (self.position + 1) % len(self.slots)
+        self.ticked_at += self.tick
+        slot = self.slots[self.position]
+        due = []
+        for timer in slot:
+            if timer.rounds:
+                timer.rounds -= 1
+            else:
+                due.append(timer)
+        loop = asyncio.get_running_loop()
+        for timer in due:
+            self.cancel(timer)
+            loop.call_soon(timer.callback)
+
+    async def _run(self):
+        while self.count:
+            await asyncio.sleep(max(0.0, self.ticked_at + self.tick - self.now()))
+            while self.count and self.ticked_at + self.tick <= self.now():
+                self.advance()
+
+
+wheel = TimingWheel()
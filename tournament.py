@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import os
+import time
+
+from bots import Bot, MonteCarloBot, heuristic
+from engine import NullNotifier, VirtualClock
+from models import Game, Player
+
+
+async def play_game(engines: list[Bot]) -> Game:
+    game = Game().bind(NullNotifier(), VirtualClock())
+    for bot in engines:
+        await game.submit("join", player=Player.get_bot(bot))
+    await game.submit("start")
+    return game
+
+
+async def run(games: int, budget: float, workers: int, parallel: int) -> dict:
+    # One Monte Carlo seat against three heuristic ones; with equal strength
+    # every seat would win a quarter of the games.
+    challenger = MonteCarloBot(budget, workers)
+    wins = challenger_score = field_score = 0
+    slots = asyncio.Semaphore(parallel)
+
+    async def play(i: int):
+        nonlocal wins, challenger_score, field_score
+        engines = [heuristic] * 4
+        engines[i % 4] = challenger
+        async with slots:
+            game = await play_game(engines)
+        for result in game.results:
+            if result["player"]._bot is challenger:
+                wins += result["place"] == 1
+                challenger_score += result["score"]
+            else:
+                field_score += result["score"]
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(play(i) for i in range(games)))
+    finally:
+        challenger.shutdown()
+    return {
+        "games": games,
+        "seconds": round(time.perf_counter() - started, 1),
+        "win_rate": round(wins / games, 3),
+        "avg_score": round(challenger_score / games, 1),
+        "field_avg_score": round(field_score / games / 3, 1),
+        **challenger.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the Monte Carlo bot against the heuristic one")
+    parser.add_argument("-n", "--games", type=int, default=100)
+    parser.add_argument("-b", "--budget", type=float, default=0.05, help="seconds of search per move")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("-p", "--parallel", type=int, default=os.cpu_count(), help="games played at once")
+    args = parser.parse_args()
+    result = asyncio.run(run(args.games, args.budget, args.workers, args.parallel))
+    for k, v in result.items():
+        print(f"{k}: {v}")
+
+
+if __name__ == "__main__":
+    main()
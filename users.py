@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Protocol
+
+from bson import Decimal128
+from pymongo import UpdateOne
+
+from engine import Clock, real_clock
+from events import EventWriter
+from models import Game, User
+
+logger = logging.getLogger(__name__)
+
+
+class UserStore(Protocol):
+    async def load(self, telegram_id: int) -> User | None: ...
+
+    async def apply(self, updates: dict[int, dict]): ...
+
+
+def to_bson(value):
+    if isinstance(value, Decimal):
+        return Decimal128(str(value))
+    if isinstance(value, dict):
+        return {k: to_bson(v) for k, v in value.items()}
+    return value
+
+
+class MongoUserStore:
+    async def load(self, telegram_id: int) -> User | None:
+        return await User.find_one(User.telegram_id == telegram_id)
+
+    async def apply(self, updates: dict[int, dict]):
+        # upserts, so a new user costs no round trip of its own
+        await User.get_motor_collection().bulk_write(
+            [UpdateOne({"telegram_id": telegram_id}, to_bson(update), upsert=True) for telegram_id, update in updates.items()],
+            ordered=False,
+        )
+
+
+class MemoryUserStore:
+    def __init__(self):
+        self.documents: dict[int, dict] = {}
+
+    async def load(self, telegram_id: int) -> User | None:
+        if (document := self.documents.get(telegram_id)) is None:
+            return None
+        return User.model_construct(**document)
+
+    async def apply(self, updates: dict[int, dict]):
+        for telegram_id, update in updates.items():
+            if (document := self.documents.get(telegram_id)) is None:
+                document = self.documents[telegram_id] = {"telegram_id": telegram_id, **update.get("$setOnInsert", {})}
+            document.update(update.get("$set", {}))
+            for k, v in update.get("$inc", {}).items():
+                document[k] = document.get(k, 0) + v
+
+
+def merge(update: dict, other: dict):
+    for op, fields in other.items():
+        target = update.setdefault(op, {})
+        if op == "$inc":
+            for k, v in fields.items():
+                target[k] = target.get(k, 0) + v
+        elif op == "$setOnInsert":
+            for k, v in fields.items():
+                target.setdefault(k, v)
+        else:
+            target.update(fields)
+
+
+class UserCache:
+    # LRU of User documents, each trusted for ttl seconds after it was
+    # loaded. Changes are applied to the cached object at once and written
+    # behind: they are merged per user into one upsert with $set and $inc
+    # and flushed as one bulk_write every flush_interval. A failed flush is
+    # merged back for the next one; a reload re-applies what is pending.
+    def __init__(
+        self,
+        store: UserStore | None = None,
+        size: int = 100_000,
+        ttl: float = 300.0,
+        flush_interval: float = 1.0,
+        clock: Clock = real_clock,
+    ):
+        self.store = store or MemoryUserStore()
+        self.size = size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.entries: OrderedDict[int, tuple[float, User]] = OrderedDict()
+        self.loading: dict[int, asyncio.Future] = {}
+        self.pending: dict[int, dict] = {}
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.failures = 0
+        self.flush_seconds = 0.0
+        self._writer: asyncio.Task | None = None
+
+    async def get(self, telegram_id: int, **data) -> User:
+        entry = self.entries.get(telegram_id)
+        if entry is not None and self.clock.now() - entry[0] < self.ttl:
+            self.hits += 1
+            self.entries.move_to_end(telegram_id)
+            user = entry[1]
+        else:
+            self.misses += 1
+            # a reconnect storm asks for the same user many times at once
+            if (future := self.loading.get(telegram_id)) is None:
+                future = self.loading[telegram_id] = asyncio.ensure_future(self._load(telegram_id))
+                future.add_done_callback(lambda _: self.loading.pop(telegram_id, None))
+            user = await asyncio.shield(future)
+        if changed := {k: v for k, v in data.items() if getattr(user, k) != v}:
+            self.update(telegram_id, {"$set": changed})
+        return user
+
+    async def _load(self, telegram_id: int) -> User:
+        user = await self.store.load(telegram_id)
+        if user is None:
+            # built without validation or beanie state; the first flush inserts it
+            user = User.model_construct(telegram_id=telegram_id)
+            self.update(telegram_id, {"$setOnInsert": {"created_at": user.created_at}})
+        if pending := self.pending.get(telegram_id):
+            # also for a new user: their first game may be recorded before the first load
+            self._apply(user, pending)
+        self.entries[telegram_id] = (self.clock.now(), user)
+        self.entries.move_to_end(telegram_id)
+        while len(self.entries) > self.size:
+            # pending changes live in self.pending, so evicting loses nothing
+            self.entries.popitem(last=False)
+        return user
+
+    def cached(self, telegram_id: int) -> User | None:
+        entry = self.entries.get(telegram_id)
+        return entry[1] if entry is not None else None
+
+    async def find(self, telegram_id: int) -> User | None:
+        # for reads about somebody else: nothing is created or cached
+        if (user := self.cached(telegram_id)) is not None:
+            return user
+        user = await self.store.load(telegram_id)
+        if user is not None and (pending := self.pending.get(telegram_id)):
+            self._apply(user, pending)
+        return user
+
+    def _apply(self, user: User, update: dict):
+        for k, v in update.get("$set", {}).items():
+            setattr(user, k, v)
+        for k, v in update.get("$inc", {}).items():
+            setattr(user, k, getattr(user, k) + v)
+
+    def update(self, telegram_id: int, update: dict, user: User | None = None):
+        if user is None and (entry := self.entries.get(telegram_id)):
+            user = entry[1]
+        if user is not None:
+            self._apply(user, update)
+        merge(self.pending.setdefault(telegram_id, {}), update)
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._run())
+
+    def credit(self, telegram_id: int, amount: Decimal):
+        self.update(telegram_id, {"$inc": {"balance": amount}})
+
+    async def _run(self):
+        while self.pending:
+            await self.clock.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> bool:
+        if not self.pending:
+            return True
+        batch, self.pending = self.pending, {}
+        started = time.perf_counter()
+        try:
+            await self.store.apply(batch)
+        except asyncio.CancelledError:
+            self._requeue(batch)
+            raise
+        except Exception:
+            logger.exception("User flush failed")
+            self.failures += 1
+            self._requeue(batch)
+            return False
+        self.flush_seconds = time.perf_counter() - started
+        self.flushes += 1
+        return True
+
+    def _requeue(self, batch: dict[int, dict]):
+        for telegram_id, update in batch.items():
+            # anything queued meanwhile is newer than the batch
+            merge(update, self.pending.pop(telegram_id, {}))
+            self.pending[telegram_id] = update
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "pending": len(self.pending),
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "last_flush_ms": round(self.flush_seconds * 1e3, 2),
+        }
+
+
+def moons(game: Game, seat: int) -> int:
+    # a shooter's round is scored 0 and everybody else's 26, the only way
+    # three players can take 26 in one round
+    return sum(
+        score == 0 and all(p.scores[i] == 26 for j, p in enumerate(game.players) if j != seat)
+        for i, score in enumerate(game.players[seat].scores)
+    )
+
+
+def stats(user: User) -> dict:
+    return {
+        "telegram_id": user.telegram_id,
+        "name": user.display_name or user.username,
+        "games": user.games,
+        "wins": user.wins,
+        "avg_place": round(user.places / user.games, 2) if user.games else None,
+        "moons": user.moons,
+    }
+
+
+def record_game(game: Game):
+    # Called once a game is over: one history row per human, bulk inserted,
+    # and the counters on User written behind.
+    seats = {id(p): i for i, p in enumerate(game.players)}
+    for result in game.results:
+        player = result["player"]
+        if player.is_bot:
+            continue
+        history.append(
+            {
+                "telegram_id": player.telegram_id,
+                "game": game.id,
+                "ended_at": game.ended_at,
+                "place": result["place"],
+                "score": result["score"],
+                "balance_changed": Decimal128("0"),
+            }
+        )
+        counters = {
+            "games": 1,
+            "wins": int(result["place"] == 1),
+            "places": result["place"],
+            "moons": moons(game, seats[id(player)]),
+        }
+        users.update(player.telegram_id, {"$inc": counters})
+
+
+users = UserCache()
+history = EventWriter()
@@ -0,0 +1,158 @@
+import struct
+from datetime import datetime
+
+from cards import INDEX
+from models import Game, Notification, Player
+
+# Binary protocol, offered as the "hearts.msgpack" WebSocket subprotocol.
+# Every frame is MessagePack: the session's message number, then
+# [event code, seq, private, *fields] with the fields of FIELDS[event] in
+# order. Cards are their index (one byte each), players their seat in the
+# current order, times milliseconds since the epoch. minihearts/src/wire.js
+# holds the same tables.
+SUBPROTOCOL = "hearts.msgpack"
+EVENTS = [
+    "state", "hand", "joined", "left", "started", "round", "waiting_pass", "pass", "got",
+    "played", "took", "trick", "shoot_the_moon", "deadline", "chat", "game_over",
+]
+CODES = {event: code for code, event in enumerate(EVENTS)}
+FIELDS = {
+    "hand": ("hand",),
+    "joined": ("telegram_id", "display_name", "scores", "auto_move", "is_bot"),
+    "left": ("telegram_id", "display_name", "scores", "auto_move", "is_bot"),
+    "started": ("started_at",),
+    "round": ("round_number", "seat", "waiting_for_pass"),
+    "waiting_pass": ("where",),
+    "pass": ("where", "cards"),
+    "got": ("where", "cards"),
+    "played": ("seat", "card"),
+    "took": ("seat", "score"),
+    "trick": ("seat", "score", "score_opened"),
+    "shoot_the_moon": ("seat",),
+    "deadline": ("seconds",),
+    "chat": ("id", "player", "text", "private_to", "created_at"),
+    "game_over": ("results", "endgame"),
+}
+STATE = (
+    "id", "players", "score_opened", "round_number", "table", "votes", "created_at",
+    "started_at", "ended_at", "waiting_for_pass", "max_score", "turn_deadline", "version",
+)
+WHERE = {"left": 0, "right": 1, "across": 2}
+
+
+def pack(value) -> bytes:
+    out = bytearray()
+    _pack(value, out)
+    return bytes(out)
+
+
+def _pack(value, out: bytearray):
+    # the subset of MessagePack the protocol needs
+    if value is None:
+        out.append(0xC0)
+    elif value is True:
+        out.append(0xC3)
+    elif value is False:
+        out.append(0xC2)
+    elif isinstance(value, int):
+        if 0 <= value < 0x80:
+            out.append(value)
+        elif -32 <= value < 0:
+            out.append(value & 0xFF)
+        elif 0 < value < 0x100:
+            out += bytes((0xCC, value))
+        elif 0 < value < 0x10000:
+            out += struct.pack(">BH", 0xCD, value)
+        elif 0 < value < 1 << 32:
+            out += struct.pack(">BI", 0xCE, value)
+        elif 0 < value < 1 << 64:
+            out += struct.pack(">BQ", 0xCF, value)
+        elif -(1 << 31) <= value < 0:
+            out += struct.pack(">Bi", 0xD2, value)
+        else:
+            out += struct.pack(">Bq", 0xD3, value)
+    elif isinstance(value, float):
+        out += struct.pack(">Bd", 0xCB, value)
+    elif isinstance(value, str):
+        data = value.encode()
+        size = len(data)
+        if size < 32:
+            out.append(0xA0 | size)
+        elif size < 0x100:
+            out += bytes((0xD9, size))
+        else:
+            out += struct.pack(">BI", 0xDB, size)
+        out += data
+    elif isinstance(value, (list, tuple)):
+        size = len(value)
+        if size < 16:
+            out.append(0x90 | size)
+        else:
+            out += struct.pack(">BI", 0xDD, size)
+        for item in value:
+            _pack(item, out)
+    elif isinstance(value, dict):
+        size = len(value)
+        if size < 16:
+            out.append(0x80 | size)
+        else:
+            out += struct.pack(">BI", 0xDF, size)
+        for k, v in value.items():
+            _pack(k, out)
+            _pack(v, out)
+    else:
+        raise TypeError(f"Cannot pack {type(value).__name__}")
+
+
+def millis(value: datetime | None) -> int | None:
+    return None if value is None else int(value.timestamp() * 1000)
+
+
+def seat(game: Game, player: Player | int | None) -> int | None:
+    if player is None:
+        return None
+    for i, p in enumerate(game.players):
+        # chat names players by telegram_id
+        if p is player or p.telegram_id == player:
+            return i
+    return None
+
+
+def field(game: Game, name: str, value):
+    match name:
+        case "card":
+            return INDEX[value]
+        case "cards" | "hand" | "table":
+            return [INDEX[card] for card in value]
+        case "where":
+            return WHERE.get(value)
+        case "player" | "private_to":
+            return seat(game, value)
+        case "started_at" | "created_at" | "ended_at" | "turn_deadline":
+            return millis(value)
+        case "results":
+            return [[seat(game, r["player"]), r["score"], r["place"]] for r in value]
+        case "endgame":
+            return [[seat(game, r["player"]), r["moves"], r["lost"]] for r in value]
+        case "players":
+            return [[p[k] for k in FIELDS["joined"]] for p in value]
+        case "votes":
+            return list(value)
+    return value
+
+
+def state(game: Game, data: dict) -> list:
+    return [field(game, name, data[name]) for name in STATE]
+
+
+def encode(game: Game, notification: Notification) -> bytes:
+    event, data = notification.event, notification.data
+    if event == "state":
+        fields = game._cached("wire", lambda: state(game, data))
+    else:
+        fields = [field(game, name, data.get(name)) for name in FIELDS[event]]
+    return pack([CODES[event], notification.seq, notification.player is not None, *fields])
+
+
+def frame(n: int, payload: bytes) -> bytes:
+    return pack(n) + payload
@@ -1,5 +1,11 @@
 import asyncio
 import hmac
+import json
+import logging
+import time
+from collections import deque
+from functools import partial
+from itertools import islice
 from typing import Optional
 from xml.sax import parse
 
@@ -9,11 +15,27 @@ from fastapi.responses import HTMLResponse
 from pydantic import ValidationError
 from pygments.lexers import q
 from starlette import status
+from starlette.websockets import WebSocketState
 
+from bots import Bot, MonteCarloBot, heuristic
 from config import config
-from models import Game, Player, games_by_player, Notification, User, public_methods
+from decisions import BatchedBot
+from engine import Clock, real_clock
+from events import event_log
+from solver import EndgameBot
+from limits import COALESCED, Limiter
+from leaderboards import leaderboards
+from lobby import Criteria, Matchmaker
+from shards import ShardRouter, UnixSocketBackend
+from snapshots import snapshots
+from models import Game, Player, games_by_player, Notification
+from timers import Timer
+from users import record_game, users
+import metrics
+import wire
 
 ws_router = APIRouter()
+logger = logging.getLogger(__name__)
 
 html = """
 <!DOCTYPE html>
@@ -53,47 +75,301 @@ html = """
 """
 
 
+# Events that carry a full snapshot of their slice of state: a newer one
+# makes any older one still waiting in the queue useless. Everything else
+# sent to the whole table is a numbered patch; if one is dropped the client
+# sees the gap in seq and asks for a sync.
+snapshot_events = {"state", "hand"}
+
+
+class SocketWriter:
+    def __init__(self, websocket: WebSocket, on_dead, policy: str = config.slow_consumer_policy, size: int = config.send_queue_size):
+        self.websocket = websocket
+        self.on_dead = on_dead
+        self.policy = policy
+        self.size = size
+        self.queue: deque[tuple[str, str | bytes]] = deque()
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.closed = False
+        self.task = asyncio.create_task(self.run())
+
+    def put(self, event: str, payload: str | bytes):
+        if self.closed:
+            return
+        if len(self.queue) >= self.size:
+            if self.policy == "disconnect":
+                self.close(status.WS_1008_POLICY_VIOLATION)
+                return
+            if self.policy == "coalesce" and event in snapshot_events:
+                kept = deque(item for item in self.queue if item[0] != event)
+                self.dropped += len(self.queue) - len(kept)
+                metrics.dropped.inc(self.policy, len(self.queue) - len(kept))
+                self.queue = kept
+            if len(self.queue) >= self.size:
+                self.dropped += 1
+                metrics.dropped.inc(self.policy)
+                if self.policy == "drop":
+                    return
+                self.queue.popleft()
+        self.queue.append((event, payload))
+        self.ready.set()
+
+    async def run(self):
+        try:
+            while True:
+                await self.ready.wait()
+                while self.queue:
+                    _, payload = self.queue.popleft()
+                    if isinstance(payload, bytes):
+                        await self.websocket.send_bytes(payload)
+                    else:
+                        await self.websocket.send_text(payload)
+                self.ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.closed = True
+            self.on_dead(self)
+
+    def close(self, code: int = status.WS_1000_NORMAL_CLOSURE):
+        if self.closed:
+            return
+        self.closed = True
+        self.task.cancel()
+        self.on_dead(self)
+        asyncio.create_task(self._close(code))
+
+    async def _close(self, code: int):
+        try:
+            await self.websocket.close(code)
+        except Exception:
+            pass
+
+
+def bot_engine() -> Bot | None:
+    bot = None
+    if config.bot_engine == "montecarlo":
+        bot = MonteCarloBot(config.bot_move_budget, config.bot_workers)
+    elif config.bot_engine == "batched":
+        bot = BatchedBot(config.bot_batch_window)
+    if config.bot_endgame_tricks:
+        bot = EndgameBot(bot or heuristic, config.bot_endgame_tricks, config.bot_endgame_samples)
+    return bot
+
+
+class Session:
+    # Everything sent to one player, numbered and kept in a ring buffer, so a
+    # client reconnecting within the grace period is sent only what it
+    # missed. The number is spliced into the JSON payload shared by the
+    # table, or put in front of the binary one.
+    def __init__(self, player: Player, size: int = config.resume_buffer_size):
+        self.player = player
+        self.game: Game | None = None
+        self.websocket: WebSocket | None = None
+        self.writer: SocketWriter | None = None
+        self.binary = False
+        self.sent = 0
+        self.buffer: deque[tuple[int, str, str | bytes]] = deque(maxlen=size)
+        self.expiry: Timer | None = None
+
+    def put(self, event: str, payload: str | bytes):
+        self.sent += 1
+        if self.binary:
+            payload = wire.frame(self.sent, payload)
+        else:
+            payload = f'{{"n":{self.sent},{payload[1:]}'
+        self.buffer.append((self.sent, event, payload))
+        if self.writer is not None:
+            self.writer.put(event, payload)
+
+    def missed(self, after: int) -> list[tuple[int, str, str | bytes]] | None:
+        # None once the buffer no longer reaches back that far
+        first = self.buffer[0][0] if self.buffer else self.sent + 1
+        if not first - 1 <= after <= self.sent:
+            return None
+        return list(islice(self.buffer, after + 1 - first, None))
+
+    def attach(self, websocket: WebSocket, writer: SocketWriter, binary: bool):
+        if binary != self.binary:
+            # what is buffered is in the other format; a resume falls back to a sync
+            self.buffer.clear()
+            self.binary = binary
+        if self.writer is not None:
+            self.writer.close()
+        if self.expiry is not None:
+            self.expiry.cancel()
+            self.expiry = None
+        self.websocket = websocket
+        self.writer = writer
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.sockets: dict[int, WebSocket] = {}
-        self.open_game = Game()
+    def __init__(self, clock: Clock = real_clock):
+        self.clock = clock
+        self.sessions: dict[int, Session] = {}
+        self.lobby = Matchmaker(
+            config.lobby_backfill_after,
+            config.lobby_batch_window,
+            bot=bot_engine(),
+            log=event_log,
+            on_finish=(record_game, leaderboards.record),
+        )
+        self.resumed = 0
+        self.synced = 0
+        self.expired = 0
 
 
-    async def connect(self, websocket: WebSocket, telegram_id: int):
-        await websocket.accept()
-        self.sockets[telegram_id] = websocket
-        # user = await User.get_or_create(telegram_id=telegram_id)
-        # player = user.player
-        player = Player(telegram_id=telegram_id, display_name=f'a{telegram_id}')
-        if self.open_game.started_at:
-            self.open_game = Game()
-        await self.open_game.join(player)
-        websocket.game = self.open_game
+    async def connect(self, websocket: WebSocket, telegram_id: int, criteria: Criteria = Criteria(), resume: int | None = None):
+        binary = wire.SUBPROTOCOL in websocket.scope.get("subprotocols", ())
+        await websocket.accept(subprotocol=wire.SUBPROTOCOL if binary else None)
+        writer = SocketWriter(websocket, self.remove)
+        session = self.sessions.get(telegram_id)
+        if session is not None and session.game is not None and not session.game.ended_at:
+            session.attach(websocket, writer, binary)
+            websocket.player, websocket.game = session.player, session.game
+            if resume is not None and (missed := session.missed(resume)) is not None:
+                for _, event, payload in missed:
+                    writer.put(event, payload)
+                self.resumed += 1
+            else:
+                session.game.submit("sync", player=session.player)
+                self.synced += 1
+            return
+        name = None
+        try:
+            user = await users.get(telegram_id)
+            name = user.display_name or user.username
+        except Exception:
+            logger.exception("Could not load user %s", telegram_id)
+        player = Player(telegram_id=telegram_id, display_name=name or f'a{telegram_id}')
+        if session is None:
+            session = self.sessions[telegram_id] = Session(player)
+        session.player = player
+        session.attach(websocket, writer, binary)
         websocket.player = player
-        if self.open_game.started_at:
-            self.open_game = Game()
+        websocket.game = session.game = await self.lobby.seat(player, criteria)
 
-    async def disconnect(self, websocket: WebSocket):
-        if game := games_by_player[websocket.player.telegram_id]:
-            await game.leave(websocket.player)
+    async def adopt(self, game: Game):
+        # Tables restored from a snapshot: their humans are treated as just
+        # disconnected, kept on this worker and given the grace to come back.
+        for player in game.players:
+            if player.is_bot or player.auto_move:
+                continue
+            session = self.sessions[player.telegram_id] = Session(player)
+            session.game = game
+            session.expiry = self.clock.call_later(config.resume_grace, partial(self.expire, session))
+            await shards.claim(player.telegram_id)
 
-        for k, v in self.sockets.items():
-            if v == websocket:
-                del self.sockets[k]
+    def remove(self, writer: SocketWriter):
+        # the socket died or was replaced; messages keep going to the buffer
+        for session in self.sessions.values():
+            if session.writer is writer:
+                session.writer = None
                 break
 
+    async def disconnect(self, websocket: WebSocket):
+        session = self.sessions.get(websocket.player.telegram_id)
+        if session is None or session.websocket is not websocket:
+            # a newer connection has taken over the session
+            return
+        if session.writer is not None:
+            session.writer.close()
+        session.websocket = session.writer = None
+        game = session.game
+        if game is not None and game.started_at and not game.ended_at:
+            # the seat stays human, timing out move by move, until the grace ends
+            session.expiry = self.clock.call_later(config.resume_grace, partial(self.expire, session))
+            return
+        del self.sessions[websocket.player.telegram_id]
+        await shards.release(websocket.player.telegram_id)
+        if game is not None and not game.ended_at:
+            await game.submit("leave", player=session.player)
+
+    def expire(self, session: Session):
+        session.expiry = None
+        if self.sessions.get(session.player.telegram_id) is not session or session.websocket is not None:
+            return
+        del self.sessions[session.player.telegram_id]
+        self.expired += 1
+        if shards.enabled:
+            asyncio.create_task(shards.release(session.player.telegram_id))
+        if not session.game.ended_at:
+            session.game.submit("leave", player=session.player)
+
     async def notify_game(self, game: Game, notification: Notification):
+        # each format is encoded once per event, and only if somebody needs it
+        started = time.perf_counter()
+        text = binary = None
+        sent = 0
         for player in game.players:
-            await self.notify_player(player, notification)
+            # by player rather than game: session.game is only set once the
+            # seat is taken, after the join and start have been broadcast
+            if (session := self.sessions.get(player.telegram_id)) and session.player is player:
+                if session.binary:
+                    binary = binary or wire.encode(game, notification)
+                    session.put(notification.event, binary)
+                else:
+                    text = text or notification.model_dump_json(exclude_none=True)
+                    session.put(notification.event, text)
+                sent += 1
+        metrics.fanout.observe(time.perf_counter() - started, notification.event)
+        metrics.messages.inc(notification.event, sent)
+        if metrics.event_logger.sampled():
+            metrics.event_logger.log(event=notification.event, game=game.id, seq=notification.seq, recipients=sent)
+
+    async def notify_player(self, game: Game, player: Player, notification: Notification):
+        if (session := self.sessions.get(player.telegram_id)) and session.player is player:
+            if session.binary:
+                # the game that sent it: session.game is not set until the
+                # seat is taken, and is the last game after one ends
+                session.put(notification.event, wire.encode(game, notification))
+            else:
+                session.put(notification.event, notification.model_dump_json(exclude_none=True))
+            metrics.messages.inc(notification.event)
+        if metrics.event_logger.sampled():
+            metrics.event_logger.log(event=notification.event, player=player.telegram_id, seq=notification.seq)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "connected": sum(s.websocket is not None for s in self.sessions.values()),
+            "resumed": self.resumed,
+            "synced": self.synced,
+            "expired": self.expired,
+        }
+
+    def tables(self) -> int:
+        games = {id(s.game): s.game for s in self.sessions.values() if s.game is not None}
+        games.update((id(g), g) for g in snapshots.restored.values())
+        return sum(not g.ended_at for g in games.values())
+
+    def queue_depths(self) -> list[int]:
+        return [len(s.writer.queue) for s in self.sessions.values() if s.writer is not None]
 
-    async def notify_player(self, player: Player, notification: Notification):
-        try:
-            await self.sockets[player.telegram_id].send_text(notification.model_dump_json())
-        except:
-            pass
-            # self.sockets.pop(player.telegram_id, None)
 
 manager = ConnectionManager()
+metrics.registry.gauge("hearts_tables", "Unfinished tables with a human seat", manager.tables)
+metrics.registry.gauge("hearts_sessions", "Player sessions, connected or within their grace period", lambda: len(manager.sessions))
+metrics.registry.gauge("hearts_sockets", "Open player sockets", lambda: manager.stats()["connected"])
+metrics.registry.gauge("hearts_send_queue_depth_max", "Longest per-socket send queue", lambda: max(manager.queue_depths(), default=0))
+metrics.registry.gauge("hearts_send_queue_depth", "Messages waiting in all send queues", lambda: sum(manager.queue_depths()))
+shards = ShardRouter(
+    config.shard_worker_id,
+    config.shard_workers,
+    UnixSocketBackend(config.shard_backend) if config.shard_backend else None,
+    config.shard_url,
+    config.shard_base_port,
+)
+
+
+def report_error(telegram_id: int, future: asyncio.Future):
+    if future.cancelled() or not (e := future.exception()):
+        return
+    if not isinstance(e, ValueError):
+        logger.error("Command failed", exc_info=e)
+    if (session := manager.sessions.get(telegram_id)) and session.writer is not None:
+        session.writer.put("error", json.dumps({'error': str(e)}))
 
 
 @ws_router.get("/")
@@ -102,7 +378,7 @@ async def get():
 
 
 @ws_router.websocket("/ws/{telegram_id}")
-async def websocket_endpoint(websocket: WebSocket, telegram_id: int):#, key: Optional[str] = Cookie(None)):
+async def websocket_endpoint(websocket: WebSocket, telegram_id: int, stake: int = 0, latency: int = 0, resume: int | None = None):#, key: Optional[str] = Cookie(None)):
     # digest = hmac.new(config.secret_key.encode(), str('telegram_id').encode(), 'sha256').hexdigest()
     # if not hmac.compare_digest(key, digest):
     #     return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
@@ -113,16 +389,42 @@ async def websocket_endpoint(websocket: WebSocket, telegram_id: int):#, key: Opt
     #     await manager.open_game.join(player)
     # await asyncio.sleep(2)
 
-    await manager.connect(websocket, telegram_id)
+    criteria = Criteria.from_request(stake, latency)
+    if (owner := await shards.owner(telegram_id, criteria)) != shards.worker_id:
+        await websocket.accept()
+        url = f"{shards.url(owner)}/ws/{telegram_id}?{websocket.url.query}"
+        await websocket.send_json({"event": "redirect", "data": {"url": url}})
+        await websocket.close()
+        return
+
+    await manager.connect(websocket, telegram_id, criteria, resume)
+    await shards.claim(telegram_id)
+    limiter = Limiter(manager.clock)
     try:
         while True:
-            data = await websocket.receive_json()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+            if (data := limiter.admit(message.get("text") or message.get("bytes"))) is None:
+                if limiter.abusive:
+                    await websocket.close(status.WS_1008_POLICY_VIOLATION)
+                    break
+                continue
             method = data.pop('event')
             data['player'] = websocket.player
-            if method in public_methods:
-                try:
-                    await getattr(websocket.game, method)(**data)
-                except ValueError as e:
-                    await websocket.send_json({'error': str(e)})
+            # the player's current table, which a tournament may have moved them to
+            game = games_by_player.get(telegram_id) or websocket.game
+            if method in COALESCED:
+                future = game.submit_latest(method, **data)
+            else:
+                future = game.submit(method, **data)
+            future.add_done_callback(partial(report_error, telegram_id))
     except WebSocketDisconnect:
+        pass
+    except RuntimeError:
+        # the writer task saw the socket die before the receive loop did
+        if websocket.application_state != WebSocketState.DISCONNECTED:
+            raise
+    finally:
+        # the player stays on this worker until their session ends
         await manager.disconnect(websocket)
\ No newline at end of file